@@ -0,0 +1,80 @@
+"""
+Benchmark: inicios de sesión por segundo con scrypt concurrente
+Uso: python -m benchmarks.bench_contrasenas [logins] [concurrencia] [costo]
+
+Compara tres formas de verificar la contraseña en un login simulado (una
+lectura a la base de ~2 ms + verificación): SHA-256 legado en el loop,
+scrypt en el loop (lo que pasaría cambiando solo la función de hash) y
+scrypt en el pool de ContrasenasService. Además del rendimiento mide el
+retraso máximo del event loop, que es lo que sufren las demás peticiones.
+"""
+import sys
+import time
+import asyncio
+
+from models.auth import hash_password, hash_password_legado, verificar_password
+from services.contrasenas_service import ContrasenasService, calibrar_costo, OBJETIVO_HASH_MS
+
+LATENCIA_BASE_DATOS = 0.002
+PASSWORD = "Contraseña123"
+
+async def medir_retraso(detener: asyncio.Event) -> float:
+    """Retraso máximo del loop: cuánto tarda en despertar un sleep de 1 ms"""
+    maximo = 0.0
+    while not detener.is_set():
+        inicio = time.perf_counter()
+        await asyncio.sleep(0.001)
+        maximo = max(maximo, time.perf_counter() - inicio - 0.001)
+    return maximo
+
+async def ejecutar(verificar, logins: int, concurrencia: int):
+    """(logins por segundo, retraso máximo del loop) de `logins` inicios de sesión"""
+    cupos = asyncio.Semaphore(concurrencia)
+
+    async def login():
+        async with cupos:
+            await asyncio.sleep(LATENCIA_BASE_DATOS)  # find_one del usuario
+            assert await verificar()
+
+    detener = asyncio.Event()
+    retraso = asyncio.create_task(medir_retraso(detener))
+    inicio = time.perf_counter()
+    await asyncio.gather(*(login() for _ in range(logins)))
+    segundos = time.perf_counter() - inicio
+    detener.set()
+    return logins / segundos, await retraso
+
+async def principal(logins: int, concurrencia: int, costo: int):
+    hash_legado = hash_password_legado(PASSWORD)
+    hash_scrypt = hash_password(PASSWORD, costo)
+    servicio = ContrasenasService(costo=costo)
+    await servicio.iniciar()
+
+    async def legado_en_loop():
+        return verificar_password(PASSWORD, hash_legado)
+
+    async def scrypt_en_loop():
+        return verificar_password(PASSWORD, hash_scrypt)
+
+    async def scrypt_en_pool():
+        valida, _ = await servicio.verificar(PASSWORD, hash_scrypt)
+        return valida
+
+    print(f"Logins: {logins}, concurrencia: {concurrencia}, scrypt N=2^{costo}, hilos: {servicio.hilos}")
+    for nombre, verificar in (
+        ("SHA-256 legado, en el loop", legado_en_loop),
+        ("scrypt en el loop", scrypt_en_loop),
+        ("scrypt en el pool", scrypt_en_pool),
+    ):
+        por_segundo, retraso = await ejecutar(verificar, logins, concurrencia)
+        print(f"{nombre:<28} {por_segundo:>9,.1f} logins/s   retraso máx. del loop {retraso * 1000:>8.1f} ms")
+    servicio.detener()
+
+def main():
+    logins = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    concurrencia = int(sys.argv[2]) if len(sys.argv) > 2 else 32
+    costo = int(sys.argv[3]) if len(sys.argv) > 3 else calibrar_costo(OBJETIVO_HASH_MS / 1000)
+    asyncio.run(principal(logins, concurrencia, costo))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+"""
+Benchmark: cálculo de envío por lotes (NumPy) vs. bucle escalar
+Uso: python -m benchmarks.bench_envio_lote [cantidad]
+"""
+import sys
+import random
+import time
+
+from services.envio_service import (
+    RESTAURANT_LAT, RESTAURANT_LON, DISTANCIA_LIMITE_KM,
+    COSTO_ENVIO_CERCA, COSTO_ENVIO_LEJOS,
+    calcular_distancia_haversine, calcular_costos_envio_lote
+)
+
+def generar_coordenadas(cantidad: int):
+    """Genera coordenadas aleatorias alrededor de Santiago (~30 km)"""
+    random.seed(42)
+    latitudes = [RESTAURANT_LAT + random.uniform(-0.3, 0.3) for _ in range(cantidad)]
+    longitudes = [RESTAURANT_LON + random.uniform(-0.3, 0.3) for _ in range(cantidad)]
+    return latitudes, longitudes
+
+def escalar(latitudes, longitudes):
+    """Equivalente al recálculo actual: una llamada escalar por usuario"""
+    costos = []
+    for lat, lon in zip(latitudes, longitudes):
+        distancia = calcular_distancia_haversine(RESTAURANT_LAT, RESTAURANT_LON, lat, lon)
+        costos.append(COSTO_ENVIO_CERCA if distancia <= DISTANCIA_LIMITE_KM else COSTO_ENVIO_LEJOS)
+    return costos
+
+def medir(funcion, *args, repeticiones: int = 5) -> float:
+    """Retorna el mejor tiempo (en segundos) de varias repeticiones"""
+    mejor = float("inf")
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        funcion(*args)
+        mejor = min(mejor, time.perf_counter() - inicio)
+    return mejor
+
+def main():
+    cantidad = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    latitudes, longitudes = generar_coordenadas(cantidad)
+
+    # Ambos métodos deben dar los mismos costos
+    assert escalar(latitudes, longitudes) == calcular_costos_envio_lote(latitudes, longitudes)["costo"].tolist()
+
+    t_escalar = medir(escalar, latitudes, longitudes)
+    t_lote = medir(calcular_costos_envio_lote, latitudes, longitudes)
+
+    print(f"Coordenadas: {cantidad}")
+    print(f"Escalar: {t_escalar * 1000:.2f} ms ({cantidad / t_escalar:,.0f} por segundo)")
+    print(f"Lote:    {t_lote * 1000:.2f} ms ({cantidad / t_lote:,.0f} por segundo)")
+    print(f"Aceleración: {t_escalar / t_lote:.1f}x")
+
+if __name__ == "__main__":
+    main()
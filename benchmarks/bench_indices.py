@@ -0,0 +1,122 @@
+"""
+Benchmark: plan de consulta con y sin los índices de repositories/indices.py
+Requiere un mongod local. Usa una base de datos aparte que se borra al final.
+Uso: python -m benchmarks.bench_indices [cantidad_usuarios]
+"""
+import os
+import sys
+import time
+import random
+import datetime
+
+from bson import ObjectId
+from pymongo import MongoClient
+
+from repositories.indices import INDICES
+
+MONGO_URL = os.getenv("MONGO_URL", "mongodb://localhost:27017")
+BASE_BENCH = "tienda_bench_indices"
+
+def poblar(db, cantidad_usuarios: int):
+    """Crea usuarios, carritos, favoritos, órdenes y tokens sintéticos"""
+    random.seed(7)
+    ahora = datetime.datetime.now(datetime.timezone.utc)
+    db.usuarios.insert_many([
+        {"correo": f"usuario{i}@example.com", "rut": f"{10000000 + i}-{i % 10}", "nombres": f"Usuario {i}"}
+        for i in range(cantidad_usuarios)
+    ])
+    db.carritos.insert_many([
+        {"_id": f"usuario{i}@example.com",
+         "items": [{"_id": ObjectId(), "nombre": f"Producto {random.randrange(200)}", "precio": 1000, "cantidad": 1}
+                   for _ in range(3)]}
+        for i in range(cantidad_usuarios)
+    ])
+    db.favoritos.insert_many([
+        {"usuario_email": f"usuario{random.randrange(cantidad_usuarios)}@example.com",
+         "nombre": f"Producto {random.randrange(200)}", "precio": 1000, "categoria": "Postres"}
+        for _ in range(cantidad_usuarios * 2)
+    ])
+    db.ordenes.insert_many([
+        {"usuario_email": f"usuario{random.randrange(cantidad_usuarios)}@example.com",
+         "fecha_creacion": (ahora - datetime.timedelta(minutes=i)).isoformat(),
+         "total": random.randrange(1000, 50000), "estado": "pagado"}
+        for i in range(cantidad_usuarios * 5)
+    ])
+    db.tokens_recuperacion.insert_many([
+        {"correo": f"usuario{i}@example.com", "token": f"token-{i}",
+         "expiracion": ahora + datetime.timedelta(hours=1), "usado": False}
+        for i in range(cantidad_usuarios)
+    ])
+
+def consultas(db, cantidad_usuarios: int):
+    """Consultas representativas de main.py: (descripción, colección, filtro, orden)"""
+    i = cantidad_usuarios // 2
+    correo = f"usuario{i}@example.com"
+    item_carrito = db.carritos.find_one({"_id": correo})["items"][0]["_id"]
+    return [
+        ("usuarios por correo", "usuarios", {"correo": correo}, None),
+        ("usuarios por rut", "usuarios", {"rut": f"{10000000 + i}-{i % 10}"}, None),
+        ("dueño de un item del carrito", "carritos", {"items._id": item_carrito}, None),
+        ("favorito por usuario y nombre", "favoritos", {"usuario_email": correo, "nombre": "Producto 5"}, None),
+        ("órdenes de un usuario por fecha", "ordenes", {"usuario_email": correo}, [("fecha_creacion", -1), ("_id", -1)]),
+        ("todas las órdenes por fecha (100)", "ordenes", {}, [("fecha_creacion", -1), ("_id", -1)]),
+        ("token de recuperación", "tokens_recuperacion", {"token": f"token-{i}"}, None),
+    ]
+
+def etapas(plan: dict) -> str:
+    """Resume el plan ganador como cadena de etapas, p. ej. FETCH > IXSCAN"""
+    # Con el motor SBE (MongoDB 7+) el plan viene anidado en "queryPlan"
+    plan = plan.get("queryPlan", plan)
+    nombres = []
+    while plan:
+        nombres.append(plan["stage"])
+        plan = plan.get("inputStage") or (plan.get("inputStages") or [None])[0]
+    return " > ".join(nombres)
+
+def explicar(db, coleccion: str, filtro: dict, orden) -> dict:
+    cursor = db[coleccion].find(filtro)
+    if orden:
+        cursor = cursor.sort(orden).limit(100)
+    explicacion = cursor.explain()
+    estadisticas = explicacion["executionStats"]
+    return {
+        "plan": etapas(explicacion["queryPlanner"]["winningPlan"]),
+        "docs": estadisticas["totalDocsExamined"],
+        "claves": estadisticas["totalKeysExamined"],
+    }
+
+def medir(db, coleccion: str, filtro: dict, orden, repeticiones: int = 50) -> float:
+    """Tiempo promedio en milisegundos de la consulta completa"""
+    inicio = time.perf_counter()
+    for _ in range(repeticiones):
+        cursor = db[coleccion].find(filtro)
+        if orden:
+            cursor = cursor.sort(orden).limit(100)
+        list(cursor)
+    return (time.perf_counter() - inicio) * 1000 / repeticiones
+
+def main():
+    cantidad_usuarios = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    cliente = MongoClient(MONGO_URL)
+    cliente.drop_database(BASE_BENCH)
+    db = cliente[BASE_BENCH]
+
+    try:
+        print(f"Poblando {BASE_BENCH} con {cantidad_usuarios} usuarios...")
+        poblar(db, cantidad_usuarios)
+        lista = consultas(db, cantidad_usuarios)
+
+        antes = [(explicar(db, c, f, o), medir(db, c, f, o)) for _, c, f, o in lista]
+        for coleccion, indices in INDICES.items():
+            db[coleccion].create_indexes(indices)
+        despues = [(explicar(db, c, f, o), medir(db, c, f, o)) for _, c, f, o in lista]
+
+        for (descripcion, *_), (plan_a, ms_a), (plan_d, ms_d) in zip(lista, antes, despues):
+            print(f"\n{descripcion}")
+            print(f"  sin índices: {plan_a['plan']:<28} docs={plan_a['docs']:<8} claves={plan_a['claves']:<8} {ms_a:.2f} ms")
+            print(f"  con índices: {plan_d['plan']:<28} docs={plan_d['docs']:<8} claves={plan_d['claves']:<8} {ms_d:.2f} ms")
+    finally:
+        cliente.drop_database(BASE_BENCH)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+"""
+Benchmark: lectura de listados como dict (decodificación completa) vs.
+RawBSONDocument + extraer_campos (LECTURA_BSON_CRUDO=1)
+Uso: python -m benchmarks.bench_lectura_cruda [cantidad]
+
+Simula lo que hace el driver con cada lote recibido: los documentos llegan
+como bytes BSON concatenados y se decodifican con el document_class de la
+colección. Se mide memoria (tracemalloc) y documentos por segundo de
+decodificar + serializar + codificar la respuesta.
+"""
+import sys
+import time
+import random
+import tracemalloc
+from datetime import datetime, timedelta
+
+import bson
+from bson import ObjectId
+from bson.codec_options import CodecOptions
+from bson.raw_bson import RawBSONDocument
+
+from models.codificacion import codificar_json
+from models.serializers import (
+    serializar_producto, serializar_orden_resumen, PROYECCION_PRODUCTO, PROYECCION_ORDEN_RESUMEN
+)
+
+COMO_DICT = CodecOptions(document_class=dict)
+COMO_CRUDO = CodecOptions(document_class=RawBSONDocument)
+CATEGORIAS = ["Pizzas", "Hamburguesas", "Bebidas", "Postres", "Ensaladas"]
+
+def generar_productos(cantidad: int) -> list:
+    """Productos con los campos del serializador y otros que no emite"""
+    return [
+        {
+            "_id": ObjectId(),
+            "nombre": f"Producto {i}",
+            "precio": random.randint(1000, 20000),
+            "categoria": random.choice(CATEGORIAS),
+            "imagen": f"https://cdn.ejemplo.cl/productos/{i}.jpg",
+            "estado": "Disponible",
+            "descripcion": "Lorem ipsum dolor sit amet " * 8,
+            "ingredientes": [f"ingrediente {j}" for j in range(10)],
+            "creado_por": "admin@ejemplo.cl",
+        }
+        for i in range(cantidad)
+    ]
+
+def generar_ordenes(cantidad: int) -> list:
+    """Órdenes completas (el listado solo emite parte de cada una)"""
+    inicio = datetime(2024, 1, 1)
+    return [
+        {
+            "_id": ObjectId(), "usuario_email": f"u{i % 500}@ejemplo.cl",
+            "productos": [
+                {"nombre": f"Producto {j}", "precio": 5000, "cantidad": 2, "imagen": f"https://cdn.ejemplo.cl/{j}.jpg"}
+                for j in range(3)
+            ],
+            "subtotal": 30000, "descuento": 0, "envio": 2000, "total": 32000, "estado": "pagado",
+            "medio_pago_id": ObjectId(), "metodo_pago_usado": "tarjeta_guardada",
+            "fecha_creacion": (inicio + timedelta(minutes=i)).isoformat(),
+            "fecha_pago": (inicio + timedelta(minutes=i + 1)).isoformat(), "fecha_cancelacion": "",
+            "cupon_codigo": "", "cupones": [], "direccion_envio": f"Calle {i} 123, Santiago",
+            "distancia_km": 4.2, "dentro_radio_envio": True,
+        }
+        for i in range(cantidad)
+    ]
+
+def proyectar(documento: dict, proyeccion: dict) -> dict:
+    """Lo que devuelve MongoDB con la proyección (las rutas con punto recortan subdocumentos)"""
+    resultado = {"_id": documento["_id"]}
+    for ruta in proyeccion:
+        campo, _, subcampo = ruta.partition(".")
+        if campo not in documento:
+            continue
+        if not subcampo:
+            resultado[campo] = documento[campo]
+        else:
+            actual = resultado.setdefault(campo, [{} for _ in documento[campo]])
+            for destino, origen in zip(actual, documento[campo]):
+                if subcampo in origen:
+                    destino[subcampo] = origen[subcampo]
+    return resultado
+
+def en_lotes(documentos: list, tamano: int = 1000) -> list:
+    """Bytes BSON concatenados en lotes, como las respuestas de getMore del servidor"""
+    return [b"".join(bson.encode(d) for d in documentos[i:i + tamano]) for i in range(0, len(documentos), tamano)]
+
+def decodificar(lotes: list, opciones: CodecOptions) -> list:
+    documentos = []
+    for lote in lotes:
+        documentos.extend(bson.decode_all(lote, opciones))
+    return documentos
+
+def responder(lotes: list, opciones: CodecOptions, serializador) -> bytes:
+    """Ruta completa de un listado: decodificar, serializar y codificar"""
+    return codificar_json([serializador(d) for d in decodificar(lotes, opciones)])
+
+def memoria(funcion, *args):
+    """(bytes retenidos por el resultado, pico de memoria) de una llamada"""
+    tracemalloc.start()
+    resultado = funcion(*args)
+    retenido, pico = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del resultado
+    return retenido, pico
+
+def medir(funcion, *args, repeticiones: int = 3) -> float:
+    """Retorna el mejor tiempo (en segundos) de varias repeticiones"""
+    mejor = float("inf")
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        funcion(*args)
+        mejor = min(mejor, time.perf_counter() - inicio)
+    return mejor
+
+def mb(cantidad_bytes: int) -> str:
+    return f"{cantidad_bytes / 1024 / 1024:8.1f} MB"
+
+def main():
+    cantidad = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    random.seed(42)
+    productos = generar_productos(cantidad)
+    ordenes = generar_ordenes(cantidad)
+    escenarios = [
+        ("productos, proyectados", [proyectar(p, PROYECCION_PRODUCTO) for p in productos], serializar_producto),
+        ("productos, completos", productos, serializar_producto),
+        ("órdenes, proyectadas", [proyectar(o, PROYECCION_ORDEN_RESUMEN) for o in ordenes], serializar_orden_resumen),
+        ("órdenes, completas", ordenes, serializar_orden_resumen),
+    ]
+
+    print(f"Documentos por escenario: {cantidad}")
+    for nombre, documentos, serializador in escenarios:
+        lotes = en_lotes(documentos)
+        # Ambos modos deben producir la misma respuesta
+        assert responder(lotes, COMO_DICT, serializador) == responder(lotes, COMO_CRUDO, serializador)
+
+        print(f"\n{nombre} ({mb(sum(map(len, lotes))).strip()} de BSON)")
+        for modo, opciones in (("dict", COMO_DICT), ("crudo", COMO_CRUDO)):
+            retenido, _ = memoria(decodificar, lotes, opciones)
+            _, pico = memoria(responder, lotes, opciones, serializador)
+            segundos = medir(responder, lotes, opciones, serializador)
+            print(f"  {modo:<6} documentos en memoria {mb(retenido)}  pico de la respuesta {mb(pico)}  "
+                  f"{cantidad / segundos:>10,.0f} docs/s")
+
+if __name__ == "__main__":
+    main()
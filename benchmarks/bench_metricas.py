@@ -0,0 +1,106 @@
+"""
+Benchmark: costo de la instrumentación de /metrics
+Uso: python -m benchmarks.bench_metricas [peticiones] [comandos_por_peticion]
+
+Mide por separado lo que agrega la instrumentación a cada petición y lo
+compara con lo que cuesta atenderla:
+- MiddlewareMetricas alrededor de una app ASGI mínima vs. la app sola (así la
+  diferencia no se pierde en la variación del resto del stack);
+- el listener por comando de MongoDB (started + succeeded);
+- una petición completa de FastAPI que serializa 20 productos, llamada como
+  ASGI sin red, con la latencia de la base en cero: el peor caso. Con un
+  round trip real a MongoDB (~0,2-1 ms por comando) la fracción es menor.
+"""
+import sys
+import time
+import types
+import asyncio
+
+from bson import ObjectId
+from fastapi import FastAPI
+
+from models.codificacion import RespuestaJSON, codificar_json
+from models.serializers import serializar_producto
+from models.metricas import MiddlewareMetricas, escucha_mongo, registro
+
+PRODUCTOS = [
+    {"_id": ObjectId(), "nombre": f"Producto {i}", "precio": 1000 + i, "categoria": "Pizzas",
+     "imagen": f"https://cdn.ejemplo.cl/productos/{i}.jpg", "estado": "Disponible"}
+    for i in range(20)
+]
+
+def crear_app() -> FastAPI:
+    app = FastAPI(default_response_class=RespuestaJSON)
+
+    @app.get("/productos/{categoria}")
+    async def productos(categoria: str):
+        return RespuestaJSON(codificar_json([serializar_producto(p) for p in PRODUCTOS]))
+    return app
+
+class _Ruta:
+    path = "/productos/{categoria}"
+
+async def app_minima(scope, receive, send):
+    """Lo mínimo que hace el router: fijar la ruta y responder"""
+    scope["route"] = _Ruta
+    await send({"type": "http.response.start", "status": 200, "headers": []})
+    await send({"type": "http.response.body", "body": b"[]"})
+
+def _scope() -> dict:
+    return {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET",
+        "scheme": "http", "path": "/productos/Pizzas", "raw_path": b"/productos/Pizzas",
+        "query_string": b"", "root_path": "", "headers": [(b"host", b"localhost")],
+        "client": ("127.0.0.1", 5000), "server": ("localhost", 8000),
+    }
+
+async def _recibir():
+    return {"type": "http.request", "body": b"", "more_body": False}
+
+async def _enviar(mensaje):
+    pass
+
+async def medir(app, peticiones: int, rondas: int = 7) -> float:
+    """Microsegundos por petición (mejor ronda)"""
+    mejor = float("inf")
+    for _ in range(rondas):
+        inicio = time.perf_counter()
+        for _ in range(peticiones):
+            await app(_scope(), _recibir, _enviar)
+        mejor = min(mejor, (time.perf_counter() - inicio) / peticiones)
+    return mejor * 1e6
+
+def medir_listener(repeticiones: int = 200000) -> float:
+    """Microsegundos por comando en el listener (started + succeeded)"""
+    evento = types.SimpleNamespace(
+        command={"find": "productos"}, command_name="find",
+        connection_id=("localhost", 27017), request_id=1, duration_micros=400
+    )
+    inicio = time.perf_counter()
+    for _ in range(repeticiones):
+        escucha_mongo.started(evento)
+        escucha_mongo.succeeded(evento)
+    return (time.perf_counter() - inicio) / repeticiones * 1e6
+
+async def principal(peticiones: int, comandos: int):
+    base = await medir(app_minima, peticiones * 10)
+    middleware = await medir(MiddlewareMetricas(app_minima), peticiones * 10) - base
+    listener = medir_listener()
+    peticion = await medir(crear_app(), peticiones)
+    sobrecosto = middleware + comandos * listener
+    print(f"{'middleware':<20} {middleware:>8.2f} µs/petición")
+    print(f"{'listener':<20} {listener:>8.2f} µs/comando")
+    print(f"{'petición FastAPI':<20} {peticion:>8.1f} µs (20 productos, sin latencia de base)")
+    print(f"Sobrecosto con {comandos} comandos: {sobrecosto:.1f} µs ({sobrecosto / peticion * 100:.1f}% en el peor caso; "
+          f"{sobrecosto / (peticion + comandos * 300) * 100:.1f}% con 0,3 ms por comando)")
+    inicio = time.perf_counter()
+    texto = registro.exportar()
+    print(f"{'exportar /metrics':<20} {(time.perf_counter() - inicio) * 1e3:>8.2f} ms ({len(texto.splitlines())} líneas)")
+
+def main():
+    peticiones = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    comandos = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+    asyncio.run(principal(peticiones, comandos))
+
+if __name__ == "__main__":
+    main()
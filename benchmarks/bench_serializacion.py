@@ -0,0 +1,142 @@
+"""
+Benchmark: serialización de respuestas (jsonable_encoder + json) vs. codificar_json,
+y decodificación BSON de documentos completos vs. proyectados
+Uso: python -m benchmarks.bench_serializacion [cantidad]
+"""
+import sys
+import json
+import random
+import time
+from datetime import datetime, timedelta
+
+import bson
+from bson import ObjectId
+from fastapi.encoders import jsonable_encoder
+
+from models.codificacion import codificar_json, orjson
+from models.auth import es_super_usuario
+from models.serializers import (
+    serializar_producto, serializar_carrito, serializar_favorito, serializar_usuario, serializar_orden,
+    PROYECCION_PRODUCTO, PROYECCION_FAVORITO, PROYECCION_USUARIO, PROYECCION_ORDEN
+)
+
+CATEGORIAS = ["Pizzas", "Hamburguesas", "Bebidas", "Postres", "Ensaladas"]
+
+def _producto(i: int) -> dict:
+    return {
+        "_id": ObjectId(),
+        "nombre": f"Producto {i}",
+        "precio": random.randint(1000, 20000),
+        "categoria": random.choice(CATEGORIAS),
+        "imagen": f"https://cdn.ejemplo.cl/productos/{i}.jpg",
+        "estado": "Disponible",
+        # Campos que guarda la colección pero no emite el serializador
+        "descripcion": "Lorem ipsum dolor sit amet " * 8,
+        "ingredientes": [f"ingrediente {j}" for j in range(10)],
+        "creado_por": "admin@ejemplo.cl",
+    }
+
+def generar_documentos(cantidad: int) -> dict:
+    """Documentos sintéticos con la forma de cada colección (incluye campos no serializados)"""
+    random.seed(42)
+    ahora = datetime(2024, 1, 1)
+    productos = [_producto(i) for i in range(cantidad)]
+    carrito = [
+        {**p, "producto_id": str(p["_id"]), "_id": ObjectId(), "usuario_email": f"u{i % 500}@ejemplo.cl",
+         "cantidad": random.randint(1, 5), "aplicadas": [f"op-{j}" for j in range(5)]}
+        for i, p in enumerate(productos)
+    ]
+    favoritos = [
+        {**p, "producto_id": str(p["_id"]), "_id": ObjectId(), "usuario_email": f"u{i % 500}@ejemplo.cl"}
+        for i, p in enumerate(productos)
+    ]
+    usuarios = [
+        {
+            "_id": ObjectId(), "nombres": f"Nombre {i}", "apellidos": f"Apellido {i}", "rut": f"{i}-K",
+            "domicilio": f"Calle {i} 123, Santiago", "correo": f"u{i}@ejemplo.cl", "telefono": "+56911111111",
+            "usuario": f"usuario{i}", "imagen_perfil": "", "latitud": -33.45, "longitud": -70.66,
+            "password": "x" * 64,
+            "medios_pago": [{"_id": ObjectId(), "tipo": "tarjeta", "ultimos_digitos": "1234"} for _ in range(3)],
+        }
+        for i in range(cantidad)
+    ]
+    ordenes = [
+        {
+            "_id": ObjectId(), "usuario_email": f"u{i % 500}@ejemplo.cl",
+            "productos": [
+                {"nombre": p["nombre"], "precio": p["precio"], "cantidad": 2, "imagen": p["imagen"]}
+                for p in random.sample(productos[:200], 3)
+            ],
+            "subtotal": 30000, "descuento": 0, "envio": 2000, "total": 32000, "estado": "pagado",
+            "medio_pago_id": ObjectId(), "metodo_pago_usado": "tarjeta_guardada",
+            "fecha_creacion": (ahora + timedelta(minutes=i)).isoformat(),
+            "fecha_pago": (ahora + timedelta(minutes=i + 1)).isoformat(), "fecha_cancelacion": "",
+            "cupon_codigo": "", "cupones": [], "direccion_envio": f"Calle {i} 123, Santiago",
+            "distancia_km": 4.2, "dentro_radio_envio": True,
+        }
+        for i in range(cantidad)
+    ]
+    return {
+        "producto": (productos, serializar_producto, PROYECCION_PRODUCTO),
+        "carrito": (carrito, serializar_carrito, None),
+        "favorito": (favoritos, serializar_favorito, PROYECCION_FAVORITO),
+        "usuario": (usuarios, lambda u: serializar_usuario(u, es_super_usuario), PROYECCION_USUARIO),
+        "orden": (ordenes, serializar_orden, PROYECCION_ORDEN),
+    }
+
+def ruta_anterior(documentos, serializador) -> bytes:
+    """Respuesta por defecto de FastAPI: serializador + jsonable_encoder + json.dumps"""
+    contenido = jsonable_encoder([serializador(d) for d in documentos], custom_encoder={ObjectId: str})
+    return json.dumps(contenido, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+def ruta_rapida(documentos, serializador) -> bytes:
+    """RespuestaJSON: serializador + codificar_json (convierte ObjectId y fechas al codificar)"""
+    return codificar_json([serializador(d) for d in documentos])
+
+def proyectar(documento: dict, proyeccion: dict) -> dict:
+    """Lo que devolvería MongoDB con la proyección (solo campos de primer nivel)"""
+    return {campo: valor for campo, valor in documento.items() if campo == "_id" or campo in proyeccion}
+
+def decodificar(crudos: list):
+    """Costo de decodificar BSON, como lo hace el driver al recibir un lote"""
+    for crudo in crudos:
+        bson.decode(crudo)
+
+def medir(funcion, *args, repeticiones: int = 5) -> float:
+    """Retorna el mejor tiempo (en segundos) de varias repeticiones"""
+    mejor = float("inf")
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        funcion(*args)
+        mejor = min(mejor, time.perf_counter() - inicio)
+    return mejor
+
+def main():
+    cantidad = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    colecciones = generar_documentos(cantidad)
+
+    print(f"Documentos por serializador: {cantidad} (codificador: {'orjson' if orjson else 'json'})")
+    print(f"{'serializador':<12} {'anterior':>12} {'rápida':>12} {'aceleración':>12}")
+    for nombre, (documentos, serializador, _) in colecciones.items():
+        # Ambas rutas deben producir el mismo JSON
+        assert json.loads(ruta_anterior(documentos, serializador)) == json.loads(ruta_rapida(documentos, serializador))
+        t_anterior = medir(ruta_anterior, documentos, serializador)
+        t_rapida = medir(ruta_rapida, documentos, serializador)
+        print(f"{nombre:<12} {t_anterior * 1000:>9.2f} ms {t_rapida * 1000:>9.2f} ms {t_anterior / t_rapida:>11.1f}x")
+
+    print()
+    print(f"{'proyección':<12} {'completo':>22} {'proyectado':>22}")
+    for nombre, (documentos, _, proyeccion) in colecciones.items():
+        if proyeccion is None:
+            continue
+        completos = [bson.encode(d) for d in documentos]
+        proyectados = [bson.encode(proyectar(d, proyeccion)) for d in documentos]
+        t_completo = medir(decodificar, completos)
+        t_proyectado = medir(decodificar, proyectados)
+        kb_completo = sum(map(len, completos)) / 1024
+        kb_proyectado = sum(map(len, proyectados)) / 1024
+        print(f"{nombre:<12} {t_completo * 1000:>7.2f} ms {kb_completo:>8.0f} KB "
+              f"{t_proyectado * 1000:>7.2f} ms {kb_proyectado:>8.0f} KB")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,10 @@
+"""
+Prueba de carga de la API contra un mongod local
+Uso: python -m benchmarks.carga [--escala 10000] [--usuarios-virtuales 50] [--duracion 30] [--salida reporte.json]
+
+Puebla una base aparte (semilla.py), levanta un Nominatim falso
+(nominatim_falso.py) y el servidor con uvicorn apuntando a ambos, y corre
+compradores asíncronos (generador.py). El reporte JSON trae peticiones por
+segundo y p50/p95/p99 por endpoint; --comparar muestra el cambio respecto
+de un reporte anterior.
+"""
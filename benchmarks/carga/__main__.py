@@ -0,0 +1,133 @@
+"""
+Punto de entrada de la prueba de carga (ver benchmarks/carga/__init__.py)
+Con --url se mide un servidor ya iniciado; debe usar la misma base
+(MONGO_BASE), SESION_SECRETO igual a --secreto y NOMINATIM_URL apuntando a
+un Nominatim falso (python -m benchmarks.carga.nominatim_falso 8090).
+"""
+import os
+import sys
+import json
+import time
+import socket
+import asyncio
+import argparse
+import platform
+
+import httpx
+
+from benchmarks.carga import generador, semilla
+from benchmarks.carga.nominatim_falso import NominatimFalso
+
+ESPERA_MAXIMA_SERVIDOR = 120.0
+
+def _puerto_libre() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def _argumentos():
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.carga", description="Prueba de carga de la API")
+    parser.add_argument("--escala", type=int, default=10000, help="usuarios y órdenes a sembrar (1000 a 1000000)")
+    parser.add_argument("--sin-semilla", action="store_true", help="reutilizar la base ya poblada")
+    parser.add_argument("--mongo-url", default=os.getenv("MONGO_URL", "mongodb://localhost:27017"))
+    parser.add_argument("--base", default="tienda_carga", help="base de datos de la prueba (se borra al sembrar)")
+    parser.add_argument("--url", help="servidor ya iniciado; sin esto se levanta uno con uvicorn")
+    parser.add_argument("--secreto", default="secreto-prueba-de-carga", help="SESION_SECRETO del servidor")
+    parser.add_argument("--usuarios-virtuales", type=int, default=50)
+    parser.add_argument("--duracion", type=float, default=30.0, help="segundos medidos")
+    parser.add_argument("--calentamiento", type=float, default=5.0, help="segundos de carga previa sin medir")
+    parser.add_argument("--pausa", type=float, default=0.0, help="segundos entre recorridos de un usuario virtual")
+    parser.add_argument("--latencia-nominatim", type=float, default=0.05)
+    parser.add_argument("--semilla", type=int, default=42)
+    parser.add_argument("--salida", help="archivo del reporte JSON (por defecto, la salida estándar)")
+    parser.add_argument("--comparar", help="reporte JSON anterior contra el cual comparar")
+    return parser.parse_args()
+
+async def _iniciar_servidor(args, nominatim: NominatimFalso):
+    """Lanza uvicorn con la base y el Nominatim de la prueba; retorna (proceso, url)"""
+    puerto = _puerto_libre()
+    entorno = {
+        **os.environ,
+        "MONGO_URL": args.mongo_url,
+        "MONGO_BASE": args.base,
+        "NOMINATIM_URL": nominatim.url,
+        "SESION_SECRETO": args.secreto,
+    }
+    proceso = await asyncio.create_subprocess_exec(
+        sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(puerto),
+        "--log-level", "warning", "--no-access-log", env=entorno
+    )
+    url = f"http://127.0.0.1:{puerto}"
+    limite = time.monotonic() + ESPERA_MAXIMA_SERVIDOR
+    async with httpx.AsyncClient(base_url=url, timeout=5.0) as cliente:
+        while time.monotonic() < limite:
+            if proceso.returncode is not None:
+                raise RuntimeError(f"El servidor terminó al iniciar (código {proceso.returncode}); ¿está instalado uvicorn?")
+            try:
+                if (await cliente.get("/productos", params={"limite": 1})).status_code == 200:
+                    return proceso, url
+            except httpx.HTTPError:
+                pass
+            await asyncio.sleep(0.5)
+    proceso.terminate()
+    raise RuntimeError(f"El servidor no respondió en {ESPERA_MAXIMA_SERVIDOR:.0f} s")
+
+async def _detener_servidor(proceso):
+    if proceso.returncode is None:
+        proceso.terminate()
+        await proceso.wait()
+
+async def principal(args) -> dict:
+    reporte = {
+        "configuracion": {
+            "escala": args.escala, "base": args.base, "usuarios_virtuales": args.usuarios_virtuales,
+            "duracion": args.duracion, "calentamiento": args.calentamiento, "pausa": args.pausa,
+            "latencia_nominatim": args.latencia_nominatim, "semilla": args.semilla,
+            "python": platform.python_version(), "maquina": platform.machine(), "cpus": os.cpu_count(),
+        },
+        "inicio": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+    if not args.sin_semilla:
+        print(f"Sembrando {args.base} (escala {args.escala})...", file=sys.stderr)
+        reporte["semilla"] = await asyncio.to_thread(semilla.poblar, args.mongo_url, args.base, args.escala, args.semilla)
+
+    nominatim = NominatimFalso(latencia=args.latencia_nominatim)
+    await nominatim.iniciar()
+    proceso = None
+    try:
+        url = args.url
+        if url is None:
+            proceso, url = await _iniciar_servidor(args, nominatim)
+        usuarios = semilla.cantidades(args.escala)["usuarios"]
+        if args.calentamiento:
+            print(f"Calentamiento ({args.calentamiento:.0f} s)...", file=sys.stderr)
+            await generador.ejecutar(url, args.usuarios_virtuales, args.calentamiento, usuarios,
+                                     args.secreto, args.pausa, args.semilla)
+        print(f"Midiendo ({args.duracion:.0f} s, {args.usuarios_virtuales} usuarios virtuales)...", file=sys.stderr)
+        inicio = time.perf_counter()
+        registro = await generador.ejecutar(url, args.usuarios_virtuales, args.duracion, usuarios,
+                                            args.secreto, args.pausa, args.semilla + 1)
+        reporte.update(registro.reporte(time.perf_counter() - inicio))
+        reporte["nominatim_solicitudes"] = nominatim.solicitudes
+    finally:
+        if proceso is not None:
+            await _detener_servidor(proceso)
+        await nominatim.detener()
+    return reporte
+
+def main():
+    args = _argumentos()
+    reporte = asyncio.run(principal(args))
+    texto = json.dumps(reporte, indent=2, ensure_ascii=False)
+    if args.salida:
+        with open(args.salida, "w", encoding="utf-8") as archivo:
+            archivo.write(texto + "\n")
+    else:
+        print(texto)
+    if args.comparar:
+        with open(args.comparar, encoding="utf-8") as archivo:
+            anterior = json.load(archivo)
+        print("\n".join(generador.comparar(anterior, reporte)), file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,182 @@
+"""
+Generador de carga
+Usuarios virtuales asíncronos que repiten el recorrido de compra de la
+tienda (catálogo, carrito, orden y pago) contra el servidor, y el registro
+de latencias por endpoint con el que se arma el reporte JSON.
+"""
+import time
+import random
+import asyncio
+import secrets
+from collections import Counter, defaultdict
+
+import httpx
+
+from services.sesiones_service import firmar_token
+from benchmarks.carga.semilla import CATEGORIAS, correo_usuario, medio_pago_usuario
+
+PERCENTILES = (50, 95, 99)
+
+def percentil(ordenadas: list, p: float) -> float:
+    """Percentil por rango más cercano de una lista ya ordenada"""
+    if not ordenadas:
+        return 0.0
+    indice = max(0, min(len(ordenadas) - 1, round(p / 100 * len(ordenadas) + 0.5) - 1))
+    return ordenadas[indice]
+
+class RegistroLatencias:
+    """Latencias y códigos de estado por endpoint, y recorridos completados"""
+
+    def __init__(self):
+        self.latencias = defaultdict(list)
+        self.estados = defaultdict(Counter)
+        self.recorridos = Counter()
+
+    def anotar(self, endpoint: str, segundos: float, estado):
+        self.latencias[endpoint].append(segundos)
+        self.estados[endpoint][str(estado)] += 1
+
+    def reporte(self, duracion: float) -> dict:
+        endpoints = {}
+        for endpoint, latencias in sorted(self.latencias.items()):
+            ordenadas = sorted(latencias)
+            estados = self.estados[endpoint]
+            errores = sum(n for estado, n in estados.items() if not estado.isdigit() or int(estado) >= 400)
+            endpoints[endpoint] = {
+                "peticiones": len(ordenadas),
+                "errores": errores,
+                "por_segundo": round(len(ordenadas) / duracion, 2),
+                "media_ms": round(sum(ordenadas) / len(ordenadas) * 1000, 3),
+                **{f"p{p}_ms": round(percentil(ordenadas, p) * 1000, 3) for p in PERCENTILES},
+                "max_ms": round(ordenadas[-1] * 1000, 3),
+                "estados": dict(sorted(estados.items())),
+            }
+        total = sum(len(l) for l in self.latencias.values())
+        return {
+            "duracion_segundos": round(duracion, 2),
+            "peticiones_por_segundo": round(total / duracion, 2),
+            "recorridos": {
+                "completados": self.recorridos["completados"],
+                "fallidos": self.recorridos["fallidos"],
+                "por_segundo": round(self.recorridos["completados"] / duracion, 2),
+            },
+            "endpoints": endpoints,
+        }
+
+class UsuarioVirtual:
+    """
+    Un comprador: entra al catálogo (revalidando con ETag como el navegador),
+    filtra una categoría, agrega de 1 a 3 productos al carrito, crea la orden
+    con su medio de pago guardado y la paga, todo con su token de sesión.
+    """
+
+    def __init__(self, cliente: httpx.AsyncClient, registro: RegistroLatencias, secreto: bytes,
+                 azar: random.Random):
+        self.cliente = cliente
+        self.registro = registro
+        self.secreto = secreto
+        self.azar = azar
+        self.etag_catalogo = None
+        self.catalogo = []
+
+    async def _pedir(self, endpoint: str, metodo: str, url: str, **kwargs):
+        inicio = time.perf_counter()
+        try:
+            respuesta = await self.cliente.request(metodo, url, **kwargs)
+        except httpx.HTTPError as e:
+            self.registro.anotar(endpoint, time.perf_counter() - inicio, type(e).__name__)
+            return None
+        self.registro.anotar(endpoint, time.perf_counter() - inicio, respuesta.status_code)
+        return respuesta
+
+    def _token(self, correo: str) -> dict:
+        ahora = time.time()
+        token = firmar_token(
+            {"sub": correo, "sid": secrets.token_urlsafe(12), "iat": round(ahora, 3), "exp": int(ahora + 3600)},
+            self.secreto
+        )
+        return {"Authorization": f"Bearer {token}"}
+
+    async def recorrido(self, usuario: int) -> bool:
+        """Un recorrido de compra completo; retorna False si algún paso falló"""
+        correo = correo_usuario(usuario)
+        medio = str(medio_pago_usuario(usuario))
+        sesion = self._token(correo)
+
+        headers = {"If-None-Match": self.etag_catalogo} if self.etag_catalogo else {}
+        respuesta = await self._pedir("GET /productos", "GET", "/productos", headers=headers)
+        if respuesta is None or respuesta.status_code not in (200, 304):
+            return False
+        if respuesta.status_code == 200:
+            self.catalogo = [p for p in respuesta.json() if p.get("estado") == "Disponible"]
+            self.etag_catalogo = respuesta.headers.get("etag")
+
+        params = {"categoria": self.azar.choice(CATEGORIAS), "orden": "precio_asc", "limite": 20}
+        respuesta = await self._pedir("GET /productos?categoria", "GET", "/productos", params=params)
+        if respuesta is None or respuesta.status_code != 200:
+            return False
+
+        for producto in self.azar.sample(self.catalogo, self.azar.randint(1, 3)):
+            item = {
+                "usuario_email": correo, "producto_id": producto["_id"], "nombre": producto["nombre"],
+                "precio": producto["precio"], "imagen": producto.get("imagen", ""), "cantidad": self.azar.randint(1, 2),
+            }
+            respuesta = await self._pedir("POST /carrito", "POST", "/carrito", json=item)
+            if respuesta is None or respuesta.status_code != 200:
+                return False
+
+        respuesta = await self._pedir(
+            "POST /ordenes", "POST", "/ordenes",
+            json={"usuario_email": correo, "medio_pago_id": medio}, headers=sesion
+        )
+        if respuesta is None or respuesta.status_code != 200:
+            return False
+        orden_id = respuesta.json()["orden"]["_id"]
+
+        respuesta = await self._pedir(
+            "POST /ordenes/{id}/pagar", "POST", f"/ordenes/{orden_id}/pagar",
+            json={"medio_pago_id": medio, "metodo_pago": "tarjeta_guardada"}, headers=sesion
+        )
+        return respuesta is not None and respuesta.status_code == 200
+
+async def ejecutar(url_base: str, usuarios_virtuales: int, duracion: float, usuarios_disponibles: int,
+                   secreto: str, pausa: float = 0.0, semilla: int = 42) -> RegistroLatencias:
+    """
+    Corre `usuarios_virtuales` compradores en paralelo durante `duracion`
+    segundos (carga de lazo cerrado: cada uno empieza su siguiente recorrido
+    al terminar el anterior, tras `pausa` segundos). Cada usuario virtual
+    rota entre sus propios usuarios sembrados, así dos recorridos
+    simultáneos nunca comparten carrito.
+    """
+    registro = RegistroLatencias()
+    usuarios_virtuales = min(usuarios_virtuales, usuarios_disponibles)
+    fin = time.perf_counter() + duracion
+    limites = httpx.Limits(max_connections=usuarios_virtuales, max_keepalive_connections=usuarios_virtuales)
+
+    async with httpx.AsyncClient(base_url=url_base, limits=limites, timeout=30.0) as cliente:
+        async def comprador(numero: int):
+            virtual = UsuarioVirtual(cliente, registro, secreto.encode("utf-8"), random.Random(semilla + numero))
+            usuario = numero
+            while time.perf_counter() < fin:
+                completado = await virtual.recorrido(usuario)
+                registro.recorridos["completados" if completado else "fallidos"] += 1
+                usuario = (usuario + usuarios_virtuales) % usuarios_disponibles
+                if pausa:
+                    await asyncio.sleep(pausa)
+
+        await asyncio.gather(*(comprador(i) for i in range(usuarios_virtuales)))
+    return registro
+
+def comparar(anterior: dict, actual: dict) -> list:
+    """Líneas de texto con el cambio por endpoint (peticiones/s y percentiles) respecto de otro reporte"""
+    lineas = [f"{'endpoint':<28} {'métrica':<12} {'anterior':>10} {'actual':>10} {'cambio':>8}"]
+    for endpoint, datos in actual["endpoints"].items():
+        previos = anterior.get("endpoints", {}).get(endpoint)
+        if previos is None:
+            lineas.append(f"{endpoint:<28} (sin datos en el reporte anterior)")
+            continue
+        for metrica in ("por_segundo",) + tuple(f"p{p}_ms" for p in PERCENTILES):
+            antes, ahora = previos[metrica], datos[metrica]
+            cambio = f"{(ahora - antes) / antes * 100:+.1f}%" if antes else "-"
+            lineas.append(f"{endpoint:<28} {metrica:<12} {antes:>10.2f} {ahora:>10.2f} {cambio:>8}")
+    return lineas
@@ -0,0 +1,73 @@
+"""
+Nominatim falso
+Servidor HTTP/1.1 mínimo (asyncio, sin dependencias) que responde cualquier
+búsqueda con coordenadas en Santiago derivadas de la consulta, tras una
+latencia fija. Evita llamar al servicio real durante la prueba de carga.
+Uso aparte (para un servidor iniciado a mano): python -m benchmarks.carga.nominatim_falso [puerto]
+"""
+import sys
+import json
+import asyncio
+import hashlib
+from urllib.parse import urlsplit, parse_qs
+
+from benchmarks.carga.semilla import CENTRO_LAT, CENTRO_LON
+
+class NominatimFalso:
+    """Se inicia con `await iniciar()`; su URL de búsqueda queda en `url`"""
+
+    def __init__(self, latencia: float = 0.05, host: str = "127.0.0.1", puerto: int = 0):
+        self.latencia = latencia
+        self.host = host
+        self.puerto = puerto
+        self.url = None
+        self.solicitudes = 0
+        self._servidor = None
+
+    async def iniciar(self):
+        self._servidor = await asyncio.start_server(self._atender, self.host, self.puerto)
+        puerto = self._servidor.sockets[0].getsockname()[1]
+        self.url = f"http://{self.host}:{puerto}/search"
+
+    async def detener(self):
+        if self._servidor is not None:
+            self._servidor.close()
+            await self._servidor.wait_closed()
+            self._servidor = None
+
+    @staticmethod
+    def _coordenadas(consulta: str) -> list:
+        """Resultado determinista por dirección, a menos de ~10 km del centro"""
+        digest = hashlib.sha256(consulta.encode("utf-8")).digest()
+        lat = CENTRO_LAT + (digest[0] / 255 - 0.5) * 0.2
+        lon = CENTRO_LON + (digest[1] / 255 - 0.5) * 0.2
+        return [{"lat": f"{lat:.6f}", "lon": f"{lon:.6f}", "display_name": consulta}]
+
+    async def _atender(self, lector, escritor):
+        try:
+            while True:
+                encabezado = await lector.readuntil(b"\r\n\r\n")
+                linea = encabezado.split(b"\r\n", 1)[0].decode("latin-1")
+                ruta = linea.split(" ")[1] if " " in linea else "/"
+                consulta = parse_qs(urlsplit(ruta).query).get("q", [""])[0]
+                self.solicitudes += 1
+                await asyncio.sleep(self.latencia)
+                cuerpo = json.dumps(self._coordenadas(consulta)).encode("utf-8")
+                escritor.write(
+                    b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n"
+                    + f"Content-Length: {len(cuerpo)}\r\n\r\n".encode("ascii") + cuerpo
+                )
+                await escritor.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            escritor.close()
+
+async def _servir(puerto: int):
+    nominatim = NominatimFalso(puerto=puerto)
+    await nominatim.iniciar()
+    print(f"NOMINATIM_URL={nominatim.url}")
+    await asyncio.Event().wait()
+
+if __name__ == "__main__":
+    asyncio.run(_servir(int(sys.argv[1]) if len(sys.argv) > 1 else 8090))
@@ -0,0 +1,146 @@
+"""
+Datos sintéticos para la prueba de carga
+Puebla una base de MongoDB aparte con productos, usuarios (con medio de
+pago), carritos y órdenes a la escala pedida, con los índices de
+repositories/indices.py y los acumulados de analítica ya reconstruidos,
+para que el servidor no haga ese trabajo mientras se mide.
+Los correos e ids son deterministas: el generador los deriva del índice.
+"""
+import time
+import random
+import datetime
+
+from bson import ObjectId
+from pymongo import MongoClient
+
+from models.auth import hash_password
+from repositories.indices import INDICES
+from repositories.analitica_repository import PIPELINES_RECONSTRUCCION
+
+PASSWORD = "Carga12345"
+COSTO_HASH = 12  # Un solo hash compartido por todos: poblar 1M usuarios no debe tardar horas
+TAMANO_LOTE = 10000
+CATEGORIAS = ["Pizzas", "Hamburguesas", "Bebidas", "Postres", "Ensaladas", "Sushi", "Pastas", "Sándwiches"]
+CENTRO_LAT, CENTRO_LON = -33.4417, -70.6400
+FRACCION_SIN_COORDENADAS = 0.1  # Usuarios que solo tienen domicilio: se geocodifican (Nominatim falso)
+
+def correo_usuario(i: int) -> str:
+    return f"carga{i}@example.com"
+
+def medio_pago_usuario(i: int) -> ObjectId:
+    """Id del medio de pago del usuario i (determinista)"""
+    return ObjectId(f"{i:024x}")
+
+def cantidades(escala: int) -> dict:
+    """Documentos por colección para una escala dada (1k a 1M)"""
+    return {
+        "productos": min(max(escala // 100, 100), 10000),
+        "usuarios": escala,
+        "carritos": max(escala // 10, 1),
+        "ordenes": escala,
+    }
+
+def _en_lotes(db, coleccion: str, documentos):
+    lote = []
+    for documento in documentos:
+        lote.append(documento)
+        if len(lote) >= TAMANO_LOTE:
+            db[coleccion].insert_many(lote, ordered=False)
+            lote = []
+    if lote:
+        db[coleccion].insert_many(lote, ordered=False)
+
+def _productos(cantidad: int):
+    for i in range(cantidad):
+        yield {
+            "nombre": f"Producto {i}",
+            "precio": random.randrange(1000, 20000, 100),
+            "categoria": CATEGORIAS[i % len(CATEGORIAS)],
+            "imagen": f"https://cdn.example.com/productos/{i}.jpg",
+            "estado": "Disponible" if random.random() < 0.9 else "Agotado",
+            "descripcion": f"Descripción del producto {i}",
+        }
+
+def _usuarios(cantidad: int, password_hash: str):
+    for i in range(cantidad):
+        usuario = {
+            "nombres": f"Nombre {i}", "apellidos": f"Apellido {i}",
+            "rut": f"{10000000 + i}-{i % 10}", "correo": correo_usuario(i), "usuario": f"carga_{i}",
+            "telefono": "+56911111111", "domicilio": f"Avenida Carga {i}, Santiago",
+            "password_hash": password_hash,
+            "medios_pago": [{
+                "_id": medio_pago_usuario(i), "tipo": "tarjeta", "titular": f"Nombre {i}", "marca": "visa",
+                "vencimiento": "12/30", "numero_enmascarado": "**** **** **** 4242", "last4": "4242",
+            }],
+        }
+        if random.random() >= FRACCION_SIN_COORDENADAS:
+            usuario["latitud"] = CENTRO_LAT + random.uniform(-0.1, 0.1)
+            usuario["longitud"] = CENTRO_LON + random.uniform(-0.1, 0.1)
+        yield usuario
+
+def _item(producto: dict) -> dict:
+    return {
+        "_id": ObjectId(), "producto_id": str(producto["_id"]), "nombre": producto["nombre"],
+        "precio": producto["precio"], "imagen": producto["imagen"], "cantidad": random.randint(1, 3),
+    }
+
+def _carritos(cantidad: int, usuarios: int, productos: list):
+    # Los carritos son de los últimos usuarios: los recorridos usan los primeros
+    for i in range(usuarios - cantidad, usuarios):
+        yield {"_id": correo_usuario(i), "items": [_item(p) for p in random.sample(productos, 3)]}
+
+def _ordenes(cantidad: int, usuarios: int, productos: list):
+    ahora = datetime.datetime.now()
+    for i in range(cantidad):
+        items = [_item(p) for p in random.sample(productos, random.randint(1, 4))]
+        subtotal = sum(item["precio"] * item["cantidad"] for item in items)
+        creada = ahora - datetime.timedelta(minutes=random.randrange(60 * 24 * 180))
+        estado = random.choices(["pagado", "pendiente", "cancelado"], weights=[80, 10, 10])[0]
+        usuario = random.randrange(usuarios)
+        orden = {
+            "usuario_email": correo_usuario(usuario), "productos": items,
+            "subtotal": subtotal, "descuento": 0, "envio": 0, "total": subtotal,
+            "estado": estado, "medio_pago_id": medio_pago_usuario(usuario),
+            "fecha_creacion": creada.isoformat(), "cupones": [], "cupon_codigo": "",
+            "direccion_envio": f"Avenida Carga {usuario}, Santiago", "distancia_km": 3.2, "dentro_radio_envio": True,
+        }
+        if estado == "pagado":
+            orden["fecha_pago"] = (creada + datetime.timedelta(minutes=2)).isoformat()
+            orden["metodo_pago_usado"] = "tarjeta_guardada"
+        elif estado == "cancelado":
+            orden["fecha_cancelacion"] = (creada + datetime.timedelta(minutes=5)).isoformat()
+        yield orden
+
+def poblar(mongo_url: str, base: str, escala: int, semilla: int = 42) -> dict:
+    """
+    Borra y vuelve a poblar `base`. Retorna las cantidades insertadas y los
+    segundos que tomó cada etapa.
+    """
+    random.seed(semilla)
+    conteos = cantidades(escala)
+    tiempos = {}
+    cliente = MongoClient(mongo_url)
+    try:
+        cliente.drop_database(base)
+        db = cliente[base]
+
+        inicio = time.perf_counter()
+        _en_lotes(db, "productos", _productos(conteos["productos"]))
+        productos = list(db.productos.find({}, {"nombre": 1, "precio": 1, "imagen": 1}))
+        _en_lotes(db, "usuarios", _usuarios(conteos["usuarios"], hash_password(PASSWORD, COSTO_HASH)))
+        _en_lotes(db, "carritos", _carritos(conteos["carritos"], conteos["usuarios"], productos))
+        _en_lotes(db, "ordenes", _ordenes(conteos["ordenes"], conteos["usuarios"], productos))
+        tiempos["insercion"] = time.perf_counter() - inicio
+
+        inicio = time.perf_counter()
+        for coleccion, indices in INDICES.items():
+            db[coleccion].create_indexes(indices)
+        tiempos["indices"] = time.perf_counter() - inicio
+
+        inicio = time.perf_counter()
+        for pipeline in PIPELINES_RECONSTRUCCION:
+            list(db.ordenes.aggregate(pipeline))
+        tiempos["analitica"] = time.perf_counter() - inicio
+    finally:
+        cliente.close()
+    return {"documentos": conteos, "segundos": {k: round(v, 2) for k, v in tiempos.items()}}
@@ -21,6 +21,12 @@ function cg_obtenerUsuarioEmail() {
   return usuarioEmail || null;
 }
 
+// Headers con el token de sesión (si hay) para endpoints de usuario
+function cg_headersSesion(headers = {}) {
+  const token = localStorage.getItem("sesionToken");
+  return token ? { ...headers, "Authorization": `Bearer ${token}` } : headers;
+}
+
 // Llamada al backend para obtener carrito actual
 async function cg_fetchCarrito() {
   try {
@@ -38,15 +44,21 @@ async function cg_fetchCarrito() {
   }
 }
 
-// Eliminar item del carrito y refrescar
+// Eliminar item del carrito y refrescar con el carrito que retorna el backend
 async function cg_eliminarItemCarrito(id) {
   try {
     const usuarioEmail = cg_obtenerUsuarioEmail();
     const url = usuarioEmail
       ? `http://127.0.0.1:8000/carrito/${id}?usuario_email=${encodeURIComponent(usuarioEmail)}`
       : `http://127.0.0.1:8000/carrito/${id}`;
-    await fetch(url, { method: "DELETE" });
-    cg_initCartDropdown();
+    const resp = await fetch(url, { method: "DELETE" });
+    const data = resp.ok ? await resp.json() : null;
+    if (data && Array.isArray(data.carrito)) {
+      cg_renderCartDropdown(data.carrito);
+      cg_updateCartDot(data.carrito);
+    } else {
+      cg_initCartDropdown();
+    }
   } catch (e) {
     console.error("Error eliminando item del carrito:", e);
   }
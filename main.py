@@ -1,28 +1,90 @@
-from fastapi import FastAPI, HTTPException
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 from bson import ObjectId
+from pymongo.errors import DuplicateKeyError
 from fastapi import Body
 
 # --- Importaciones de capas ---
 # Repositorios (acceso a datos)
 from repositories.database import (
-    productos_col, carrito_col, favoritos_col, usuarios_col,
-    empleados_col, cupones_col, ordenes_col, tokens_recuperacion_col
+    productos_col, favoritos_col, usuarios_col,
+    empleados_col, ordenes_col, tokens_recuperacion_col, para_listado
 )
+from repositories.indices import crear_indices, verificar_indices
 
 # Servicios (lógica de negocio)
 from services.productos_service import ProductosService
-from services.carrito_service import CarritoService
-from services.envio_service import calcular_costo_envio
+from services.carrito_service import CarritoService, clave_producto
+from services.revisiones_service import RevisionesService
+from services.ordenes_service import OrdenesService
+from services.analitica_service import AnaliticaService
+from services.cupones_service import CuponesService
+from services.contrasenas_service import ContrasenasService
+from services.sesiones_service import SesionesService
+from services.limites_peticiones import LimitesPeticiones, MiddlewareLimites
+from services.perfilado import Perfilador, MiddlewarePerfilado, PERFILADO_HABILITADO
+from services.formatos import detectar_formato, registros, TIPOS_CONTENIDO
+from services.envio_service import (
+    calcular_envio_usuario, estadisticas_geocodificacion,
+    recalcular_envio_usuarios, iniciar_cliente_http, cerrar_cliente_http,
+    sucursales as sucursales_service, tarifas as tarifas_service
+)
 
 # Modelos (serializadores y utilidades)
 from models.serializers import (
     serializar_producto, serializar_carrito, serializar_favorito,
-    serializar_usuario
+    serializar_usuario, serializar_orden, PROYECCION_FAVORITO, PROYECCION_ORDEN
 )
-from models.auth import hash_password, es_super_usuario
+from models.codificacion import RespuestaJSON, codificar_json
+from models.auth import es_super_usuario
+from models.metricas import MiddlewareMetricas, registro as registro_metricas, METRICAS_HABILITADAS, TIPO_CONTENIDO
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Inicializa y libera recursos compartidos durante la vida de la app"""
+    await iniciar_cliente_http()
+    await sucursales_service.cargar()
+    sucursales_service.iniciar_recarga_automatica()
+    await tarifas_service.cargar()
+    tarifas_service.iniciar_recarga_automatica()
+    await cupones_service.cargar()
+    cupones_service.iniciar_recarga_automatica()
+    await sesiones_service.cargar()
+    sesiones_service.iniciar_recarga_automatica()
+    errores_indices = await crear_indices()
+    for coleccion, errores in errores_indices.items():
+        print(f"[ÍNDICES] No se pudieron crear índices en {coleccion}: {errores}")
+    for coleccion, nombres in (await verificar_indices()).items():
+        print(f"[ÍNDICES] Faltan índices en {coleccion}: {', '.join(nombres)}")
+    productos_service.iniciar_vigilancia_cambios()
+    await carrito_service.iniciar()
+    await analitica_service.iniciar()
+    await contrasenas_service.iniciar()
+    yield
+    contrasenas_service.detener()
+    await carrito_service.detener()
+    await productos_service.detener_vigilancia_cambios()
+    await cupones_service.detener_recarga_automatica()
+    await sesiones_service.detener_recarga_automatica()
+    await tarifas_service.detener_recarga_automatica()
+    await sucursales_service.detener_recarga_automatica()
+    await cerrar_cliente_http()
+    perfilador.detener()
+
+app = FastAPI(lifespan=lifespan, default_response_class=RespuestaJSON)
+
+# --- Límites de peticiones (login, validación de correo, recuperación) ---
+# Se agrega antes que CORS para quedar dentro de él: los 429 llevan sus headers
+limites_peticiones = LimitesPeticiones()
+app.add_middleware(MiddlewareLimites, limitador=limites_peticiones)
 
-app = FastAPI()
+# --- Perfilado por muestreo (opcional, PERFILADO_HABILITADO=1) ---
+# Por header X-Perfilar o al superar PERFILADO_UMBRAL_MS; deshabilitado no agrega nada
+perfilador = Perfilador()
+if PERFILADO_HABILITADO:
+    app.add_middleware(MiddlewarePerfilado, perfilador=perfilador)
 
 # --- CORS ---
 app.add_middleware(
@@ -31,11 +93,80 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Siguiente-Cursor", "ETag", "X-Perfil-Id"],
 )
 
+# --- Métricas (el más externo: mide también límites y CORS) ---
+if METRICAS_HABILITADAS:
+    app.add_middleware(MiddlewareMetricas)
+
 # --- Inicializar servicios ---
 productos_service = ProductosService()
 carrito_service = CarritoService()
+analitica_service = AnaliticaService()
+# Cupones vigentes aunque la colección esté vacía (sin límites de uso)
+cupones_service = CuponesService([
+    {"codigo": "LIBREENVIO", "tipo": "free_shipping", "etiqueta": "Envío gratis"},
+    {"codigo": "ENVIOGRATIS", "tipo": "free_shipping", "etiqueta": "Envío gratis"},
+    {"codigo": "DESCUENTO10", "tipo": "percent", "valor": 10, "etiqueta": "10% de descuento"},
+    {"codigo": "MENOS2000", "tipo": "fixed", "valor": 2000, "etiqueta": "$2.000 de descuento"},
+])
+ordenes_service = OrdenesService(carrito=carrito_service, analitica=analitica_service, cupones=cupones_service)
+revisiones = RevisionesService()
+contrasenas_service = ContrasenasService()
+sesiones_service = SesionesService()
+
+# --- CACHÉ HTTP (ETag / If-None-Match) ---
+CACHE_PUBLICO = "no-cache"  # El navegador guarda la respuesta pero revalida siempre
+CACHE_PRIVADO = "private, no-cache"  # Igual, pero no en cachés compartidas (datos de usuario)
+
+def etag_coincide(request: Request, etag: str) -> bool:
+    """Indica si el cliente ya tiene la versión identificada por `etag`"""
+    encabezado = request.headers.get("if-none-match")
+    if not encabezado:
+        return False
+    if encabezado.strip() == "*":
+        return True
+    etiquetas = [e.strip().removeprefix("W/") for e in encabezado.split(",")]
+    return etag in etiquetas
+
+def respuesta_no_modificada(etag: str, cache_control: str) -> Response:
+    """Respuesta 304 sin cuerpo"""
+    return Response(status_code=304, headers={"ETag": etag, "Cache-Control": cache_control})
+
+# --- SESIONES (Authorization: Bearer <token>) ---
+def token_de_sesion(request: Request):
+    """Token del header Authorization (None si no viene)"""
+    tipo, _, token = request.headers.get("authorization", "").partition(" ")
+    token = token.strip()
+    return token if tipo.lower() == "bearer" and token else None
+
+def sesion_de(request: Request):
+    """Datos de la sesión de la petición, verificada sin acceder a la base (None sin token)"""
+    token = token_de_sesion(request)
+    if token is None:
+        return None
+    try:
+        return sesiones_service.verificar(token)
+    except ValueError as e:
+        raise HTTPException(status_code=401, detail=str(e))
+
+async def usuario_de_peticion(request: Request, correo: str):
+    """
+    Documento del usuario `correo`. Con token de sesión sale de la caché de
+    sesiones (403 si el token es de otro usuario y no de un super usuario);
+    sin token se lee de la base como antes.
+    """
+    sesion = sesion_de(request)
+    if sesion is None:
+        return await usuarios_col.find_one({"correo": correo})
+    if sesion["sub"] != correo and not es_super_usuario(sesion["sub"]):
+        raise HTTPException(status_code=403, detail="La sesión no corresponde a este usuario")
+    return await sesiones_service.obtener_usuario(correo)
+
+def serializar_usuario_helper(usuario):
+    """Serializa un usuario marcando si es super usuario"""
+    return serializar_usuario(usuario, es_super_usuario)
 
 # --- NOTA: Funciones movidas a capas ---
 # Serializadores → models/serializers.py
@@ -46,9 +177,42 @@ carrito_service = CarritoService()
 # --- PRODUCTOS ---
 # Controladores: Reciben peticiones HTTP y delegan a servicios
 @app.get("/productos")
-async def obtener_productos():
-    """Controlador: Obtiene todos los productos"""
-    return await productos_service.obtener_todos()
+async def obtener_productos(
+    request: Request,
+    categoria: str = None,
+    precio_min: int = None,
+    precio_max: int = None,
+    estado: str = None,
+    orden: str = None,
+    limite: int = None,
+    cursor: str = None
+):
+    """
+    Controlador: Obtiene productos filtrados y ordenados en el servidor.
+    Sin parámetros retorna todos desde el catálogo en memoria. Con `limite`
+    pagina por cursor: el cursor de la página siguiente viene en el header
+    X-Siguiente-Cursor.
+    Responde 304 si el catálogo no cambió desde el ETag que envía el cliente.
+    """
+    etag = productos_service.etag()
+    if etag_coincide(request, etag):
+        return respuesta_no_modificada(etag, CACHE_PUBLICO)
+    
+    if not any(v is not None for v in (categoria, precio_min, precio_max, estado, orden, limite, cursor)):
+        cuerpo = await productos_service.obtener_todos_json()
+        return RespuestaJSON(cuerpo, headers={"ETag": etag, "Cache-Control": CACHE_PUBLICO})
+    
+    headers = {"ETag": etag, "Cache-Control": CACHE_PUBLICO}
+    try:
+        productos, siguiente_cursor = await productos_service.buscar(
+            categoria=categoria, precio_min=precio_min, precio_max=precio_max,
+            estado=estado, orden=orden, limite=limite, cursor=cursor
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if siguiente_cursor:
+        headers["X-Siguiente-Cursor"] = siguiente_cursor
+    return RespuestaJSON(productos, headers=headers)
 
 @app.post("/productos")
 async def agregar_producto(producto: dict = Body(...)):
@@ -56,6 +220,33 @@ async def agregar_producto(producto: dict = Body(...)):
     result_id = await productos_service.crear(producto)
     return {"_id": str(result_id)}
 
+@app.post("/productos/bulk")
+async def importar_productos(request: Request, formato: str = None):
+    """
+    Controlador: Importa productos desde un cuerpo NDJSON o CSV (con
+    encabezado) leído en streaming. Filas con `_id` actualizan ese producto;
+    sin `_id` se crean. El formato se toma de ?formato= o del Content-Type.
+    Retorna un resumen con los totales y los errores por línea.
+    """
+    try:
+        formato = detectar_formato(formato, request.headers.get("content-type"))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return await productos_service.importar(registros(request.stream(), formato))
+
+@app.get("/productos/export")
+async def exportar_productos(formato: str = "ndjson"):
+    """Controlador: Descarga el catálogo completo en NDJSON o CSV, en streaming"""
+    try:
+        formato = detectar_formato(formato)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return StreamingResponse(
+        productos_service.exportar(formato),
+        media_type=TIPOS_CONTENIDO[formato],
+        headers={"Content-Disposition": f'attachment; filename="productos.{formato}"'}
+    )
+
 @app.put("/productos/{id_producto}")
 async def actualizar_producto(id_producto: str, producto: dict = Body(...)):
     """Controlador: Actualiza un producto"""
@@ -73,57 +264,177 @@ async def eliminar_producto(id_producto: str):
     return {"status": "ok"}
 
 
+# --- ADMINISTRACIÓN DE ÍNDICES ---
+@app.get("/admin/indices")
+async def estado_indices():
+    """Verifica que existan todos los índices declarados y reporta los faltantes"""
+    faltantes = await verificar_indices()
+    return {"completo": not faltantes, "faltantes": faltantes}
+
+@app.post("/admin/indices")
+async def reconstruir_indices():
+    """Crea los índices faltantes (idempotente) y reporta errores y faltantes"""
+    errores = await crear_indices()
+    faltantes = await verificar_indices()
+    return {"completo": not faltantes, "errores": errores, "faltantes": faltantes}
+
+@app.get("/metrics")
+async def metricas():
+    """Exporta las métricas del proceso en el formato de texto de Prometheus"""
+    return Response(content=registro_metricas.exportar(), media_type=TIPO_CONTENIDO)
+
+@app.get("/admin/perfiles")
+async def listar_perfiles(ruta: str = None):
+    """Lista los perfiles guardados (opcionalmente de una ruta, p. ej. "POST /ordenes")"""
+    return {
+        "habilitado": PERFILADO_HABILITADO,
+        "estadisticas": perfilador.estadisticas(),
+        "perfiles": perfilador.listar(ruta)
+    }
+
+@app.get("/admin/perfiles/{perfil_id}")
+async def descargar_perfil(perfil_id: str):
+    """Descarga un perfil en formato de pilas colapsadas (flamegraph.pl, speedscope)"""
+    texto = perfilador.exportar(perfil_id)
+    if texto is None:
+        raise HTTPException(status_code=404, detail="Perfil no encontrado")
+    return Response(
+        content=texto, media_type="text/plain; charset=utf-8",
+        headers={"Content-Disposition": f'attachment; filename="perfil-{perfil_id}.folded"'}
+    )
+
+@app.get("/admin/limites")
+async def estado_limites():
+    """Retorna los contadores de peticiones admitidas y rechazadas por límite"""
+    return limites_peticiones.estadisticas()
+
+
+# --- SUCURSALES ---
+@app.get("/sucursales")
+async def obtener_sucursales():
+    """Controlador: Lista las sucursales activas"""
+    return sucursales_service.listar()
+
+@app.post("/sucursales")
+async def agregar_sucursal(sucursal: dict = Body(...)):
+    """Controlador: Registra una sucursal (requiere nombre, latitud y longitud)"""
+    try:
+        return await sucursales_service.crear(sucursal)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.put("/sucursales/{id_sucursal}")
+async def actualizar_sucursal(id_sucursal: str, datos: dict = Body(...)):
+    """Controlador: Actualiza una sucursal (activa=false la saca del reparto)"""
+    try:
+        sucursal = await sucursales_service.actualizar(id_sucursal, datos)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if not sucursal:
+        raise HTTPException(status_code=404, detail="Sucursal no encontrada")
+    return sucursal
+
+@app.delete("/sucursales/{id_sucursal}")
+async def eliminar_sucursal(id_sucursal: str):
+    """Controlador: Elimina una sucursal"""
+    eliminada = await sucursales_service.eliminar(id_sucursal)
+    if not eliminada:
+        raise HTTPException(status_code=404, detail="Sucursal no encontrada")
+    return {"status": "ok"}
+
+
 # --- CARRITO ---
 # Controladores: Reciben peticiones HTTP y delegan a servicios
 @app.get("/carrito")
-async def obtener_carrito(usuario_email: str = None):
-    """Controlador: Obtiene el carrito de un usuario"""
-    return await carrito_service.obtener_por_usuario(usuario_email)
+async def obtener_carrito(request: Request, usuario_email: str = None):
+    """Controlador: Obtiene el carrito de un usuario (304 si no cambió)"""
+    headers = {}
+    if usuario_email:
+        etag = await carrito_service.etag(usuario_email)
+        if etag_coincide(request, etag):
+            return respuesta_no_modificada(etag, CACHE_PRIVADO)
+        headers = {"ETag": etag, "Cache-Control": CACHE_PRIVADO}
+    return RespuestaJSON(await carrito_service.obtener_por_usuario(usuario_email), headers=headers)
 
 @app.post("/carrito")
 async def agregar_al_carrito(item: dict):
-    """Controlador: Agrega un producto al carrito"""
+    """Controlador: Agrega un producto al carrito y retorna el carrito actualizado"""
     try:
         result_id = await carrito_service.agregar_item(item)
-        return {"_id": str(result_id)}
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
+    return {
+        "_id": str(result_id),
+        "carrito": await carrito_service.obtener_por_usuario(item["usuario_email"])
+    }
+
+@app.post("/carrito/batch")
+async def agregar_al_carrito_lote(datos: dict = Body(...)):
+    """
+    Controlador: Agrega varios productos al carrito en una sola solicitud.
+    Body: {"usuario_email": str, "items": [{producto_id, nombre, precio, cantidad, imagen}, ...]}
+    Los productos que ya estaban suman su cantidad.
+    """
+    usuario_email = datos.get("usuario_email")
+    try:
+        ids = await carrito_service.agregar_items(usuario_email, datos.get("items"))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {
+        "ids": [str(id_item) for id_item in ids],
+        "carrito": await carrito_service.obtener_por_usuario(usuario_email)
+    }
+
+@app.patch("/carrito/{id_item}")
+async def cambiar_cantidad_item(id_item: str, datos: dict = Body(...), usuario_email: str = None):
+    """Suma `delta` a la cantidad de un producto del carrito (mínimo 1)"""
+    try:
+        delta = int(datos.get("delta", 0))
+    except (ValueError, TypeError, OverflowError):
+        raise HTTPException(status_code=400, detail="delta inválido")
+    item = await carrito_service.cambiar_cantidad(id_item, delta, usuario_email)
+    if item is None:
+        raise HTTPException(status_code=404, detail="Item no encontrado en carrito")
+    return {"status": "ok", "cantidad": item["cantidad"]}
 
 @app.delete("/carrito/{id_item}")
 async def eliminar_item_carrito(id_item: str, usuario_email: str = None):
-    """Elimina un producto del carrito de un usuario"""
-    query = {"_id": ObjectId(id_item)}
-    if usuario_email:
-        query["usuario_email"] = usuario_email
-    
-    result = await carrito_col.delete_one(query)
-    if result.deleted_count == 0:
+    """Elimina un producto del carrito de un usuario y retorna el carrito actualizado"""
+    if not await carrito_service.eliminar_item(id_item, usuario_email):
         raise HTTPException(status_code=404, detail="Item no encontrado en carrito")
-    return {"status": "ok"}
+    respuesta = {"status": "ok"}
+    if usuario_email:
+        respuesta["carrito"] = await carrito_service.obtener_por_usuario(usuario_email)
+    return respuesta
 
 @app.delete("/carrito")
 async def vaciar_carrito(usuario_email: str = None):
     """Vacía el carrito de un usuario"""
-    query = {}
-    if usuario_email:
-        query["usuario_email"] = usuario_email
-    
-    await carrito_col.delete_many(query)
+    await carrito_service.vaciar_carrito(usuario_email)
     return {"status": "Carrito vacío"}
 
+@app.get("/admin/carrito")
+async def estado_carrito():
+    """Retorna el estado de la escritura diferida del carrito"""
+    return carrito_service.estadisticas()
+
 
 # --- FAVORITOS ---
 @app.get("/favoritos")
-async def obtener_favoritos(usuario_email: str = None):
-    """Obtiene los favoritos de un usuario específico"""
+async def obtener_favoritos(request: Request, usuario_email: str = None):
+    """Obtiene los favoritos de un usuario específico (304 si no cambiaron)"""
+    etag = await revisiones.etag("favoritos", usuario_email)
+    if etag_coincide(request, etag):
+        return respuesta_no_modificada(etag, CACHE_PRIVADO)
+    
     query = {}
     if usuario_email:
         query["usuario_email"] = usuario_email
     
     favoritos = []
-    async for f in favoritos_col.find(query):
+    async for f in para_listado(favoritos_col).find(query, PROYECCION_FAVORITO):
         favoritos.append(serializar_favorito(f))
-    return favoritos
+    return RespuestaJSON(favoritos, headers={"ETag": etag, "Cache-Control": CACHE_PRIVADO})
 
 @app.post("/favoritos")
 async def agregar_a_favoritos(producto: dict = Body(...)):
@@ -132,16 +443,24 @@ async def agregar_a_favoritos(producto: dict = Body(...)):
     if "usuario_email" not in producto:
         raise HTTPException(status_code=400, detail="usuario_email es requerido")
     
-    # Verificar si ya existe en favoritos del usuario (por nombre)
-    existente = await favoritos_col.find_one({
-        "usuario_email": producto["usuario_email"],
-        "nombre": producto["nombre"]
-    })
-    if existente:
+    clave = clave_producto(producto)
+    if not clave:
+        raise HTTPException(status_code=400, detail="producto_id o nombre es requerido")
+    producto.pop("_id", None)
+    producto["producto_id"] = clave
+    
+    # Upsert atómico sobre (usuario_email, producto_id): dos clics simultáneos no duplican
+    filtro = {"usuario_email": producto["usuario_email"], "producto_id": clave}
+    try:
+        result = await favoritos_col.update_one(filtro, {"$setOnInsert": producto}, upsert=True)
+    except DuplicateKeyError:
+        # Otro upsert simultáneo insertó primero (índice único)
+        result = None
+    if result is None or result.upserted_id is None:
         raise HTTPException(status_code=400, detail="El producto ya está en favoritos")
     
-    result = await favoritos_col.insert_one(producto)
-    return {"_id": str(result.inserted_id), "message": "Producto agregado a favoritos"}
+    await revisiones.incrementar("favoritos", producto["usuario_email"])
+    return {"_id": str(result.upserted_id), "message": "Producto agregado a favoritos"}
 
 @app.delete("/favoritos/{id_favorito}")
 async def eliminar_de_favoritos(id_favorito: str, usuario_email: str = None):
@@ -153,6 +472,7 @@ async def eliminar_de_favoritos(id_favorito: str, usuario_email: str = None):
     result = await favoritos_col.delete_one(query)
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Favorito no encontrado")
+    await revisiones.incrementar("favoritos", usuario_email)
     return {"status": "ok"}
 
 @app.delete("/favoritos")
@@ -163,6 +483,7 @@ async def vaciar_favoritos(usuario_email: str = None):
         query["usuario_email"] = usuario_email
     
     await favoritos_col.delete_many(query)
+    await revisiones.incrementar("favoritos", usuario_email)
     return {"status": "Favoritos vaciados"}
 
 
@@ -191,10 +512,15 @@ async def registrar_usuario(usuario: dict = Body(...)):
     
     # Hashear la contraseña antes de guardarla
     password_original = usuario.pop("password", "")
-    usuario["password_hash"] = hash_password(password_original)
+    usuario["password_hash"] = await contrasenas_service.hashear(password_original)
     
     # Insertar usuario
-    result = await usuarios_col.insert_one(usuario)
+    try:
+        result = await usuarios_col.insert_one(usuario)
+    except DuplicateKeyError as e:
+        # Otro registro simultáneo con el mismo correo o RUT insertó primero (índices únicos)
+        campo = "RUT" if "rut" in ((e.details or {}).get("keyPattern") or {}) else "correo"
+        raise HTTPException(status_code=400, detail=f"El {campo} ya está registrado")
     usuario_creado = await usuarios_col.find_one({"_id": result.inserted_id})
     
     return {
@@ -218,20 +544,39 @@ async def login_usuario(credenciales: dict = Body(...)):
     if not usuario:
         raise HTTPException(status_code=401, detail="Correo o contraseña incorrectos")
     
-    # Verificar contraseña
-    password_hash = hash_password(password)
-    if usuario.get("password_hash") != password_hash:
+    # Verificar contraseña (scrypt en el pool de hilos, sin bloquear el loop)
+    valida, nuevo_hash = await contrasenas_service.verificar(password, usuario.get("password_hash"))
+    if not valida:
         raise HTTPException(status_code=401, detail="Correo o contraseña incorrectos")
+    if nuevo_hash:
+        # Hash SHA-256 legado o de otro costo: se reemplaza solo si nadie lo cambió entretanto
+        await usuarios_col.update_one(
+            {"_id": usuario["_id"], "password_hash": usuario.get("password_hash")},
+            {"$set": {"password_hash": nuevo_hash}}
+        )
+    else:
+        # Las próximas peticiones con el token usan este documento sin releerlo
+        sesiones_service.guardar_usuario(usuario)
     
     return {
         "message": "Inicio de sesión exitoso",
-        "usuario": serializar_usuario_helper(usuario)
+        "usuario": serializar_usuario_helper(usuario),
+        "token": sesiones_service.emitir(correo)
     }
 
+@app.post("/usuarios/logout")
+async def cerrar_sesion(request: Request):
+    """Revoca el token de sesión de la petición"""
+    sesion = sesion_de(request)
+    if sesion is None:
+        raise HTTPException(status_code=401, detail="Falta el token de sesión")
+    await sesiones_service.revocar(sesion)
+    return {"message": "Sesión cerrada"}
+
 @app.get("/usuarios/perfil/{correo}")
-async def obtener_perfil(correo: str):
+async def obtener_perfil(request: Request, correo: str):
     """Obtiene el perfil de un usuario por correo"""
-    usuario = await usuarios_col.find_one({"correo": correo})
+    usuario = await usuario_de_peticion(request, correo)
     
     if not usuario:
         raise HTTPException(status_code=404, detail="Usuario no encontrado")
@@ -246,18 +591,27 @@ async def actualizar_perfil(correo: str, datos: dict = Body(...)):
     datos.pop("password", None)
     datos.pop("password_hash", None)
     
+    operacion = {"$set": datos}
+    # Si cambia el domicilio sin coordenadas nuevas, descartar las anteriores
+    # para que se vuelva a geocodificar la dirección nueva
+    if "domicilio" in datos and ("latitud" not in datos or "longitud" not in datos):
+        datos.pop("latitud", None)
+        datos.pop("longitud", None)
+        operacion["$unset"] = {"latitud": "", "longitud": ""}
+    
     result = await usuarios_col.update_one(
         {"correo": correo},
-        {"$set": datos}
+        operacion
     )
     
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Usuario no encontrado")
     
     usuario_actualizado = await usuarios_col.find_one({"correo": correo})
+    await sesiones_service.usuario_modificado(correo, usuario_actualizado)
     return {
         "message": "Perfil actualizado exitosamente",
-        "usuario": serializar_usuario(usuario_actualizado)
+        "usuario": serializar_usuario_helper(usuario_actualizado)
     }
 
 # --- EMPLEADOS ---
@@ -302,14 +656,17 @@ async def cambiar_password(correo: str, datos: dict = Body(...)):
         raise HTTPException(status_code=404, detail="Usuario no encontrado")
 
     # Validar contraseña actual
-    if usuario.get("password_hash") != hash_password(password_actual):
+    valida, _ = await contrasenas_service.verificar(password_actual, usuario.get("password_hash"))
+    if not valida:
         raise HTTPException(status_code=401, detail="La contraseña actual es incorrecta")
 
     # Actualizar por nueva contraseña
-    nuevo_hash = hash_password(password_nueva)
+    nuevo_hash = await contrasenas_service.hashear(password_nueva)
     await usuarios_col.update_one({"correo": correo}, {"$set": {"password_hash": nuevo_hash}})
 
-    return {"message": "Contraseña actualizada exitosamente"}
+    # Cierra las sesiones abiertas con la contraseña anterior; esta sigue con un token nuevo
+    await sesiones_service.revocar_usuario(correo)
+    return {"message": "Contraseña actualizada exitosamente", "token": sesiones_service.emitir(correo)}
 
 # --- VALIDACIÓN DE CORREO ---
 @app.post("/usuarios/validar-correo")
@@ -374,14 +731,16 @@ async def solicitar_cambio_password(datos: dict = Body(...)):
     import datetime
     token = secrets.token_urlsafe(32)
     
-    # Guardar token en base de datos (válido por 1 hora)
-    expiracion = datetime.datetime.now() + datetime.timedelta(hours=1)
+    # Guardar token en base de datos (válido por 1 hora). En UTC, porque el
+    # índice TTL sobre "expiracion" interpreta las fechas como UTC
+    ahora = datetime.datetime.now(datetime.timezone.utc)
+    expiracion = ahora + datetime.timedelta(hours=1)
     await tokens_recuperacion_col.insert_one({
         "correo": correo,
         "token": token,
         "expiracion": expiracion,
         "usado": False,
-        "fecha_creacion": datetime.datetime.now()
+        "fecha_creacion": ahora
     })
     
     # SIMULAR envío de email (en producción usarías un servicio real)
@@ -418,7 +777,7 @@ async def cambiar_password_con_token(datos: dict = Body(...)):
     token_doc = await tokens_recuperacion_col.find_one({
         "token": token,
         "usado": False,
-        "expiracion": {"$gt": datetime.datetime.now()}
+        "expiracion": {"$gt": datetime.datetime.now(datetime.timezone.utc)}
     })
     
     if not token_doc:
@@ -438,11 +797,12 @@ async def cambiar_password_con_token(datos: dict = Body(...)):
         )
     
     # Actualizar contraseña
-    nuevo_hash = hash_password(password_nueva)
+    nuevo_hash = await contrasenas_service.hashear(password_nueva)
     await usuarios_col.update_one(
         {"correo": correo},
         {"$set": {"password_hash": nuevo_hash}}
     )
+    await sesiones_service.revocar_usuario(correo)
     
     # Marcar token como usado
     await tokens_recuperacion_col.update_one(
@@ -454,34 +814,62 @@ async def cambiar_password_con_token(datos: dict = Body(...)):
 
 # --- CUPONES ---
 @app.get("/cupones/{codigo}")
-async def validar_cupon(codigo: str):
-    """Valida un cupón y retorna su efecto. Implementación básica con lista blanca.
-    tipos soportados: free_shipping, percent (value=0-100), fixed (value en CLP)
+async def validar_cupon(codigo: str, subtotal: int = None):
     """
-    codigo_norm = (codigo or "").strip().upper()
-    cupones = {
-        "LIBREENVIO": {"type": "free_shipping", "label": "Envío gratis"},
-        "ENVIOGRATIS": {"type": "free_shipping", "label": "Envío gratis"},
-        "DESCUENTO10": {"type": "percent", "value": 10, "label": "10% de descuento"},
-        "MENOS2000": {"type": "fixed", "value": 2000, "label": "$2.000 de descuento"},
-    }
-    data = cupones.get(codigo_norm)
-    if not data:
+    Valida un cupón y retorna su efecto (el descuento real se calcula al
+    crear la orden). tipos: free_shipping, percent (value=1-100), fixed
+    (value en CLP). Con `subtotal` también verifica el mínimo de compra.
+    """
+    try:
+        cupon = cupones_service.obtener(codigo, subtotal)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if not cupon:
         raise HTTPException(status_code=404, detail="Cupón inválido o expirado")
-    return {"code": codigo_norm, **data}
+    return cupon.publico()
+
+@app.get("/admin/cupones")
+async def listar_cupones():
+    """Lista los cupones guardados con sus usos"""
+    return await cupones_service.listar()
+
+@app.post("/admin/cupones")
+async def crear_cupon(cupon: dict = Body(...)):
+    """Crea un cupón (ver validar_cupon en services/cupones_service.py)"""
+    try:
+        return await cupones_service.crear(cupon)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.put("/admin/cupones/{codigo}")
+async def actualizar_cupon(codigo: str, cupon: dict = Body(...)):
+    """Reemplaza las reglas de un cupón; sus usos se conservan"""
+    try:
+        actualizado = await cupones_service.actualizar(codigo, cupon)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if actualizado is None:
+        raise HTTPException(status_code=404, detail="Cupón no encontrado")
+    return actualizado
+
+@app.delete("/admin/cupones/{codigo}")
+async def eliminar_cupon(codigo: str):
+    """Elimina un cupón"""
+    if not await cupones_service.eliminar(codigo):
+        raise HTTPException(status_code=404, detail="Cupón no encontrado")
+    return {"status": "ok"}
 
 # --- MEDIOS DE PAGO POR USUARIO ---
 @app.get("/usuarios/{correo}/medios_pago")
-async def listar_medios_pago(correo: str):
-    usuario = await usuarios_col.find_one({"correo": correo})
+async def listar_medios_pago(request: Request, correo: str):
+    usuario = await usuario_de_peticion(request, correo)
     if not usuario:
         raise HTTPException(status_code=404, detail="Usuario no encontrado")
-    medios = usuario.get("medios_pago", [])
-    # Normalizar _id a string si existen
-    for m in medios:
-        if isinstance(m.get("_id"), ObjectId):
-            m["_id"] = str(m["_id"])
-    return medios
+    # Copias: el documento puede venir de la caché de sesiones
+    return [
+        {**m, "_id": str(m["_id"])} if isinstance(m.get("_id"), ObjectId) else m
+        for m in usuario.get("medios_pago", [])
+    ]
 
 @app.post("/usuarios/{correo}/medios_pago")
 async def agregar_medio_pago(correo: str, medio: dict = Body(...)):
@@ -519,6 +907,7 @@ async def agregar_medio_pago(correo: str, medio: dict = Body(...)):
         {"correo": correo},
         {"$push": {"medios_pago": nuevo_medio}}
     )
+    await sesiones_service.usuario_modificado(correo)
 
     nuevo_medio["_id"] = str(nuevo_medio["_id"])  # serializar
     return {"message": "Medio de pago agregado", "medio": nuevo_medio}
@@ -537,6 +926,7 @@ async def actualizar_medio_pago(correo: str, medio_id: str, cambios: dict = Body
     )
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Medio de pago no encontrado")
+    await sesiones_service.usuario_modificado(correo)
     return {"message": "Medio de pago actualizado"}
 
 @app.delete("/usuarios/{correo}/medios_pago/{medio_id}")
@@ -547,246 +937,198 @@ async def eliminar_medio_pago(correo: str, medio_id: str):
     )
     if result.modified_count == 0:
         raise HTTPException(status_code=404, detail="Medio de pago no encontrado")
+    await sesiones_service.usuario_modificado(correo)
     return {"message": "Medio de pago eliminado"}
 
 # --- ÓRDENES Y PAGOS ---
-def serializar_orden(orden):
-    """Serializa una orden para respuesta JSON"""
-    return {
-        "_id": str(orden["_id"]),
-        "usuario_email": orden.get("usuario_email", ""),
-        "productos": orden.get("productos", []),
-        "subtotal": orden.get("subtotal", 0),
-        "descuento": orden.get("descuento", 0),
-        "envio": orden.get("envio", 0),
-        "total": orden.get("total", 0),
-        "estado": orden.get("estado", "pendiente"),
-        "medio_pago_id": str(orden.get("medio_pago_id", "")) if orden.get("medio_pago_id") else None,
-        "metodo_pago_usado": orden.get("metodo_pago_usado", "tarjeta_guardada"),
-        "fecha_creacion": orden.get("fecha_creacion", ""),
-        "fecha_pago": orden.get("fecha_pago", ""),
-        "fecha_cancelacion": orden.get("fecha_cancelacion", ""),
-        "cupon_codigo": orden.get("cupon_codigo", ""),
-        "direccion_envio": orden.get("direccion_envio", ""),
-        "distancia_km": orden.get("distancia_km"),
-        "dentro_radio_envio": orden.get("dentro_radio_envio")
-    }
+@app.get("/envio/tarifas")
+async def obtener_tarifas_envio():
+    """Retorna las reglas de tarifas de envío vigentes"""
+    return tarifas_service.obtener_reglas()
+
+@app.put("/envio/tarifas")
+async def actualizar_tarifas_envio(reglas: dict = Body(...)):
+    """
+    Reemplaza las reglas de tarifas de envío (tramos, costo estándar, recargos
+    y envío gratis por monto). Se aplican de inmediato en este proceso y en
+    los demás al revisar la versión.
+    """
+    try:
+        return await tarifas_service.actualizar(reglas)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/envio/geocodificacion")
+async def estado_geocodificacion():
+    """Retorna el estado de la geocodificación: caché, límite de tasa y circuit breaker"""
+    return estadisticas_geocodificacion()
+
+# --- ANALÍTICA DE VENTAS ---
+# Leen acumulados precalculados; desde / hasta son días AAAA-MM-DD inclusivos
+@app.get("/analitica/resumen")
+async def analitica_resumen(desde: str = None, hasta: str = None):
+    """Totales de ventas, cancelaciones, ticket y distancia promedio del rango"""
+    try:
+        return await analitica_service.resumen(desde, hasta)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/analitica/ventas")
+async def analitica_ventas(periodo: str = "dia", desde: str = None, hasta: str = None):
+    """Ventas por día o por semana ISO"""
+    try:
+        return await analitica_service.ventas(periodo, desde, hasta)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/analitica/productos")
+async def analitica_productos(limite: int = 10, por: str = "cantidad", desde: str = None, hasta: str = None):
+    """Productos más vendidos por unidades (por=cantidad) o por ingresos (por=ingresos)"""
+    try:
+        return await analitica_service.top_productos(limite, por, desde, hasta)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/analitica/cupones")
+async def analitica_cupones(desde: str = None, hasta: str = None):
+    """Efectividad de los cupones: usos, descuento otorgado, ingresos y cancelaciones"""
+    try:
+        return await analitica_service.cupones(desde, hasta)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.post("/admin/analitica/reconstruir")
+async def reconstruir_analitica():
+    """Recalcula los acumulados de ventas desde el historial de órdenes"""
+    await analitica_service.reconstruir()
+    return {"status": "ok"}
+
+@app.get("/admin/envio/recalcular")
+async def recalcular_envio_todos():
+    """
+    Recalcula costo y elegibilidad de envío de todos los usuarios (p. ej. tras
+    mover el restaurante o cambiar el radio). Responde en streaming NDJSON,
+    una línea por usuario.
+    """
+    async def generar():
+        async for fila in recalcular_envio_usuarios():
+            yield codificar_json(fila) + b"\n"
+    
+    return StreamingResponse(generar(), media_type="application/x-ndjson")
 
 @app.get("/ordenes/calcular-envio")
-async def calcular_envio_orden(usuario_email: str):
+async def calcular_envio_orden(request: Request, usuario_email: str, subtotal: int = None):
     """
     Calcula el costo de envío para un usuario basado en su dirección o coordenadas.
+    Si se indica el subtotal del carrito, aplica el envío gratis por monto.
     Retorna el costo de envío, distancia y si está dentro del radio.
     """
     if not usuario_email:
         raise HTTPException(status_code=400, detail="usuario_email es requerido")
     
     # Obtener usuario y su dirección/coordenadas
-    usuario = await usuarios_col.find_one({"correo": usuario_email})
+    usuario = await usuario_de_peticion(request, usuario_email)
     if not usuario:
         raise HTTPException(status_code=404, detail="Usuario no encontrado")
     
-    # Priorizar coordenadas guardadas (más rápido y preciso)
-    lat = usuario.get("latitud")
-    lon = usuario.get("longitud")
-    direccion = usuario.get("domicilio", "")
-    
-    # Si tiene coordenadas, usarlas directamente (más rápido)
-    if lat is not None and lon is not None:
-        resultado_envio = await calcular_costo_envio(lat_cliente=lat, lon_cliente=lon)
-    else:
-        # Si no tiene coordenadas, geocodificar la dirección
-        resultado_envio = await calcular_costo_envio(direccion_cliente=direccion)
-    
-    return resultado_envio
+    return await calcular_envio_usuario(usuario, subtotal)
 
 @app.post("/ordenes")
-async def crear_orden(orden_data: dict = Body(...)):
+async def crear_orden(request: Request, orden_data: dict = Body(...)):
     """Crea una nueva orden a partir del carrito del usuario"""
     usuario_email = orden_data.get("usuario_email")
     if not usuario_email:
         raise HTTPException(status_code=400, detail="usuario_email es requerido")
+    # Con sesión, el usuario sale de la caché; sin ella, el servicio lo lee
+    usuario = await usuario_de_peticion(request, usuario_email) if token_de_sesion(request) else None
     
-    # Obtener carrito del usuario
-    carrito_items = []
-    async for item in carrito_col.find({"usuario_email": usuario_email}):
-        carrito_items.append({
-            "nombre": item.get("nombre", ""),
-            "precio": item.get("precio", 0),
-            "cantidad": item.get("cantidad", 1),
-            "imagen": item.get("imagen", "")
-        })
-    
-    if not carrito_items:
-        raise HTTPException(status_code=400, detail="El carrito está vacío")
-    
-    # Calcular costo de envío según distancia
-    usuario = await usuarios_col.find_one({"correo": usuario_email})
-    direccion = usuario.get("domicilio", "") if usuario else ""
-    lat_usuario = usuario.get("latitud") if usuario else None
-    lon_usuario = usuario.get("longitud") if usuario else None
-    
-    # Si se proporciona envío explícitamente (y no es None), usarlo (para cupones de envío gratis)
-    envio_proporcionado = orden_data.get("envio")
-    if envio_proporcionado is not None and envio_proporcionado != "":
-        try:
-            envio = int(envio_proporcionado)
-            distancia_info = None
-        except (ValueError, TypeError):
-            # Si no es un número válido, calcular según distancia
-            # Priorizar coordenadas si están disponibles
-            if lat_usuario is not None and lon_usuario is not None:
-                resultado_envio = await calcular_costo_envio(lat_cliente=lat_usuario, lon_cliente=lon_usuario)
-            else:
-                resultado_envio = await calcular_costo_envio(direccion_cliente=direccion)
-            envio = resultado_envio["costo"]
-            distancia_info = {
-                "distancia_km": resultado_envio.get("distancia_km"),
-                "dentro_radio": resultado_envio.get("dentro_radio")
-            }
-    else:
-        # Calcular envío según distancia
-        # Priorizar coordenadas si están disponibles (más rápido y preciso)
-        if lat_usuario is not None and lon_usuario is not None:
-            resultado_envio = await calcular_costo_envio(lat_cliente=lat_usuario, lon_cliente=lon_usuario)
-        else:
-            resultado_envio = await calcular_costo_envio(direccion_cliente=direccion)
-        envio = resultado_envio["costo"]
-        distancia_info = {
-            "distancia_km": resultado_envio.get("distancia_km"),
-            "dentro_radio": resultado_envio.get("dentro_radio")
-        }
-    
-    # Calcular totales
-    subtotal = sum(item["precio"] * item.get("cantidad", 1) for item in carrito_items)
-    descuento = orden_data.get("descuento", 0)
-    total = max(0, subtotal - descuento) + envio
-    
-    # Crear orden
-    from datetime import datetime
-    nueva_orden = {
-        "usuario_email": usuario_email,
-        "productos": carrito_items,
-        "subtotal": subtotal,
-        "descuento": descuento,
-        "envio": envio,
-        "total": total,
-        "estado": "pendiente",
-        "medio_pago_id": orden_data.get("medio_pago_id"),
-        "fecha_creacion": datetime.now().isoformat(),
-        "cupon_codigo": orden_data.get("cupon_codigo", ""),
-        "direccion_envio": direccion,
-        "distancia_km": distancia_info.get("distancia_km") if distancia_info else None,
-        "dentro_radio_envio": distancia_info.get("dentro_radio") if distancia_info else None
-    }
-    
-    result = await ordenes_col.insert_one(nueva_orden)
-    orden_creada = await ordenes_col.find_one({"_id": result.inserted_id})
+    try:
+        orden = await ordenes_service.crear_desde_carrito(usuario_email, orden_data, usuario)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     
-    return {
+    return RespuestaJSON({
         "message": "Orden creada exitosamente",
-        "orden": serializar_orden(orden_creada)
-    }
+        "orden": serializar_orden(orden)
+    })
 
 @app.post("/ordenes/{orden_id}/pagar")
-async def procesar_pago(orden_id: str, pago_data: dict = Body(...)):
+async def procesar_pago(request: Request, orden_id: str, pago_data: dict = Body(...)):
     """Procesa el pago de una orden"""
-    orden = await ordenes_col.find_one({"_id": ObjectId(orden_id)})
-    if not orden:
-        raise HTTPException(status_code=404, detail="Orden no encontrada")
-    
-    if orden.get("estado") != "pendiente":
-        raise HTTPException(status_code=400, detail=f"La orden ya está {orden.get('estado')}")
-    
-    usuario_email = orden.get("usuario_email")
-    medio_pago_id = pago_data.get("medio_pago_id")
-    
-    # Verificar que el medio de pago pertenece al usuario
-    if medio_pago_id:
-        usuario = await usuarios_col.find_one({"correo": usuario_email})
-        if usuario:
-            medios_pago = usuario.get("medios_pago", [])
-            medio_encontrado = any(str(m.get("_id")) == medio_pago_id for m in medios_pago)
-            if not medio_encontrado:
-                raise HTTPException(status_code=400, detail="Medio de pago no válido")
-    
     # Simular procesamiento de pago (aquí integrarías con pasarela real)
     # Por ahora, marcamos como pagado directamente
-    from datetime import datetime
     metodo_pago_usado = pago_data.get("metodo_pago", "tarjeta_guardada")  # mercadopago, applepay, tarjeta_guardada
+    sesion = sesion_de(request)
+    usuario = await sesiones_service.obtener_usuario(sesion["sub"]) if sesion else None
+    try:
+        orden = await ordenes_service.pagar(orden_id, pago_data.get("medio_pago_id"), metodo_pago_usado, usuario)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if not orden:
+        raise HTTPException(status_code=404, detail="Orden no encontrada")
     
-    update_data = {
-        "estado": "pagado",
-        "fecha_pago": datetime.now().isoformat(),
-        "metodo_pago_usado": metodo_pago_usado
-    }
-    
-    if medio_pago_id:
-        update_data["medio_pago_id"] = ObjectId(medio_pago_id)
-    else:
-        update_data["medio_pago_id"] = None
-    
-    await ordenes_col.update_one(
-        {"_id": ObjectId(orden_id)},
-        {"$set": update_data}
-    )
-    
-    # Vaciar carrito del usuario después del pago exitoso
-    await carrito_col.delete_many({"usuario_email": usuario_email})
-    
-    orden_actualizada = await ordenes_col.find_one({"_id": ObjectId(orden_id)})
-    
-    return {
+    return RespuestaJSON({
         "message": "Pago procesado exitosamente",
-        "orden": serializar_orden(orden_actualizada)
-    }
+        "orden": serializar_orden(orden)
+    })
 
 @app.get("/ordenes")
-async def obtener_ordenes(usuario_email: str = None):
-    """Obtiene las órdenes de un usuario o todas si es super usuario"""
-    query = {}
-    if usuario_email:
-        query["usuario_email"] = usuario_email
-    
-    ordenes = []
-    async for orden in ordenes_col.find(query).sort("fecha_creacion", -1):
-        ordenes.append(serializar_orden(orden))
-    
-    return ordenes
+async def obtener_ordenes(
+    usuario_email: str = None,
+    estado: str = None,
+    fecha: str = None,
+    limite: int = None,
+    cursor: str = None
+):
+    """
+    Obtiene una página de las órdenes de un usuario (o de todas para el
+    super usuario), de la más reciente a la más antigua, filtrables por
+    estado y día (AAAA-MM-DD). El cursor de la página siguiente viene en el
+    header X-Siguiente-Cursor.
+    """
+    try:
+        ordenes, siguiente_cursor = await ordenes_service.listar(
+            usuario_email=usuario_email, estado=estado, fecha=fecha, limite=limite, cursor=cursor
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    headers = {"X-Siguiente-Cursor": siguiente_cursor} if siguiente_cursor else None
+    return RespuestaJSON(ordenes, headers=headers)
+
+@app.get("/ordenes/export")
+async def exportar_ordenes(formato: str = "ndjson", usuario_email: str = None, estado: str = None, fecha: str = None):
+    """Descarga el historial de órdenes (completo o filtrado) en NDJSON o CSV, en streaming"""
+    try:
+        formato = detectar_formato(formato)
+        contenido = ordenes_service.exportar(formato, usuario_email=usuario_email, estado=estado, fecha=fecha)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return StreamingResponse(
+        contenido,
+        media_type=TIPOS_CONTENIDO[formato],
+        headers={"Content-Disposition": f'attachment; filename="ordenes.{formato}"'}
+    )
 
 @app.get("/ordenes/{orden_id}")
 async def obtener_orden(orden_id: str):
     """Obtiene una orden específica"""
-    orden = await ordenes_col.find_one({"_id": ObjectId(orden_id)})
+    orden = await ordenes_col.find_one({"_id": ObjectId(orden_id)}, PROYECCION_ORDEN)
     if not orden:
         raise HTTPException(status_code=404, detail="Orden no encontrada")
     
-    return serializar_orden(orden)
+    return RespuestaJSON(serializar_orden(orden))
 
 @app.put("/ordenes/{orden_id}/cancelar")
 async def cancelar_orden(orden_id: str):
     """Cancela una orden pendiente"""
-    orden = await ordenes_col.find_one({"_id": ObjectId(orden_id)})
+    try:
+        orden = await ordenes_service.cancelar(orden_id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     if not orden:
         raise HTTPException(status_code=404, detail="Orden no encontrada")
     
-    if orden.get("estado") != "pendiente":
-        raise HTTPException(status_code=400, detail=f"No se puede cancelar una orden que está {orden.get('estado')}. Solo se pueden cancelar órdenes pendientes.")
-    
-    from datetime import datetime
-    await ordenes_col.update_one(
-        {"_id": ObjectId(orden_id)},
-        {
-            "$set": {
-                "estado": "cancelado",
-                "fecha_cancelacion": datetime.now().isoformat()
-            }
-        }
-    )
-    
-    orden_actualizada = await ordenes_col.find_one({"_id": ObjectId(orden_id)})
-    
-    return {
+    return RespuestaJSON({
         "message": "Orden cancelada exitosamente",
-        "orden": serializar_orden(orden_actualizada)
-    }
\ No newline at end of file
+        "orden": serializar_orden(orden)
+    })
@@ -2,12 +2,75 @@
 Modelos de Autenticación
 Funciones relacionadas con autenticación y autorización
 """
+import hmac
+import base64
 import hashlib
+import secrets
 
-def hash_password(password: str) -> str:
-    """Hashea la contraseña usando SHA256"""
+# Parámetros de scrypt: el costo (log2 de N) es configurable; r y p fijos
+SCRYPT_R = 8
+SCRYPT_P = 1
+LARGO_SAL = 16
+LARGO_HASH = 32
+COSTO_MAXIMO = 19  # N = 2^19 con r=8 ya usa 512 MB por hash
+
+def _b64(datos: bytes) -> str:
+    return base64.b64encode(datos).decode("ascii").rstrip("=")
+
+def _desde_b64(texto: str) -> bytes:
+    return base64.b64decode(texto + "=" * (-len(texto) % 4))
+
+def _scrypt(password: str, sal: bytes, costo: int, r: int, p: int) -> bytes:
+    n = 2 ** costo
+    return hashlib.scrypt(
+        password.encode("utf-8"), salt=sal, n=n, r=r, p=p,
+        maxmem=min(2 * 128 * r * n, 2 ** 31 - 1), dklen=LARGO_HASH
+    )
+
+def hash_password_legado(password: str) -> str:
+    """SHA-256 sin sal: solo para verificar contraseñas guardadas antes de scrypt"""
     return hashlib.sha256(password.encode()).hexdigest()
 
+def es_hash_legado(hash_guardado: str) -> bool:
+    """Indica si el hash es el SHA-256 hexadecimal anterior a scrypt"""
+    return len(hash_guardado) == 64 and "$" not in hash_guardado
+
+def hash_password(password: str, costo: int) -> str:
+    """
+    Hashea la contraseña con scrypt y sal aleatoria. Formato:
+    scrypt$costo$r$p$sal$hash (sal y hash en base64 sin relleno)
+    """
+    if not 1 <= costo <= COSTO_MAXIMO:
+        raise ValueError(f"El costo de scrypt debe estar entre 1 y {COSTO_MAXIMO}")
+    sal = secrets.token_bytes(LARGO_SAL)
+    derivado = _scrypt(password, sal, costo, SCRYPT_R, SCRYPT_P)
+    return f"scrypt${costo}${SCRYPT_R}${SCRYPT_P}${_b64(sal)}${_b64(derivado)}"
+
+def verificar_password(password: str, hash_guardado: str) -> bool:
+    """Compara en tiempo constante contra un hash scrypt o uno SHA-256 legado"""
+    if not hash_guardado:
+        return False
+    if es_hash_legado(hash_guardado):
+        return hmac.compare_digest(hash_password_legado(password), hash_guardado)
+    try:
+        algoritmo, costo, r, p, sal, derivado = hash_guardado.split("$")
+        if algoritmo != "scrypt" or not 1 <= int(costo) <= COSTO_MAXIMO:
+            return False
+        calculado = _scrypt(password, _desde_b64(sal), int(costo), int(r), int(p))
+    except ValueError:
+        return False
+    return hmac.compare_digest(calculado, _desde_b64(derivado))
+
+def necesita_rehash(hash_guardado: str, costo: int) -> bool:
+    """
+    Indica si el hash es legado o más débil que el costo actual. Un costo
+    mayor se conserva: la calibración puede variar un punto entre reinicios.
+    """
+    if es_hash_legado(hash_guardado):
+        return True
+    partes = hash_guardado.split("$")
+    return partes[0] != "scrypt" or partes[2:4] != [str(SCRYPT_R), str(SCRYPT_P)] or int(partes[1]) < costo
+
 def es_super_usuario(correo: str) -> bool:
     """Verifica si un correo pertenece a un super usuario"""
     if not correo:
@@ -0,0 +1,43 @@
+"""
+Codificación JSON
+Capa de modelos: codificador JSON rápido (orjson si está instalado) que
+convierte ObjectId y fechas por sí mismo, y la respuesta HTTP que lo usa
+para enviar bytes ya codificados sin pasar por jsonable_encoder
+"""
+import json
+from datetime import date, datetime
+from bson import ObjectId
+from fastapi.responses import Response
+
+# orjson es opcional: sin él se usa json de la biblioteca estándar
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+def _convertir(valor):
+    """Tipos que no son JSON nativo: ObjectId como texto, fechas en ISO 8601"""
+    if isinstance(valor, ObjectId):
+        return str(valor)
+    if isinstance(valor, (datetime, date)):
+        return valor.isoformat()
+    raise TypeError(f"Tipo no serializable a JSON: {type(valor).__name__}")
+
+def codificar_json(datos) -> bytes:
+    """Codifica a JSON compacto en UTF-8 (mismo formato con o sin orjson)"""
+    if orjson is not None:
+        return orjson.dumps(datos, default=_convertir, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(datos, default=_convertir, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+class RespuestaJSON(Response):
+    """
+    Respuesta JSON codificada con codificar_json. Un controlador que la
+    retorna directamente evita el recorrido de jsonable_encoder; si el
+    contenido ya son bytes JSON, se envían tal cual.
+    """
+    media_type = "application/json"
+
+    def render(self, contenido) -> bytes:
+        if isinstance(contenido, bytes):
+            return contenido
+        return codificar_json(contenido)
@@ -0,0 +1,233 @@
+"""
+Métricas
+Capa de modelos: contadores e histogramas en memoria exportados en el
+formato de texto de Prometheus, el middleware ASGI que mide cada petición
+por ruta y el listener de comandos de MongoDB que los atribuye a la
+petición en curso (vía contextvars)
+"""
+import os
+import time
+import threading
+from bisect import bisect_left
+from contextvars import ContextVar
+from pymongo import monitoring
+
+METRICAS_HABILITADAS = os.getenv("METRICAS_HABILITADAS", "1") == "1"
+TIPO_CONTENIDO = "text/plain; version=0.0.4; charset=utf-8"
+
+# Límites superiores de los buckets (segundos o cantidad)
+BUCKETS_LATENCIA = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+BUCKETS_MONGO = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+BUCKETS_COMANDOS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+def _escapar(valor) -> str:
+    return str(valor).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _etiquetas(nombres: tuple, valores: tuple, extra: str = "") -> str:
+    partes = [f'{nombre}="{_escapar(valor)}"' for nombre, valor in zip(nombres, valores)]
+    if extra:
+        partes.append(extra)
+    return "{" + ",".join(partes) + "}" if partes else ""
+
+def _numero(valor) -> str:
+    return repr(float(valor)) if isinstance(valor, float) else str(valor)
+
+class Contador:
+    """Contador monótono por combinación de etiquetas"""
+    tipo = "counter"
+
+    def __init__(self, nombre: str, ayuda: str, etiquetas: tuple = ()):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = etiquetas
+        self._valores = {}
+        self._lock = threading.Lock()  # El listener de MongoDB corre en hilos de Motor
+
+    def incrementar(self, *etiquetas, valor=1):
+        with self._lock:
+            self._valores[etiquetas] = self._valores.get(etiquetas, 0) + valor
+
+    def exportar(self) -> list:
+        with self._lock:
+            valores = list(self._valores.items())
+        return [f"{self.nombre}{_etiquetas(self.etiquetas, clave)} {_numero(valor)}" for clave, valor in valores]
+
+class Histograma:
+    """
+    Histograma de buckets fijos por combinación de etiquetas. Cada serie
+    guarda conteos no acumulados (uno por bucket más +Inf) y la suma;
+    observar es una búsqueda binaria y dos incrementos.
+    """
+    tipo = "histogram"
+
+    def __init__(self, nombre: str, ayuda: str, etiquetas: tuple = (), buckets: tuple = BUCKETS_LATENCIA):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = etiquetas
+        self.buckets = buckets
+        self._series = {}  # etiquetas -> [conteos, suma]
+        self._lock = threading.Lock()
+
+    def observar(self, valor: float, *etiquetas):
+        with self._lock:
+            serie = self._series.get(etiquetas)
+            if serie is None:
+                serie = self._series[etiquetas] = [[0] * (len(self.buckets) + 1), 0.0]
+            serie[0][bisect_left(self.buckets, valor)] += 1
+            serie[1] += valor
+
+    def exportar(self) -> list:
+        with self._lock:
+            series = [(clave, list(conteos), suma) for clave, (conteos, suma) in self._series.items()]
+        lineas = []
+        for clave, conteos, suma in series:
+            acumulado = 0
+            for limite, conteo in zip(self.buckets + ("+Inf",), conteos):
+                acumulado += conteo
+                le = 'le="%s"' % limite
+                lineas.append(f"{self.nombre}_bucket{_etiquetas(self.etiquetas, clave, le)} {acumulado}")
+            lineas.append(f"{self.nombre}_sum{_etiquetas(self.etiquetas, clave)} {_numero(suma)}")
+            lineas.append(f"{self.nombre}_count{_etiquetas(self.etiquetas, clave)} {acumulado}")
+        return lineas
+
+class RegistroMetricas:
+    """Conjunto de métricas del proceso, exportable como texto de Prometheus"""
+
+    def __init__(self):
+        self.metricas = []
+
+    def contador(self, nombre: str, ayuda: str, etiquetas: tuple = ()) -> Contador:
+        metrica = Contador(nombre, ayuda, etiquetas)
+        self.metricas.append(metrica)
+        return metrica
+
+    def histograma(self, nombre: str, ayuda: str, etiquetas: tuple = (), buckets: tuple = BUCKETS_LATENCIA) -> Histograma:
+        metrica = Histograma(nombre, ayuda, etiquetas, buckets)
+        self.metricas.append(metrica)
+        return metrica
+
+    def exportar(self) -> str:
+        lineas = []
+        for metrica in self.metricas:
+            lineas.append(f"# HELP {metrica.nombre} {metrica.ayuda}")
+            lineas.append(f"# TYPE {metrica.nombre} {metrica.tipo}")
+            lineas.extend(metrica.exportar())
+        return "\n".join(lineas) + "\n"
+
+registro = RegistroMetricas()
+
+peticiones_segundos = registro.histograma(
+    "tienda_http_peticion_segundos", "Duración de las peticiones HTTP por ruta",
+    ("metodo", "ruta"), BUCKETS_LATENCIA
+)
+respuestas_total = registro.contador(
+    "tienda_http_respuestas_total", "Respuestas HTTP por ruta y código de estado",
+    ("metodo", "ruta", "estado")
+)
+comandos_por_peticion = registro.histograma(
+    "tienda_http_mongo_comandos_por_peticion", "Comandos de MongoDB ejecutados por cada petición",
+    ("metodo", "ruta"), BUCKETS_COMANDOS
+)
+mongo_segundos_por_ruta = registro.contador(
+    "tienda_http_mongo_segundos_total", "Tiempo en comandos de MongoDB atribuido a cada ruta",
+    ("metodo", "ruta")
+)
+mongo_comandos_segundos = registro.histograma(
+    "tienda_mongo_comando_segundos", "Duración de los comandos de MongoDB por colección",
+    ("coleccion", "comando"), BUCKETS_MONGO
+)
+mongo_comandos_fallidos = registro.contador(
+    "tienda_mongo_comandos_fallidos_total", "Comandos de MongoDB que terminaron en error",
+    ("coleccion", "comando")
+)
+geocodificacion_segundos = registro.histograma(
+    "tienda_geocodificacion_segundos", "Resolución de direcciones por origen (cache, nominatim, error)",
+    ("origen",), BUCKETS_LATENCIA
+)
+nominatim_segundos = registro.histograma(
+    "tienda_nominatim_http_segundos", "Duración de las solicitudes HTTP a Nominatim",
+    ("resultado",), BUCKETS_LATENCIA
+)
+
+class _MedicionPeticion:
+    """Comandos de MongoDB acumulados por la petición en curso"""
+    __slots__ = ("comandos", "segundos")
+
+    def __init__(self):
+        self.comandos = 0
+        self.segundos = 0.0
+
+_peticion_actual = ContextVar("peticion_actual", default=None)
+_lock_peticiones = threading.Lock()
+
+class EscuchaComandosMongo(monitoring.CommandListener):
+    """
+    Listener de comandos de pymongo. Motor ejecuta cada operación en su pool
+    de hilos copiando el contexto de la tarea que la pidió, así que aquí se
+    ve la medición de la petición que originó el comando.
+    """
+
+    def __init__(self):
+        self._en_curso = {}  # (conexión, request_id) -> colección
+
+    def started(self, event):
+        comando = event.command
+        coleccion = comando.get("collection") if event.command_name == "getMore" else comando.get(event.command_name)
+        self._en_curso[(event.connection_id, event.request_id)] = coleccion if isinstance(coleccion, str) else "-"
+
+    def succeeded(self, event):
+        self._terminar(event)
+
+    def failed(self, event):
+        coleccion = self._terminar(event)
+        mongo_comandos_fallidos.incrementar(coleccion, event.command_name)
+
+    def _terminar(self, event) -> str:
+        coleccion = self._en_curso.pop((event.connection_id, event.request_id), "-")
+        segundos = event.duration_micros / 1e6
+        mongo_comandos_segundos.observar(segundos, coleccion, event.command_name)
+        medicion = _peticion_actual.get()
+        if medicion is not None:
+            with _lock_peticiones:
+                medicion.comandos += 1
+                medicion.segundos += segundos
+        return coleccion
+
+escucha_mongo = EscuchaComandosMongo()
+
+class MiddlewareMetricas:
+    """
+    Middleware ASGI: mide cada petición HTTP y la registra por método y
+    plantilla de ruta (p. ej. "/ordenes/{orden_id}"), junto con los comandos
+    de MongoDB y el tiempo en la base que se le atribuyeron.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        medicion = _MedicionPeticion()
+        token = _peticion_actual.set(medicion)
+        estado = 500
+
+        async def enviar(mensaje):
+            nonlocal estado
+            if mensaje["type"] == "http.response.start":
+                estado = mensaje["status"]
+            await send(mensaje)
+
+        inicio = time.perf_counter()
+        try:
+            await self.app(scope, receive, enviar)
+        finally:
+            duracion = time.perf_counter() - inicio
+            _peticion_actual.reset(token)
+            ruta = getattr(scope.get("route"), "path", None) or "sin_ruta"
+            metodo = scope["method"]
+            peticiones_segundos.observar(duracion, metodo, ruta)
+            respuestas_total.incrementar(metodo, ruta, estado)
+            comandos_por_peticion.observar(medicion.comandos, metodo, ruta)
+            if medicion.segundos:
+                mongo_segundos_por_ruta.incrementar(metodo, ruta, valor=medicion.segundos)
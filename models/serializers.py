@@ -2,10 +2,98 @@
 Modelos y Serializadores
 Capa de modelos: funciones para serializar datos
 """
+import struct
+import bson
 from bson import ObjectId
+from bson.errors import InvalidBSON
+from bson.raw_bson import RawBSONDocument
+
+# Proyecciones de MongoDB con exactamente los campos que lee cada serializador
+# (el _id siempre viene). ObjectId y fechas anidadas se dejan tal cual: los
+# convierte el codificador JSON (models/codificacion.py).
+PROYECCION_PRODUCTO = {"nombre": 1, "precio": 1, "categoria": 1, "imagen": 1, "estado": 1}
+PROYECCION_FAVORITO = {"producto_id": 1, **PROYECCION_PRODUCTO}
+PROYECCION_USUARIO = {
+    "nombres": 1, "apellidos": 1, "rut": 1, "domicilio": 1, "correo": 1, "telefono": 1,
+    "usuario": 1, "imagen_perfil": 1, "latitud": 1, "longitud": 1
+}
+PROYECCION_ORDEN = {
+    "usuario_email": 1, "productos": 1, "subtotal": 1, "descuento": 1, "envio": 1, "total": 1,
+    "estado": 1, "medio_pago_id": 1, "metodo_pago_usado": 1, "fecha_creacion": 1, "fecha_pago": 1,
+    "fecha_cancelacion": 1, "cupon_codigo": 1, "cupones": 1, "direccion_envio": 1,
+    "distancia_km": 1, "dentro_radio_envio": 1
+}
+PROYECCION_ORDEN_RESUMEN = {
+    "usuario_email": 1, "productos.nombre": 1, "productos.precio": 1,
+    "productos.cantidad": 1, "total": 1, "estado": 1, "fecha_creacion": 1
+}
+
+# --- Extracción perezosa desde BSON crudo ---
+# Con la lectura en BSON crudo (LECTURA_BSON_CRUDO, repositories/database.py)
+# los documentos llegan como RawBSONDocument, que al leer cualquier campo
+# decodifica el documento completo. extraer_campos() recorre los bytes
+# saltando los elementos que no se piden y decodifica solo los pedidos.
+
+# Tamaño fijo del valor según el tipo de elemento BSON
+_TAMANOS_FIJOS = {
+    0x01: 8, 0x06: 0, 0x07: 12, 0x08: 1, 0x09: 8, 0x0A: 0,
+    0x10: 4, 0x11: 8, 0x12: 8, 0x13: 16, 0x7F: 0, 0xFF: 0
+}
+_ENTERO = struct.Struct("<i")
+
+def _fin_valor(crudo: bytes, tipo: int, inicio: int) -> int:
+    """Posición siguiente al valor de un elemento que empieza en `inicio`"""
+    fijo = _TAMANOS_FIJOS.get(tipo)
+    if fijo is not None:
+        return inicio + fijo
+    largo = _ENTERO.unpack_from(crudo, inicio)[0]
+    if tipo in (0x02, 0x0D, 0x0E):  # texto, código, símbolo
+        return inicio + 4 + largo
+    if tipo in (0x03, 0x04, 0x0F):  # documento, arreglo, código con ámbito (largo incluido)
+        return inicio + largo
+    if tipo == 0x05:  # binario: largo + subtipo
+        return inicio + 5 + largo
+    if tipo == 0x0C:  # DBPointer: texto + ObjectId
+        return inicio + 4 + largo + 12
+    if tipo == 0x0B:  # expresión regular: dos cstrings
+        return crudo.index(b"\x00", crudo.index(b"\x00", inicio) + 1) + 1
+    raise InvalidBSON(f"Tipo BSON desconocido: {tipo:#x}")
+
+def campos_proyeccion(proyeccion: dict) -> frozenset:
+    """Campos de primer nivel (como bytes) que trae una proyección, _id incluido"""
+    return frozenset(campo.split(".")[0].encode("utf-8") for campo in ("_id", *proyeccion))
+
+def extraer_campos(documento, campos: frozenset):
+    """
+    Retorna un dict con solo `campos` (de campos_proyeccion) de un
+    RawBSONDocument, decodificados en una sola llamada y sin materializar
+    el resto. Cualquier otro documento (dict) se retorna tal cual.
+    """
+    if not isinstance(documento, RawBSONDocument):
+        return documento
+    crudo = documento.raw
+    elementos = []
+    pendientes = len(campos)
+    posicion, fin = 4, len(crudo) - 1
+    while posicion < fin and pendientes:
+        tipo = crudo[posicion]
+        fin_nombre = crudo.index(b"\x00", posicion + 1)
+        fin_elemento = _fin_valor(crudo, tipo, fin_nombre + 1)
+        if crudo[posicion + 1:fin_nombre] in campos:
+            elementos.append(crudo[posicion:fin_elemento])
+            pendientes -= 1
+        posicion = fin_elemento
+    cuerpo = b"".join(elementos)
+    return bson.decode(_ENTERO.pack(len(cuerpo) + 5) + cuerpo + b"\x00")
+
+_CAMPOS_PRODUCTO = campos_proyeccion(PROYECCION_PRODUCTO)
+_CAMPOS_FAVORITO = campos_proyeccion(PROYECCION_FAVORITO)
+_CAMPOS_ORDEN = campos_proyeccion(PROYECCION_ORDEN)
+_CAMPOS_ORDEN_RESUMEN = campos_proyeccion(PROYECCION_ORDEN_RESUMEN)
 
 def serializar_producto(prod):
     """Serializa un producto de MongoDB a formato JSON"""
+    prod = extraer_campos(prod, _CAMPOS_PRODUCTO)
     return {
         "_id": str(prod["_id"]),
         "nombre": prod["nombre"],
@@ -19,15 +107,58 @@ def serializar_carrito(item):
     """Serializa un item del carrito de MongoDB a formato JSON"""
     return {
         "_id": str(item["_id"]),
+        "producto_id": item.get("producto_id", ""),
         "nombre": item["nombre"],
         "precio": item["precio"],
+        "cantidad": item.get("cantidad", 1),
         "imagen": item.get("imagen", "")
     }
 
+def serializar_orden(orden):
+    """Serializa una orden para respuesta JSON"""
+    orden = extraer_campos(orden, _CAMPOS_ORDEN)
+    return {
+        "_id": str(orden["_id"]),
+        "usuario_email": orden.get("usuario_email", ""),
+        "productos": orden.get("productos", []),
+        "subtotal": orden.get("subtotal", 0),
+        "descuento": orden.get("descuento", 0),
+        "envio": orden.get("envio", 0),
+        "total": orden.get("total", 0),
+        "estado": orden.get("estado", "pendiente"),
+        "medio_pago_id": orden.get("medio_pago_id") or None,
+        "metodo_pago_usado": orden.get("metodo_pago_usado", "tarjeta_guardada"),
+        "fecha_creacion": orden.get("fecha_creacion", ""),
+        "fecha_pago": orden.get("fecha_pago", ""),
+        "fecha_cancelacion": orden.get("fecha_cancelacion", ""),
+        "cupon_codigo": orden.get("cupon_codigo", ""),
+        "cupones": orden.get("cupones", []),
+        "direccion_envio": orden.get("direccion_envio", ""),
+        "distancia_km": orden.get("distancia_km"),
+        "dentro_radio_envio": orden.get("dentro_radio_envio")
+    }
+
+def serializar_orden_resumen(orden):
+    """Serializa una orden del historial (solo los campos del listado)"""
+    orden = extraer_campos(orden, _CAMPOS_ORDEN_RESUMEN)
+    return {
+        "_id": str(orden["_id"]),
+        "usuario_email": orden.get("usuario_email", ""),
+        "productos": [
+            {"nombre": p.get("nombre", ""), "precio": p.get("precio", 0), "cantidad": p.get("cantidad", 1)}
+            for p in orden.get("productos", [])
+        ],
+        "total": orden.get("total", 0),
+        "estado": orden.get("estado", "pendiente"),
+        "fecha_creacion": orden.get("fecha_creacion", "")
+    }
+
 def serializar_favorito(fav):
     """Serializa un favorito de MongoDB a formato JSON"""
+    fav = extraer_campos(fav, _CAMPOS_FAVORITO)
     return {
         "_id": str(fav["_id"]),
+        "producto_id": fav.get("producto_id", ""),
         "nombre": fav["nombre"],
         "precio": fav["precio"],
         "categoria": fav["categoria"],
@@ -53,5 +184,13 @@ def serializar_usuario(usuario, es_super_usuario_func):
         "longitud": usuario.get("longitud")
     }
 
-
-
+def serializar_sucursal(sucursal):
+    """Serializa una sucursal de MongoDB a formato JSON"""
+    return {
+        "_id": str(sucursal["_id"]),
+        "nombre": sucursal.get("nombre", ""),
+        "direccion": sucursal.get("direccion", ""),
+        "latitud": sucursal["latitud"],
+        "longitud": sucursal["longitud"],
+        "activa": sucursal.get("activa", True)
+    }
@@ -0,0 +1,195 @@
+"""
+Repositorio de Analítica
+Capa de acceso a datos: acumulados de ventas (`ventas_resumen`) mantenidos
+con $inc al pagar o cancelar, y pipelines de agregación para leerlos y para
+reconstruirlos desde `ordenes`
+"""
+from repositories.database import ventas_resumen_col, ordenes_col
+
+# Campos sumables de los acumulados por día
+CAMPOS_DIA = (
+    "ordenes_pagadas", "ingresos", "subtotal", "descuentos", "envio",
+    "distancia_total", "ordenes_con_distancia", "ordenes_canceladas", "monto_cancelado"
+)
+CAMPOS_PRODUCTO = ("cantidad", "ingresos")
+CAMPOS_CUPON = ("usos", "descuento_total", "ingresos", "canceladas")
+
+def _dia(campo_fecha: str) -> dict:
+    """Expresión: día AAAA-MM-DD de una fecha ISO 8601 guardada como texto"""
+    return {"$substrBytes": [campo_fecha, 0, 10]}
+
+def _semana(expresion_dia) -> dict:
+    """Expresión: semana ISO (AAAA-Www) de un día AAAA-MM-DD"""
+    return {"$dateToString": {
+        "date": {"$dateFromString": {"dateString": expresion_dia, "format": "%Y-%m-%d"}},
+        "format": "%G-W%V"
+    }}
+
+def _fusionar() -> dict:
+    """Etapa final de reconstrucción: crea el acumulado o le agrega los campos calculados"""
+    return {"$merge": {"into": ventas_resumen_col.name, "whenMatched": "merge", "whenNotMatched": "insert"}}
+
+def _acumulado_dia() -> list:
+    """Etapas comunes: el _id agrupado (día) pasa a ser el acumulado dia:AAAA-MM-DD"""
+    return [
+        {"$set": {"_id": {"$concat": ["dia:", "$_id"]}, "tipo": "dia", "dia": "$_id", "semana": _semana("$_id")}},
+        _fusionar(),
+    ]
+
+# Clave de un producto vendido: producto_id, o el nombre en órdenes anteriores a producto_id
+CLAVE_PRODUCTO = {"$cond": [
+    {"$gt": [{"$ifNull": ["$productos.producto_id", ""]}, ""]},
+    "$productos.producto_id",
+    {"$ifNull": ["$productos.nombre", ""]}
+]}
+
+PIPELINES_RECONSTRUCCION = [
+    # Ventas pagadas por día
+    [
+        {"$match": {"estado": "pagado", "fecha_pago": {"$type": "string"}}},
+        {"$group": {
+            "_id": _dia("$fecha_pago"),
+            "ordenes_pagadas": {"$sum": 1},
+            "ingresos": {"$sum": "$total"},
+            "subtotal": {"$sum": "$subtotal"},
+            "descuentos": {"$sum": "$descuento"},
+            "envio": {"$sum": "$envio"},
+            "distancia_total": {"$sum": "$distancia_km"},
+            "ordenes_con_distancia": {"$sum": {"$cond": [{"$isNumber": "$distancia_km"}, 1, 0]}},
+        }},
+        *_acumulado_dia(),
+    ],
+    # Cancelaciones por día
+    [
+        {"$match": {"estado": "cancelado", "fecha_cancelacion": {"$type": "string"}}},
+        {"$group": {
+            "_id": _dia("$fecha_cancelacion"),
+            "ordenes_canceladas": {"$sum": 1},
+            "monto_cancelado": {"$sum": "$total"},
+        }},
+        *_acumulado_dia(),
+    ],
+    # Productos vendidos por día
+    [
+        {"$match": {"estado": "pagado", "fecha_pago": {"$type": "string"}}},
+        {"$unwind": "$productos"},
+        {"$group": {
+            "_id": {"dia": _dia("$fecha_pago"), "producto_id": CLAVE_PRODUCTO},
+            "nombre": {"$last": "$productos.nombre"},
+            "cantidad": {"$sum": {"$ifNull": ["$productos.cantidad", 1]}},
+            "ingresos": {"$sum": {"$multiply": [
+                {"$ifNull": ["$productos.precio", 0]}, {"$ifNull": ["$productos.cantidad", 1]}
+            ]}},
+        }},
+        {"$set": {
+            "_id": {"$concat": ["producto:", "$_id.dia", ":", "$_id.producto_id"]},
+            "tipo": "producto", "dia": "$_id.dia", "producto_id": "$_id.producto_id",
+        }},
+        _fusionar(),
+    ],
+    # Uso de cupones por día (pagadas y canceladas); las órdenes anteriores
+    # a `cupones` solo tienen cupon_codigo y el descuento total
+    [
+        {"$match": {"cupon_codigo": {"$type": "string", "$ne": ""}, "$or": [
+            {"estado": "pagado", "fecha_pago": {"$type": "string"}},
+            {"estado": "cancelado", "fecha_cancelacion": {"$type": "string"}},
+        ]}},
+        {"$set": {
+            "pagada": {"$eq": ["$estado", "pagado"]},
+            "cupon": {"$ifNull": ["$cupones", [{"codigo": "$cupon_codigo", "descuento": "$descuento"}]]},
+        }},
+        {"$unwind": "$cupon"},
+        {"$group": {
+            "_id": {
+                "dia": _dia({"$cond": ["$pagada", "$fecha_pago", "$fecha_cancelacion"]}),
+                "cupon": "$cupon.codigo",
+            },
+            "usos": {"$sum": {"$cond": ["$pagada", 1, 0]}},
+            "descuento_total": {"$sum": {"$cond": ["$pagada", "$cupon.descuento", 0]}},
+            "ingresos": {"$sum": {"$cond": ["$pagada", "$total", 0]}},
+            "canceladas": {"$sum": {"$cond": ["$pagada", 0, 1]}},
+        }},
+        {"$set": {
+            "_id": {"$concat": ["cupon:", "$_id.dia", ":", "$_id.cupon"]},
+            "tipo": "cupon", "dia": "$_id.dia", "cupon": "$_id.cupon",
+        }},
+        _fusionar(),
+    ],
+]
+
+def _filtro_dias(tipo: str, desde: str = None, hasta: str = None) -> dict:
+    filtro = {"tipo": tipo}
+    if desde or hasta:
+        filtro["dia"] = {}
+        if desde:
+            filtro["dia"]["$gte"] = desde
+        if hasta:
+            filtro["dia"]["$lte"] = hasta
+    return filtro
+
+def _sumas(campos) -> dict:
+    return {campo: {"$sum": f"${campo}"} for campo in campos}
+
+class AnaliticaRepository:
+    """Repositorio para acumulados de ventas"""
+
+    async def acumular(self, operaciones: list, session=None):
+        """Aplica los $inc de una orden sobre sus acumulados en un solo viaje"""
+        if operaciones:
+            await ventas_resumen_col.bulk_write(operaciones, ordered=False, session=session)
+
+    async def ventas_por_periodo(self, periodo: str, desde: str = None, hasta: str = None) -> list:
+        """Suma los acumulados diarios por `periodo` ("dia" o "semana"), en orden cronológico"""
+        pipeline = [
+            {"$match": _filtro_dias("dia", desde, hasta)},
+            {"$group": {"_id": f"${periodo}", **_sumas(CAMPOS_DIA)}},
+            {"$sort": {"_id": 1}},
+        ]
+        return await ventas_resumen_col.aggregate(pipeline).to_list(length=None)
+
+    async def total(self, desde: str = None, hasta: str = None):
+        """Suma todos los acumulados diarios del rango (None si no hay)"""
+        pipeline = [
+            {"$match": _filtro_dias("dia", desde, hasta)},
+            {"$group": {"_id": None, **_sumas(CAMPOS_DIA)}},
+        ]
+        resultado = await ventas_resumen_col.aggregate(pipeline).to_list(length=1)
+        return resultado[0] if resultado else None
+
+    async def top_productos(self, campo: str, limite: int, desde: str = None, hasta: str = None) -> list:
+        """Productos con mayor `campo` ("cantidad" o "ingresos") en el rango"""
+        pipeline = [
+            {"$match": _filtro_dias("producto", desde, hasta)},
+            {"$sort": {"dia": 1}},
+            {"$group": {"_id": "$producto_id", "nombre": {"$last": "$nombre"}, **_sumas(CAMPOS_PRODUCTO)}},
+            {"$sort": {campo: -1, "_id": 1}},
+            {"$limit": limite},
+        ]
+        return await ventas_resumen_col.aggregate(pipeline).to_list(length=None)
+
+    async def cupones(self, desde: str = None, hasta: str = None) -> list:
+        """Uso de cada cupón en el rango, del más usado al menos usado"""
+        pipeline = [
+            {"$match": _filtro_dias("cupon", desde, hasta)},
+            {"$group": {"_id": "$cupon", **_sumas(CAMPOS_CUPON)}},
+            {"$sort": {"usos": -1, "_id": 1}},
+        ]
+        return await ventas_resumen_col.aggregate(pipeline).to_list(length=None)
+
+    async def hay_acumulados(self) -> bool:
+        """Indica si ya existe algún acumulado"""
+        return await ventas_resumen_col.find_one({}, {"_id": 1}) is not None
+
+    async def contar_ordenes(self) -> int:
+        """Cantidad aproximada de órdenes (de los metadatos, sin recorrer la colección)"""
+        return await ordenes_col.estimated_document_count()
+
+    async def reconstruir(self):
+        """
+        Recalcula todos los acumulados desde `ordenes` con pipelines que
+        terminan en $merge (el servidor escribe el resultado; nada pasa por
+        la aplicación).
+        """
+        await ventas_resumen_col.delete_many({})
+        for pipeline in PIPELINES_RECONSTRUCCION:
+            await ordenes_col.aggregate(pipeline).to_list(length=None)
@@ -1,53 +1,111 @@
 """
 Repositorio de Carrito
-Capa de acceso a datos: operaciones CRUD sobre carrito
+Capa de acceso a datos: un documento por usuario en `carritos`
+({_id: correo, items: [...]}) modificado con $push / $pull / $inc
 """
-from bson import ObjectId
-from repositories.database import carrito_col
+from pymongo import UpdateOne
+from repositories.database import carritos_col, carrito_col
+
+# Cuántos ids de operación recuerda cada item para no aplicar dos veces un $inc
+OPERACIONES_RECORDADAS = 10
 
 class CarritoRepository:
     """Repositorio para operaciones con carrito"""
-    
+
     async def obtener_por_usuario(self, usuario_email: str):
-        """Obtiene el carrito de un usuario"""
-        items = []
-        async for item in carrito_col.find({"usuario_email": usuario_email}):
-            items.append(item)
-        return items
-    
+        """Obtiene los items del carrito de un usuario (None si nunca tuvo carrito)"""
+        carrito = await carritos_col.find_one({"_id": usuario_email}, {"items.aplicadas": 0})
+        return carrito.get("items", []) if carrito else None
+
     async def obtener_todos(self):
-        """Obtiene todos los items del carrito"""
+        """Obtiene todos los items de todos los carritos, con el correo de su dueño"""
         items = []
-        async for item in carrito_col.find():
-            items.append(item)
+        async for carrito in carritos_col.find({}, {"items.aplicadas": 0}):
+            for item in carrito.get("items", []):
+                items.append({**item, "usuario_email": carrito["_id"]})
         return items
-    
-    async def agregar_item(self, item: dict):
-        """Agrega un item al carrito"""
-        result = await carrito_col.insert_one(item)
-        return result.inserted_id
-    
-    async def buscar_item(self, usuario_email: str, nombre: str):
-        """Busca un item específico en el carrito del usuario"""
-        return await carrito_col.find_one({
-            "usuario_email": usuario_email,
-            "nombre": nombre
-        })
-    
-    async def eliminar_item(self, id_item: str, usuario_email: str = None):
-        """Elimina un item del carrito"""
-        query = {"_id": ObjectId(id_item)}
-        if usuario_email:
-            query["usuario_email"] = usuario_email
-        result = await carrito_col.delete_one(query)
-        return result.deleted_count > 0
-    
-    async def vaciar_carrito(self, usuario_email: str = None):
-        """Vacía el carrito de un usuario o todos"""
-        query = {}
-        if usuario_email:
-            query["usuario_email"] = usuario_email
-        await carrito_col.delete_many(query)
 
+    async def buscar_dueno_item(self, id_item):
+        """Obtiene el correo del usuario cuyo carrito contiene el item (None si no existe)"""
+        carrito = await carritos_col.find_one({"items._id": id_item}, {"_id": 1})
+        return carrito["_id"] if carrito else None
+
+    async def aplicar_cambios(self, cambios: list):
+        """
+        Aplica en un solo bulk_write los cambios netos de varios usuarios.
+        Cada cambio: {"usuario_email", "vaciar", "agregar": [(item, id_operacion)],
+        "quitar": [ids], "incrementos": [(id_item, delta, id_operacion)]}.
+        Todas las operaciones son idempotentes, así que repetir un lote
+        (reintento o reproducción del diario) no duplica su efecto.
+        """
+        operaciones = []
+        for cambio in cambios:
+            usuario = cambio["usuario_email"]
+            # Crear el documento si no existe, sin tocarlo si ya existe
+            operaciones.append(UpdateOne({"_id": usuario}, {"$setOnInsert": {"items": []}}, upsert=True))
+            if cambio["vaciar"]:
+                operaciones.append(UpdateOne({"_id": usuario}, {"$set": {"items": []}}))
+            if cambio["quitar"]:
+                # Antes de agregar: un producto quitado y vuelto a agregar tiene una línea nueva
+                operaciones.append(UpdateOne(
+                    {"_id": usuario},
+                    {"$pull": {"items": {"_id": {"$in": cambio["quitar"]}}}}
+                ))
+            for item, id_operacion in cambio["agregar"]:
+                # Una línea por producto: solo se agrega si el producto no está...
+                operaciones.append(UpdateOne(
+                    {"_id": usuario, "items.producto_id": {"$ne": item["producto_id"]}},
+                    {"$push": {"items": item}}
+                ))
+                # ...y si otro proceso ya lo agregó, la cantidad se suma a su línea
+                operaciones.append(self._incremento(
+                    usuario, {"producto_id": item["producto_id"], "_id": {"$ne": item["_id"]}},
+                    item["cantidad"], id_operacion
+                ))
+            for id_item, delta, id_operacion in cambio["incrementos"]:
+                operaciones.append(self._incremento(usuario, {"_id": id_item}, delta, id_operacion))
+        if operaciones:
+            # Ordenado: dentro de un usuario, vaciar y quitar deben ir antes de agregar
+            await carritos_col.bulk_write(operaciones, ordered=True)
+
+    def _incremento(self, usuario_email: str, condicion_item: dict, delta: int, id_operacion: str) -> UpdateOne:
+        """$inc de la cantidad de un item, aplicado una sola vez por id de operación"""
+        return UpdateOne(
+            {"_id": usuario_email, "items": {"$elemMatch": {**condicion_item, "aplicadas": {"$ne": id_operacion}}}},
+            {
+                "$inc": {"items.$.cantidad": delta},
+                "$push": {"items.$.aplicadas": {"$each": [id_operacion], "$slice": -OPERACIONES_RECORDADAS}}
+            }
+        )
+
+    async def vaciar(self, usuario_email: str, session=None):
+        """Vacía el carrito persistido de un usuario"""
+        await carritos_col.update_one({"_id": usuario_email}, {"$set": {"items": []}}, session=session)
 
+    async def vaciar_todos(self):
+        """Vacía todos los carritos"""
+        await carritos_col.delete_many({})
 
+    async def migrar_items_sueltos(self) -> int:
+        """
+        Mueve los items del esquema anterior (un documento por item en
+        `carrito`) al documento de su usuario. Es idempotente: $addToSet no
+        duplica un item ya migrado si se interrumpe a mitad de camino.
+        Retorna la cantidad de items migrados.
+        """
+        por_usuario = {}
+        async for item in carrito_col.find({}):
+            usuario = item.pop("usuario_email", None)
+            if usuario:
+                item.setdefault("cantidad", 1)
+                item.setdefault("producto_id", item.get("nombre", ""))
+                por_usuario.setdefault(usuario, []).append(item)
+        if not por_usuario:
+            return 0
+        await carritos_col.bulk_write([
+            UpdateOne({"_id": usuario}, {"$addToSet": {"items": {"$each": items}}}, upsert=True)
+            for usuario, items in por_usuario.items()
+        ], ordered=False)
+        ids = [item["_id"] for items in por_usuario.values() for item in items]
+        await carrito_col.delete_many({"_id": {"$in": ids}})
+        return len(ids)
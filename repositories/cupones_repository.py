@@ -0,0 +1,72 @@
+"""
+Repositorio de Cupones
+Capa de acceso a datos: reglas de cupones y contadores de uso (global en el
+cupón, por usuario en `cupones_usos`), incrementados con updates condicionados
+"""
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+from repositories.database import cupones_col, cupones_usos_col
+
+class CuponesRepository:
+    """Repositorio para cupones y sus contadores de uso"""
+
+    async def obtener_todos(self):
+        """Obtiene todos los cupones con sus usos"""
+        return [cupon async for cupon in cupones_col.find({})]
+
+    async def crear(self, cupon: dict):
+        """Crea un cupón con su contador de usos en cero; lanza DuplicateKeyError si el código existe"""
+        await cupones_col.insert_one({**cupon, "usos": 0})
+
+    async def actualizar(self, codigo: str, cupon: dict):
+        """Reemplaza las reglas de un cupón conservando sus usos (None si no existe)"""
+        return await cupones_col.find_one_and_update(
+            {"codigo": codigo},
+            {"$set": cupon},
+            return_document=ReturnDocument.AFTER
+        )
+
+    async def eliminar(self, codigo: str) -> bool:
+        """Elimina un cupón"""
+        result = await cupones_col.delete_one({"codigo": codigo})
+        return result.deleted_count > 0
+
+    async def reservar_uso(self, codigo: str, max_usos: int = None, session=None) -> bool:
+        """
+        Suma un uso al contador global, solo si queda cupo: la condición y el
+        incremento son una sola operación atómica. Retorna False si no hay cupo.
+        Los cupones que no están en la base de datos no llevan contador.
+        """
+        filtro = {"codigo": codigo}
+        if max_usos is not None:
+            filtro["$or"] = [{"usos": {"$lt": max_usos}}, {"usos": {"$exists": False}}]
+        result = await cupones_col.update_one(filtro, {"$inc": {"usos": 1}}, session=session)
+        return result.matched_count > 0 or max_usos is None
+
+    async def reservar_uso_usuario(self, codigo: str, usuario_email: str,
+                                   max_usos: int = None, session=None) -> bool:
+        """
+        Suma un uso al contador del usuario, solo si queda cupo. Si el contador
+        ya llegó al máximo, el filtro no coincide y el upsert choca con el _id
+        existente: así dos checkouts simultáneos no pueden pasar ambos.
+        """
+        filtro = {"_id": f"{codigo}:{usuario_email}"}
+        if max_usos is not None:
+            filtro["usos"] = {"$lt": max_usos}
+        try:
+            await cupones_usos_col.update_one(filtro, {"$inc": {"usos": 1}}, upsert=True, session=session)
+        except DuplicateKeyError:
+            return False
+        return True
+
+    async def liberar_uso(self, codigo: str, session=None):
+        """Descuenta un uso del contador global (orden que no se concretó)"""
+        await cupones_col.update_one(
+            {"codigo": codigo, "usos": {"$gt": 0}}, {"$inc": {"usos": -1}}, session=session
+        )
+
+    async def liberar_uso_usuario(self, codigo: str, usuario_email: str, session=None):
+        """Descuenta un uso del contador del usuario"""
+        await cupones_usos_col.update_one(
+            {"_id": f"{codigo}:{usuario_email}", "usos": {"$gt": 0}}, {"$inc": {"usos": -1}}, session=session
+        )
@@ -2,11 +2,20 @@
 Repositorio de Base de Datos
 Capa de acceso a datos: conexión y colecciones de MongoDB
 """
+import os
+from bson.raw_bson import RawBSONDocument
 from motor.motor_asyncio import AsyncIOMotorClient
+from models.metricas import escucha_mongo, METRICAS_HABILITADAS
 
-# Conexión a MongoDB
-client = AsyncIOMotorClient("mongodb://localhost:27017")
-db = client["tienda"]
+MONGO_URL = os.getenv("MONGO_URL", "mongodb://localhost:27017")
+MONGO_BASE = os.getenv("MONGO_BASE", "tienda")  # Otra base para pruebas de carga (benchmarks/carga)
+
+# Conexión a MongoDB (con el listener de comandos para /metrics si está habilitado)
+client = AsyncIOMotorClient(
+    MONGO_URL,
+    event_listeners=[escucha_mongo] if METRICAS_HABILITADAS else []
+)
+db = client[MONGO_BASE]
 
 # Colecciones
 productos_col = db["productos"]
@@ -18,3 +27,49 @@ cupones_col = db["cupones"]
 ordenes_col = db["ordenes"]
 tokens_recuperacion_col = db["tokens_recuperacion"]  # Tokens para cambio de contraseña
 
+geocodificaciones_col = db["geocodificaciones"]  # Caché persistente de geocodificación
+sucursales_col = db["sucursales"]  # Sucursales (locales de despacho)
+tarifas_envio_col = db["tarifas_envio"]  # Reglas de tarifas de envío (tramos, recargos)
+revisiones_col = db["revisiones"]  # Contadores de revisión para ETags
+carritos_col = db["carritos"]  # Un documento por usuario con sus items embebidos
+cupones_usos_col = db["cupones_usos"]  # Usos de cada cupón por usuario ({_id: "CODIGO:correo", usos})
+ventas_resumen_col = db["ventas_resumen"]  # Acumulados de ventas por día, producto y cupón
+sesiones_revocadas_col = db["sesiones_revocadas"]  # Sesiones (o todas las de un usuario) revocadas hasta expirar
+
+# Lectura en BSON crudo para los listados grandes (opcional, LECTURA_BSON_CRUDO=1):
+# los documentos llegan como RawBSONDocument y los serializadores decodifican
+# solo los campos que emiten (ver extraer_campos en models/serializers.py)
+LECTURA_BSON_CRUDO = os.getenv("LECTURA_BSON_CRUDO", "0") == "1"
+
+def para_listado(coleccion):
+    """La colección tal cual, o en modo BSON crudo si LECTURA_BSON_CRUDO está activa"""
+    if not LECTURA_BSON_CRUDO:
+        return coleccion
+    return coleccion.with_options(
+        codec_options=coleccion.codec_options.with_options(document_class=RawBSONDocument)
+    )
+
+# Las transacciones solo existen en replica sets y clusters fragmentados;
+# se detecta una vez por proceso (None = aún no consultado)
+_soporta_transacciones = None
+
+async def soporta_transacciones() -> bool:
+    """Indica si el servidor conectado admite transacciones multi-documento"""
+    global _soporta_transacciones
+    if _soporta_transacciones is None:
+        try:
+            info = await client.admin.command("hello")
+            _soporta_transacciones = "setName" in info or info.get("msg") == "isdbgrid"
+        except Exception:
+            _soporta_transacciones = False
+    return _soporta_transacciones
+
+async def ejecutar_en_transaccion(funcion):
+    """
+    Ejecuta `funcion(session)` dentro de una transacción si el servidor las
+    admite (reintentando los errores transitorios), o con session=None si no.
+    """
+    if not await soporta_transacciones():
+        return await funcion(None)
+    async with await client.start_session() as session:
+        return await session.with_transaction(funcion)
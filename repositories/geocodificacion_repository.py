@@ -0,0 +1,27 @@
+"""
+Repositorio de Geocodificación
+Capa de acceso a datos: caché persistente de direcciones geocodificadas
+"""
+from repositories.database import geocodificaciones_col
+
+class GeocodificacionRepository:
+    """Repositorio para la caché de geocodificación"""
+    
+    async def obtener(self, clave: str, ahora):
+        """Obtiene una entrada vigente (no expirada) por dirección normalizada"""
+        return await geocodificaciones_col.find_one({
+            "_id": clave,
+            "expiracion": {"$gt": ahora}
+        })
+    
+    async def guardar(self, clave: str, coordenadas, expiracion, ahora):
+        """Guarda (o reemplaza) el resultado de geocodificar una dirección"""
+        documento = {
+            "_id": clave,
+            "encontrado": coordenadas is not None,
+            "latitud": coordenadas[0] if coordenadas else None,
+            "longitud": coordenadas[1] if coordenadas else None,
+            "expiracion": expiracion,
+            "fecha_actualizacion": ahora
+        }
+        await geocodificaciones_col.replace_one({"_id": clave}, documento, upsert=True)
@@ -0,0 +1,115 @@
+"""
+Índices de Base de Datos
+Capa de acceso a datos: declaración de los índices de cada colección,
+creación idempotente al iniciar y verificación de índices faltantes
+"""
+from pymongo import IndexModel, ASCENDING, DESCENDING
+from pymongo.errors import OperationFailure
+
+from repositories.database import db
+
+# Índices requeridos por colección (con el nombre por defecto de MongoDB,
+# p. ej. "usuario_email_1_fecha_creacion_-1__id_-1"); create_indexes no hace nada
+# si ya existe uno igual.
+INDICES = {
+    "productos": [
+        IndexModel([("categoria", ASCENDING), ("precio", ASCENDING), ("_id", ASCENDING)]),
+        IndexModel([("categoria", ASCENDING), ("nombre", ASCENDING), ("_id", ASCENDING)]),
+        IndexModel([("precio", ASCENDING), ("_id", ASCENDING)]),
+        IndexModel([("nombre", ASCENDING), ("_id", ASCENDING)]),
+        IndexModel([("estado", ASCENDING), ("precio", ASCENDING), ("_id", ASCENDING)]),
+    ],
+    "usuarios": [
+        IndexModel([("correo", ASCENDING)], unique=True),
+        # Único solo entre usuarios que tienen RUT
+        IndexModel(
+            [("rut", ASCENDING)], unique=True,
+            partialFilterExpression={"rut": {"$type": "string"}}
+        ),
+    ],
+    "carritos": [
+        # Para ubicar al dueño de un item cuando no se indica el usuario
+        IndexModel([("items._id", ASCENDING)]),
+    ],
+    "favoritos": [
+        IndexModel([("usuario_email", ASCENDING), ("nombre", ASCENDING)]),
+        # Un favorito por producto; los anteriores sin producto_id quedan fuera
+        IndexModel(
+            [("usuario_email", ASCENDING), ("producto_id", ASCENDING)], unique=True,
+            partialFilterExpression={"producto_id": {"$type": "string"}}
+        ),
+    ],
+    "cupones": [
+        IndexModel([("codigo", ASCENDING)], unique=True),
+    ],
+    "ordenes": [
+        # Historial paginado por (fecha_creacion, _id), de un usuario o de todos
+        IndexModel([("usuario_email", ASCENDING), ("fecha_creacion", DESCENDING), ("_id", DESCENDING)]),
+        IndexModel([("fecha_creacion", DESCENDING), ("_id", DESCENDING)]),
+    ],
+    "empleados": [
+        IndexModel([("email", ASCENDING)]),
+        IndexModel([("rut", ASCENDING)]),
+    ],
+    "tokens_recuperacion": [
+        IndexModel([("token", ASCENDING)], unique=True),
+        # MongoDB borra los tokens una vez pasada su expiración
+        IndexModel([("expiracion", ASCENDING)], expireAfterSeconds=0),
+    ],
+    "ventas_resumen": [
+        # Rango de días de un tipo de acumulado (día, producto o cupón)
+        IndexModel([("tipo", ASCENDING), ("dia", ASCENDING)]),
+    ],
+    "geocodificaciones": [
+        IndexModel([("expiracion", ASCENDING)], expireAfterSeconds=0),
+    ],
+    "sesiones_revocadas": [
+        # Una revocación deja de importar cuando expiran los tokens que afecta
+        IndexModel([("expiracion", ASCENDING)], expireAfterSeconds=0),
+    ],
+}
+
+async def crear_indices() -> dict:
+    """
+    Crea todos los índices declarados. Es idempotente: los que ya existen no
+    se tocan. Un índice que no se puede crear (p. ej. único con datos
+    duplicados) no detiene el resto; se retorna {coleccion: [errores]}.
+    """
+    errores = {}
+    for coleccion, indices in INDICES.items():
+        for indice in indices:
+            try:
+                await db[coleccion].create_indexes([indice])
+            except OperationFailure as e:
+                errores.setdefault(coleccion, []).append(f"{indice.document['name']}: {e}")
+    return errores
+
+# Opciones que cambian el comportamiento de un índice, con su valor por omisión
+OPCIONES_COMPARADAS = {"unique": False, "expireAfterSeconds": None, "partialFilterExpression": None}
+
+def misma_definicion(esperado: dict, actual: dict) -> bool:
+    """Indica si un índice existente tiene las claves y opciones del declarado"""
+    if list(actual["key"].items()) != list(esperado["key"].items()):
+        return False
+    return all(
+        actual.get(opcion, omision) == esperado.get(opcion, omision)
+        for opcion, omision in OPCIONES_COMPARADAS.items()
+    )
+
+async def verificar_indices() -> dict:
+    """
+    Compara los índices declarados con los existentes (claves, unicidad,
+    TTL y filtro parcial).
+    Retorna {coleccion: [nombres de índices faltantes o con otra definición]}.
+    """
+    faltantes = {}
+    for coleccion, indices in INDICES.items():
+        existentes = {}
+        async for info in db[coleccion].list_indexes():
+            existentes[info["name"]] = info
+        for indice in indices:
+            esperado = indice.document
+            actual = existentes.get(esperado["name"])
+            if actual is None or not misma_definicion(esperado, actual):
+                faltantes.setdefault(coleccion, []).append(esperado["name"])
+    return faltantes
@@ -0,0 +1,57 @@
+"""
+Repositorio de Órdenes
+Capa de acceso a datos: operaciones sobre órdenes
+"""
+from bson import ObjectId
+from pymongo import ReturnDocument
+from repositories.database import ordenes_col, para_listado
+
+# Orden del historial: más recientes primero, _id desempata fechas iguales
+ORDEN_HISTORIAL = [("fecha_creacion", -1), ("_id", -1)]
+# Las órdenes antiguas sin campo estado se consideran pendientes
+ESTADO_PREDETERMINADO = "pendiente"
+
+def condicion_estado(estado: str):
+    """Condición de filtro para un estado; la del predeterminado incluye las órdenes sin el campo"""
+    return {"$in": [estado, None]} if estado == ESTADO_PREDETERMINADO else estado
+
+class OrdenesRepository:
+    """Repositorio para operaciones con órdenes"""
+
+    async def obtener_por_id(self, orden_id: str):
+        """Obtiene una orden por su ID"""
+        return await ordenes_col.find_one({"_id": ObjectId(orden_id)})
+
+    async def listar(self, filtro: dict, proyeccion: dict, limite: int):
+        """Obtiene una página del historial (filtro ya incluye la posición del cursor)"""
+        cursor = para_listado(ordenes_col).find(filtro, proyeccion).sort(ORDEN_HISTORIAL).limit(limite)
+        return [orden async for orden in cursor]
+    
+    def recorrer(self, filtro: dict, proyeccion: dict = None, tamano_lote: int = 1000):
+        """Cursor del servidor sobre el historial completo, leído de a `tamano_lote` órdenes"""
+        return para_listado(ordenes_col).find(filtro, proyeccion).sort(ORDEN_HISTORIAL).batch_size(tamano_lote)
+    
+    async def obtener_estado(self, orden_id: str):
+        """Obtiene solo el estado de una orden (None si no existe)"""
+        orden = await ordenes_col.find_one({"_id": ObjectId(orden_id)}, {"estado": 1})
+        return orden.get("estado", ESTADO_PREDETERMINADO) if orden else None
+
+    async def crear(self, orden: dict, session=None):
+        """Inserta una orden; insert_one agrega el _id al mismo diccionario"""
+        await ordenes_col.insert_one(orden, session=session)
+        return orden
+
+    async def cambiar_estado(self, orden_id: str, estado_actual: str, cambios: dict,
+                             filtro_extra: dict = None, session=None):
+        """
+        Aplica `cambios` solo si la orden sigue en `estado_actual`, en una sola
+        operación atómica. Retorna la orden actualizada, o None si no existe o
+        ya no estaba en ese estado.
+        """
+        filtro = {"_id": ObjectId(orden_id), "estado": condicion_estado(estado_actual), **(filtro_extra or {})}
+        return await ordenes_col.find_one_and_update(
+            filtro,
+            {"$set": cambios},
+            return_document=ReturnDocument.AFTER,
+            session=session
+        )
@@ -3,15 +3,27 @@ Repositorio de Productos
 Capa de acceso a datos: operaciones CRUD sobre productos
 """
 from bson import ObjectId
-from repositories.database import productos_col
+from bson.errors import InvalidId
+from pymongo.errors import BulkWriteError
+from repositories.database import productos_col, para_listado
 
 class ProductosRepository:
     """Repositorio para operaciones con productos"""
     
-    async def obtener_todos(self):
+    async def obtener_todos(self, proyeccion: dict = None):
         """Obtiene todos los productos"""
         productos = []
-        async for p in productos_col.find():
+        async for p in para_listado(productos_col).find({}, proyeccion):
+            productos.append(p)
+        return productos
+    
+    async def buscar(self, filtro: dict, orden: list, limite: int = None, proyeccion: dict = None):
+        """Busca productos con filtro, orden y límite aplicados en MongoDB"""
+        cursor = para_listado(productos_col).find(filtro, proyeccion).sort(orden)
+        if limite:
+            cursor = cursor.limit(limite)
+        productos = []
+        async for p in cursor:
             productos.append(p)
         return productos
     
@@ -25,17 +37,44 @@ class ProductosRepository:
         return result.inserted_id
     
     async def actualizar(self, id_producto: str, producto: dict):
-        """Actualiza un producto existente"""
-        result = await productos_col.update_one(
-            {"_id": ObjectId(id_producto)}, 
-            {"$set": producto}
-        )
+        """Actualiza un producto existente (False si no existe o el ID no es válido)"""
+        try:
+            oid = ObjectId(id_producto)
+        except (InvalidId, TypeError):
+            return False
+        result = await productos_col.update_one({"_id": oid}, {"$set": producto})
         return result.matched_count > 0
     
     async def eliminar(self, id_producto: str):
-        """Elimina un producto"""
-        result = await productos_col.delete_one({"_id": ObjectId(id_producto)})
+        """Elimina un producto (False si no existe o el ID no es válido)"""
+        try:
+            oid = ObjectId(id_producto)
+        except (InvalidId, TypeError):
+            return False
+        result = await productos_col.delete_one({"_id": oid})
         return result.deleted_count > 0
-
-
-
+    
+    async def aplicar_lote(self, operaciones: list) -> dict:
+        """
+        Aplica un lote de InsertOne / UpdateOne en un bulk_write no ordenado:
+        un error en una operación no detiene a las demás.
+        Retorna {"insertados", "actualizados", "errores": [(índice, mensaje)]}.
+        """
+        try:
+            resultado = await productos_col.bulk_write(operaciones, ordered=False)
+            detalle = resultado.bulk_api_result
+        except BulkWriteError as e:
+            detalle = e.details
+        return {
+            "insertados": detalle.get("nInserted", 0) + detalle.get("nUpserted", 0),
+            "actualizados": detalle.get("nMatched", 0),
+            "errores": [(error["index"], error.get("errmsg", "")) for error in detalle.get("writeErrors", [])]
+        }
+    
+    def recorrer(self, proyeccion: dict = None, tamano_lote: int = 1000):
+        """Cursor del servidor sobre todo el catálogo por _id, leído de a `tamano_lote` documentos"""
+        return productos_col.find({}, proyeccion).sort("_id", 1).batch_size(tamano_lote)
+    
+    def vigilar_cambios(self, resume_after=None):
+        """Abre un change stream sobre la colección (requiere replica set)"""
+        return productos_col.watch(resume_after=resume_after)
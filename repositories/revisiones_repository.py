@@ -0,0 +1,23 @@
+"""
+Repositorio de Revisiones
+Capa de acceso a datos: contadores de revisión por colección y por usuario
+"""
+from pymongo import UpdateOne
+from repositories.database import revisiones_col
+
+class RevisionesRepository:
+    """Repositorio para contadores de revisión"""
+    
+    async def obtener(self, claves: list):
+        """Obtiene el valor de varios contadores en una sola consulta (0 si no existen)"""
+        valores = {clave: 0 for clave in claves}
+        async for doc in revisiones_col.find({"_id": {"$in": claves}}):
+            valores[doc["_id"]] = doc.get("rev", 0)
+        return valores
+    
+    async def incrementar(self, claves: list):
+        """Incrementa varios contadores en un solo viaje a la base de datos"""
+        await revisiones_col.bulk_write(
+            [UpdateOne({"_id": clave}, {"$inc": {"rev": 1}}, upsert=True) for clave in claves],
+            ordered=False
+        )
@@ -0,0 +1,34 @@
+"""
+Repositorio de Sesiones
+Capa de acceso a datos: revocaciones de tokens de sesión, por sesión
+("sesion:<sid>") o de todas las sesiones de un usuario ("usuario:<correo>")
+"""
+from datetime import datetime, timezone
+from repositories.database import sesiones_revocadas_col
+
+def _fecha(marca: float) -> datetime:
+    return datetime.fromtimestamp(marca, tz=timezone.utc)
+
+class SesionesRepository:
+    """Repositorio para revocaciones de sesiones"""
+
+    async def revocar_sesion(self, sid: str, correo: str, expira: float):
+        """Revoca una sesión hasta la expiración de su token"""
+        await sesiones_revocadas_col.update_one(
+            {"_id": f"sesion:{sid}"},
+            {"$set": {"sid": sid, "correo": correo, "expira": expira, "expiracion": _fecha(expira)}},
+            upsert=True
+        )
+
+    async def revocar_usuario(self, correo: str, desde: float, expira: float):
+        """Revoca los tokens de un usuario emitidos antes de `desde` (hasta que expiren todos)"""
+        await sesiones_revocadas_col.update_one(
+            {"_id": f"usuario:{correo}"},
+            {"$set": {"correo": correo}, "$max": {"desde": desde, "expira": expira, "expiracion": _fecha(expira)}},
+            upsert=True
+        )
+
+    async def obtener_vigentes(self) -> list:
+        """Revocaciones que aún no expiran"""
+        ahora = datetime.now(timezone.utc)
+        return [r async for r in sesiones_revocadas_col.find({"expiracion": {"$gt": ahora}})]
@@ -0,0 +1,39 @@
+"""
+Repositorio de Sucursales
+Capa de acceso a datos: operaciones CRUD sobre sucursales
+"""
+from bson import ObjectId
+from pymongo import ReturnDocument
+from repositories.database import sucursales_col
+
+class SucursalesRepository:
+    """Repositorio para operaciones con sucursales"""
+    
+    async def obtener_activas(self):
+        """Obtiene todas las sucursales activas"""
+        sucursales = []
+        async for s in sucursales_col.find({"activa": {"$ne": False}}):
+            sucursales.append(s)
+        return sucursales
+    
+    async def obtener_por_id(self, id_sucursal: str):
+        """Obtiene una sucursal por su ID"""
+        return await sucursales_col.find_one({"_id": ObjectId(id_sucursal)})
+    
+    async def crear(self, sucursal: dict):
+        """Crea una nueva sucursal"""
+        result = await sucursales_col.insert_one(sucursal)
+        return result.inserted_id
+    
+    async def actualizar(self, id_sucursal: str, datos: dict):
+        """Actualiza una sucursal y retorna el documento actualizado"""
+        return await sucursales_col.find_one_and_update(
+            {"_id": ObjectId(id_sucursal)},
+            {"$set": datos},
+            return_document=ReturnDocument.AFTER
+        )
+    
+    async def eliminar(self, id_sucursal: str):
+        """Elimina una sucursal"""
+        result = await sucursales_col.delete_one({"_id": ObjectId(id_sucursal)})
+        return result.deleted_count > 0
@@ -0,0 +1,33 @@
+"""
+Repositorio de Tarifas de Envío
+Capa de acceso a datos: reglas de tarifas de envío vigentes
+"""
+from pymongo import ReturnDocument
+from repositories.database import tarifas_envio_col
+
+# Las reglas vigentes se guardan en un único documento
+ID_REGLAS_VIGENTES = "vigente"
+
+class TarifasRepository:
+    """Repositorio para las reglas de tarifas de envío"""
+    
+    async def obtener(self):
+        """Obtiene las reglas vigentes (o None si nunca se configuraron)"""
+        return await tarifas_envio_col.find_one({"_id": ID_REGLAS_VIGENTES})
+    
+    async def obtener_version(self):
+        """Obtiene solo el número de versión de las reglas vigentes"""
+        documento = await tarifas_envio_col.find_one(
+            {"_id": ID_REGLAS_VIGENTES},
+            {"version": 1}
+        )
+        return documento.get("version", 0) if documento else None
+    
+    async def guardar(self, reglas: dict):
+        """Reemplaza las reglas vigentes incrementando su versión"""
+        return await tarifas_envio_col.find_one_and_update(
+            {"_id": ID_REGLAS_VIGENTES},
+            {"$set": reglas, "$inc": {"version": 1}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
@@ -36,6 +36,30 @@ class UsuariosRepository:
             {"correo": correo},
             {"$set": {"password_hash": password_hash}}
         )
-
-
-
+    
+    async def guardar_coordenadas(self, correo: str, domicilio: str, latitud: float, longitud: float):
+        """Guarda coordenadas geocodificadas solo si el domicilio no cambió entretanto"""
+        await usuarios_col.update_one(
+            {"correo": correo, "domicilio": domicilio},
+            {"$set": {"latitud": latitud, "longitud": longitud}}
+        )
+    
+    async def obtener_correo_por_medio_pago(self, medio_pago_id):
+        """Obtiene el correo del usuario dueño de un medio de pago (None si no existe)"""
+        usuario = await usuarios_col.find_one({"medios_pago._id": medio_pago_id}, {"correo": 1})
+        return usuario.get("correo") if usuario else None
+    
+    async def iterar_coordenadas_por_lotes(self, tamano_lote: int = 1000):
+        """Recorre todos los usuarios en lotes, trayendo solo correo y coordenadas"""
+        lote = []
+        cursor = usuarios_col.find(
+            {},
+            {"_id": 0, "correo": 1, "latitud": 1, "longitud": 1}
+        ).batch_size(tamano_lote)
+        async for usuario in cursor:
+            lote.append(usuario)
+            if len(lote) >= tamano_lote:
+                yield lote
+                lote = []
+        if lote:
+            yield lote
@@ -0,0 +1,212 @@
+"""
+Servicio de Analítica
+Capa de lógica de negocio: ventas por día y semana, productos más vendidos
+y efectividad de cupones, leídos de acumulados que se actualizan al pagar
+o cancelar cada orden (sin recorrer el historial)
+"""
+import asyncio
+from datetime import date
+from pymongo import UpdateOne
+
+from repositories.analitica_repository import AnaliticaRepository, CAMPOS_DIA
+
+PERIODOS = ("dia", "semana")
+CRITERIOS_TOP = ("cantidad", "ingresos")
+LIMITE_MAXIMO_TOP = 100
+
+def clave_producto_vendido(item: dict) -> str:
+    """Igual que CLAVE_PRODUCTO en la reconstrucción: producto_id o, si falta, el nombre"""
+    return item.get("producto_id") or item.get("nombre") or ""
+
+def cupones_de_orden(orden: dict) -> list:
+    """Cupones aplicados a una orden: [{"codigo", "descuento"}] (las anteriores solo tienen cupon_codigo)"""
+    if "cupones" in orden:
+        return orden["cupones"]
+    if orden.get("cupon_codigo"):
+        return [{"codigo": orden["cupon_codigo"], "descuento": orden.get("descuento", 0)}]
+    return []
+
+def validar_dia(valor: str, nombre: str):
+    """Valida un día AAAA-MM-DD; lanza ValueError si no lo es"""
+    if valor is None:
+        return None
+    try:
+        return date.fromisoformat(valor).isoformat()
+    except ValueError:
+        raise ValueError(f"{nombre} debe tener el formato AAAA-MM-DD")
+
+def _promedio(suma, cantidad):
+    return round(suma / cantidad, 2) if cantidad else None
+
+def _metricas(acumulado: dict) -> dict:
+    """Métricas de un período a partir de sus sumas"""
+    pagadas = acumulado.get("ordenes_pagadas", 0)
+    return {
+        "ordenes_pagadas": pagadas,
+        "ingresos": acumulado.get("ingresos", 0),
+        "descuentos": acumulado.get("descuentos", 0),
+        "envio": acumulado.get("envio", 0),
+        "ticket_promedio": _promedio(acumulado.get("ingresos", 0), pagadas),
+        "distancia_promedio_km": _promedio(
+            acumulado.get("distancia_total", 0), acumulado.get("ordenes_con_distancia", 0)
+        ),
+        "ordenes_canceladas": acumulado.get("ordenes_canceladas", 0),
+        "monto_cancelado": acumulado.get("monto_cancelado", 0),
+    }
+
+class AnaliticaService:
+    """
+    Servicio para la analítica de ventas.
+    Los acumulados (por día, por producto y día, por cupón y día) se
+    incrementan en la misma transacción que cambia el estado de la orden,
+    y como cada orden sale de "pendiente" una sola vez, no se cuenta dos
+    veces. reconstruir() los recalcula desde el historial si hiciera falta
+    (p. ej. órdenes previas a este módulo).
+    """
+
+    def __init__(self):
+        self.repository = AnaliticaRepository()
+        self._tarea_reconstruccion = None
+
+    async def iniciar(self):
+        """
+        Si hay órdenes pero ningún acumulado (primera ejecución con este
+        módulo), los reconstruye en segundo plano sin demorar el arranque.
+        """
+        if await self.repository.hay_acumulados() or not await self.repository.contar_ordenes():
+            return
+        self._tarea_reconstruccion = asyncio.create_task(self._reconstruccion_inicial())
+
+    async def _reconstruccion_inicial(self):
+        try:
+            await self.repository.reconstruir()
+            print("[ANALÍTICA] Acumulados de ventas reconstruidos desde el historial")
+        except Exception as e:
+            print(f"[ANALÍTICA] No se pudieron reconstruir los acumulados: {e}")
+
+    def _dia_acumulado(self, dia: str, incrementos: dict) -> UpdateOne:
+        return UpdateOne(
+            {"_id": f"dia:{dia}"},
+            {
+                "$inc": incrementos,
+                "$setOnInsert": {"tipo": "dia", "dia": dia, "semana": "%d-W%02d" % date.fromisoformat(dia).isocalendar()[:2]}
+            },
+            upsert=True
+        )
+
+    def _cupon_acumulado(self, dia: str, cupon: str, incrementos: dict) -> UpdateOne:
+        return UpdateOne(
+            {"_id": f"cupon:{dia}:{cupon}"},
+            {"$inc": incrementos, "$setOnInsert": {"tipo": "cupon", "dia": dia, "cupon": cupon}},
+            upsert=True
+        )
+
+    async def registrar_pago(self, orden: dict, session=None):
+        """Suma una orden recién pagada a los acumulados de su día de pago"""
+        dia = orden["fecha_pago"][:10]
+        distancia = orden.get("distancia_km")
+        con_distancia = isinstance(distancia, (int, float)) and not isinstance(distancia, bool)
+        operaciones = [self._dia_acumulado(dia, {
+            "ordenes_pagadas": 1,
+            "ingresos": orden.get("total", 0),
+            "subtotal": orden.get("subtotal", 0),
+            "descuentos": orden.get("descuento", 0),
+            "envio": orden.get("envio", 0),
+            "distancia_total": distancia if con_distancia else 0,
+            "ordenes_con_distancia": 1 if con_distancia else 0,
+        })]
+
+        # Una operación por producto aunque aparezca en varias líneas
+        vendidos = {}
+        for item in orden.get("productos", []):
+            cantidad = item.get("cantidad", 1)
+            vendido = vendidos.setdefault(clave_producto_vendido(item), {"cantidad": 0, "ingresos": 0})
+            vendido["cantidad"] += cantidad
+            vendido["ingresos"] += item.get("precio", 0) * cantidad
+            vendido["nombre"] = item.get("nombre", "")
+        for clave, vendido in vendidos.items():
+            operaciones.append(UpdateOne(
+                {"_id": f"producto:{dia}:{clave}"},
+                {
+                    "$inc": {"cantidad": vendido["cantidad"], "ingresos": vendido["ingresos"]},
+                    "$set": {"nombre": vendido["nombre"]},
+                    "$setOnInsert": {"tipo": "producto", "dia": dia, "producto_id": clave}
+                },
+                upsert=True
+            ))
+
+        for cupon in cupones_de_orden(orden):
+            operaciones.append(self._cupon_acumulado(dia, cupon["codigo"], {
+                "usos": 1, "descuento_total": cupon.get("descuento", 0), "ingresos": orden.get("total", 0)
+            }))
+        await self.repository.acumular(operaciones, session)
+
+    async def registrar_cancelacion(self, orden: dict, session=None):
+        """Suma una orden recién cancelada a los acumulados de su día de cancelación"""
+        dia = orden["fecha_cancelacion"][:10]
+        operaciones = [self._dia_acumulado(dia, {"ordenes_canceladas": 1, "monto_cancelado": orden.get("total", 0)})]
+        for cupon in cupones_de_orden(orden):
+            operaciones.append(self._cupon_acumulado(dia, cupon["codigo"], {"canceladas": 1}))
+        await self.repository.acumular(operaciones, session)
+
+    async def ventas(self, periodo: str = "dia", desde: str = None, hasta: str = None) -> list:
+        """
+        Ventas por día o por semana ISO (AAAA-Www) en el rango de días dado.
+        Lanza ValueError si el período o las fechas no son válidos.
+        """
+        if periodo not in PERIODOS:
+            raise ValueError(f"Período inválido. Opciones: {', '.join(PERIODOS)}")
+        desde, hasta = validar_dia(desde, "desde"), validar_dia(hasta, "hasta")
+        acumulados = await self.repository.ventas_por_periodo(periodo, desde, hasta)
+        return [{"periodo": a["_id"], **_metricas(a)} for a in acumulados]
+
+    async def resumen(self, desde: str = None, hasta: str = None) -> dict:
+        """Totales del rango, más la cantidad de órdenes registradas en total"""
+        desde, hasta = validar_dia(desde, "desde"), validar_dia(hasta, "hasta")
+        total = await self.repository.total(desde, hasta) or {campo: 0 for campo in CAMPOS_DIA}
+        return {
+            "desde": desde,
+            "hasta": hasta,
+            **_metricas(total),
+            "ordenes_registradas": await self.repository.contar_ordenes()
+        }
+
+    async def top_productos(self, limite: int = 10, por: str = "cantidad",
+                            desde: str = None, hasta: str = None) -> list:
+        """Los `limite` productos más vendidos por unidades o por ingresos"""
+        if por not in CRITERIOS_TOP:
+            raise ValueError(f"Criterio inválido. Opciones: {', '.join(CRITERIOS_TOP)}")
+        if not 1 <= limite <= LIMITE_MAXIMO_TOP:
+            raise ValueError(f"limite debe estar entre 1 y {LIMITE_MAXIMO_TOP}")
+        desde, hasta = validar_dia(desde, "desde"), validar_dia(hasta, "hasta")
+        productos = await self.repository.top_productos(por, limite, desde, hasta)
+        return [
+            {"producto_id": p["_id"], "nombre": p.get("nombre", ""),
+             "cantidad": p.get("cantidad", 0), "ingresos": p.get("ingresos", 0)}
+            for p in productos
+        ]
+
+    async def cupones(self, desde: str = None, hasta: str = None) -> list:
+        """Efectividad de cada cupón: usos, descuento otorgado, ingresos y cancelaciones"""
+        desde, hasta = validar_dia(desde, "desde"), validar_dia(hasta, "hasta")
+        cupones = await self.repository.cupones(desde, hasta)
+        return [
+            {
+                "cupon": c["_id"],
+                "usos": c.get("usos", 0),
+                "descuento_total": c.get("descuento_total", 0),
+                "descuento_promedio": _promedio(c.get("descuento_total", 0), c.get("usos", 0)),
+                "ingresos": c.get("ingresos", 0),
+                "ticket_promedio": _promedio(c.get("ingresos", 0), c.get("usos", 0)),
+                "canceladas": c.get("canceladas", 0),
+            }
+            for c in cupones
+        ]
+
+    async def reconstruir(self):
+        """
+        Recalcula los acumulados desde el historial de órdenes. Los pagos y
+        cancelaciones que ocurran durante la reconstrucción pueden quedar
+        fuera: conviene ejecutarla con poco tráfico.
+        """
+        await self.repository.reconstruir()
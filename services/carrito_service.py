@@ -1,46 +1,696 @@
 """
 Servicio de Carrito
-Capa de lógica de negocio: operaciones de negocio sobre carrito
+Capa de lógica de negocio: carrito de cada usuario en memoria, con escritura
+diferida (write-behind) por lotes a MongoDB
 """
+import os
+import re
+import glob
+import json
+import time
+import asyncio
+import math
+import secrets
+from collections import OrderedDict
+from bson import ObjectId
+from bson.errors import InvalidDocument
+from pymongo.errors import BulkWriteError, WriteError
+
+try:
+    import fcntl
+except ImportError:  # Windows: sin bloqueos de archivo, el diario no se puede usar
+    fcntl = None
+
 from repositories.carrito_repository import CarritoRepository
 from models.serializers import serializar_carrito
 
+INTERVALO_ESCRITURA = 0.25  # Segundos entre lotes de escritura a MongoDB
+MAX_OPERACIONES_PENDIENTES = 500  # Con más pendientes se escribe sin esperar el intervalo
+ESPERA_REINTENTO_ESCRITURA = 1.0  # Pausa tras un lote fallido antes de reintentarlo
+MAX_USUARIOS_EN_MEMORIA = 10000
+TTL_ESTADO = 60.0  # Segundos desde la carga tras los cuales el carrito se vuelve a leer de MongoDB
+# Ruta base del diario de operaciones (None = sin diario); cada proceso usa "<ruta>.<pid>"
+DIARIO_CARRITO = os.getenv("CARRITO_DIARIO")
+MAX_LINEAS_DIARIO = 5000  # Al superarlas, el diario se compacta a las operaciones pendientes
+MAX_ITEMS_POR_LOTE = 200  # Máximo de items en POST /carrito/batch
+MAX_CANTIDAD_ITEM = 999  # Cantidad máxima de una línea del carrito
+MAX_PRECIO_ITEM = 10_000_000_000  # Con MAX_CANTIDAD_ITEM y MAX_LINEAS_CARRITO, el total cabe en 8 bytes
+MAX_LINEAS_CARRITO = 500  # Líneas por carrito: mantiene el documento lejos de los 16 MB
+MAX_LARGO_TEXTO = 2048  # Caracteres de producto_id, nombre e imagen
+
+def clave_producto(item: dict) -> str:
+    """
+    Identifica al producto de un item de carrito o favorito: su producto_id,
+    o el nombre para clientes e items anteriores que no lo envían
+    """
+    return str(item.get("producto_id") or item.get("nombre") or "")
+
+def error_determinista(error: Exception) -> bool:
+    """
+    Indica si un error de escritura se repetiría igual al reintentar el
+    mismo lote: un valor que BSON no puede representar, un documento
+    demasiado grande o un error de escritura del servidor. Los de red o de
+    write concern sí se reintentan.
+    """
+    if isinstance(error, BulkWriteError):
+        return bool(error.details.get("writeErrors"))
+    return isinstance(error, (OverflowError, InvalidDocument, WriteError))
+
+def _bloquear(archivo) -> bool:
+    """Toma el bloqueo exclusivo de un diario sin esperar; False si lo tiene otro proceso"""
+    try:
+        fcntl.flock(archivo.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return True
+    except OSError:
+        return False
+
+def _leer_entradas(archivo) -> list:
+    # Una última línea incompleta (caída a mitad de escritura) se descarta
+    entradas = []
+    for linea in archivo:
+        try:
+            entradas.append(json.loads(linea))
+        except ValueError:
+            break
+    return entradas
+
+class DiarioCarrito:
+    """
+    Archivo JSONL con las operaciones confirmadas que aún no están en MongoDB.
+    Cada lote de escritura anota una marca {"lote": n} antes de enviarse, para
+    que al reproducir el diario los lotes se rearmen exactamente igual, y
+    {"escrito": n} cuando quedó en MongoDB. Solo se agregan líneas: el archivo
+    se reescribe con las operaciones pendientes cuando supera
+    MAX_LINEAS_DIARIO, no en cada lote.
+    Mientras está abierto tiene un bloqueo exclusivo (flock): así otro
+    proceso distingue un diario en uso de uno cuyo proceso murió.
+    No hace fsync por operación: protege ante caídas del proceso, no del equipo.
+    """
+
+    def __init__(self, ruta: str):
+        self.ruta = ruta
+        self.lineas = 0
+        self._archivo = None
+
+    def leer(self) -> list:
+        if not os.path.exists(self.ruta):
+            return []
+        with open(self.ruta, encoding="utf-8") as archivo:
+            return _leer_entradas(archivo)
+
+    def anotar(self, entrada: dict):
+        if self._archivo is None:
+            self._archivo = self._abrir(self.ruta, "a")
+        self._archivo.write(json.dumps(entrada, ensure_ascii=False) + "\n")
+        self._archivo.flush()
+        self.lineas += 1
+
+    def reescribir(self, entradas: list):
+        """Reemplaza el diario de forma atómica por las entradas indicadas"""
+        # El temporal se bloquea antes de reemplazar: el diario nunca queda sin bloqueo
+        archivo = self._abrir(self.ruta + ".tmp", "w")
+        for entrada in entradas:
+            archivo.write(json.dumps(entrada, ensure_ascii=False) + "\n")
+        archivo.flush()
+        os.replace(self.ruta + ".tmp", self.ruta)
+        self.cerrar()
+        self._archivo = archivo
+        self.lineas = len(entradas)
+
+    @staticmethod
+    def _abrir(ruta: str, modo: str):
+        archivo = open(ruta, modo, encoding="utf-8")
+        if not _bloquear(archivo):
+            archivo.close()
+            raise RuntimeError(f"El diario {ruta} está en uso por otro proceso")
+        return archivo
+
+    def cerrar(self):
+        if self._archivo is not None:
+            self._archivo.close()
+            self._archivo = None
+
+def tomar_diarios_huerfanos(ruta_base: str) -> list:
+    """
+    Diarios de procesos que ya no corren: "<ruta_base>.<pid>" sin bloqueo, y
+    "<ruta_base>" de versiones que usaban un solo archivo. Retorna
+    [(ruta, archivo abierto y bloqueado)]: quien los toma debe cerrarlos.
+    """
+    tomados = []
+    rutas = [ruta_base] + sorted(
+        ruta for ruta in glob.glob(glob.escape(ruta_base) + ".*")
+        if re.fullmatch(r"\.\d+", ruta[len(ruta_base):])
+    )
+    for ruta in rutas:
+        try:
+            archivo = open(ruta, encoding="utf-8")
+        except FileNotFoundError:
+            continue
+        try:
+            # Otro proceso lo tiene en uso, o lo tomó y ya lo eliminó
+            if not _bloquear(archivo) or os.stat(ruta).st_ino != os.fstat(archivo.fileno()).st_ino:
+                archivo.close()
+                continue
+        except FileNotFoundError:
+            archivo.close()
+            continue
+        tomados.append((ruta, archivo))
+    return tomados
+
+def lotes_del_diario(entradas: list) -> list:
+    """
+    Rearma los lotes de un diario: las operaciones entre dos marcas
+    {"lote": n} forman el lote n (las del final, uno sin marca). Se omiten
+    los lotes marcados como escritos.
+    """
+    lotes, lote = [], []
+    escritos = set()
+    for entrada in entradas:
+        if "lote" in entrada:
+            lotes.append((entrada["lote"], lote))
+            lote = []
+        elif "escrito" in entrada:
+            escritos.add(entrada["escrito"])
+        else:
+            lote.append(entrada)
+    if lote:
+        lotes.append((None, lote))
+    return [operaciones for numero, operaciones in lotes if operaciones and numero not in escritos]
+
+def cambio_neto(usuario_email: str, operaciones: list) -> dict:
+    """
+    Reduce las operaciones de un usuario a su efecto neto por item: agregar
+    y luego quitar el mismo item no genera escritura, varios cambios de
+    cantidad se suman en un solo $inc, y vaciar quita los items que había
+    (los de diarios anteriores, sin item_ids, descartan todo lo anterior).
+    """
+    vaciar = False
+    agregados = {}
+    quitados = {}
+    incrementos = {}
+
+    def quitar(id_item: str):
+        if agregados.pop(id_item, None) is None:
+            quitados[id_item] = True
+        incrementos.pop(id_item, None)
+
+    for operacion in operaciones:
+        tipo = operacion["tipo"]
+        if tipo == "vaciar":
+            if "item_ids" in operacion:
+                for id_item in operacion["item_ids"]:
+                    quitar(id_item)
+            else:
+                vaciar = True
+                agregados.clear()
+                quitados.clear()
+                incrementos.clear()
+        elif tipo == "agregar":
+            item = dict(operacion["item"])
+            item.setdefault("producto_id", clave_producto(item))
+            agregados[item["_id"]] = (item, operacion["id"])
+        elif tipo == "quitar":
+            quitar(operacion["item_id"])
+        elif tipo == "cantidad":
+            id_item = operacion["item_id"]
+            if id_item in agregados:
+                agregados[id_item][0]["cantidad"] += operacion["delta"]
+            elif id_item not in quitados:
+                # El id de la última operación identifica el $inc combinado
+                delta, _ = incrementos.get(id_item, (0, None))
+                incrementos[id_item] = (delta + operacion["delta"], operacion["id"])
+    return {
+        "usuario_email": usuario_email,
+        "vaciar": vaciar,
+        "agregar": [
+            ({**item, "_id": ObjectId(id_item)}, id_operacion)
+            for id_item, (item, id_operacion) in agregados.items()
+        ],
+        "quitar": [ObjectId(id_item) for id_item in quitados],
+        "incrementos": [
+            (ObjectId(id_item), delta, id_operacion)
+            for id_item, (delta, id_operacion) in incrementos.items() if delta != 0
+        ]
+    }
+
+def _cambios_del_lote(operaciones: list) -> list:
+    """Agrupa operaciones (en orden) por usuario y calcula el cambio neto de cada uno"""
+    por_usuario = {}
+    for operacion in operaciones:
+        por_usuario.setdefault(operacion["u"], []).append(operacion)
+    return [cambio_neto(usuario, ops) for usuario, ops in por_usuario.items()]
+
+class _EstadoCarrito:
+    """Items de un usuario en memoria (id en texto -> item) y su versión"""
+    __slots__ = ("items", "carga", "version", "cargado", "ultimo_uso")
+
+    def __init__(self, items: list, carga: int):
+        self.items = {str(item["_id"]): item for item in items}
+        self.carga = carga  # Distingue una copia recargada de la anterior
+        self.version = 0
+        self.cargado = self.ultimo_uso = time.monotonic()
+
 class CarritoService:
-    """Servicio para lógica de negocio de carrito"""
-    
-    def __init__(self):
+    """
+    Servicio para lógica de negocio de carrito, con escritura diferida.
+
+    Garantías:
+    - Una mutación se confirma al cliente cuando quedó aplicada en memoria (y
+      anotada en el diario, si hay). Las lecturas de este proceso la ven de
+      inmediato, sin ir a la base de datos.
+    - Se escribe en MongoDB en el siguiente lote: a más tardar
+      INTERVALO_ESCRITURA después, antes si se acumulan
+      MAX_OPERACIONES_PENDIENTES, y siempre al apagar la app.
+    - Un lote que falla se reintenta tal cual, antes que cualquier operación
+      posterior. Todas sus escrituras son idempotentes, así que repetirlo
+      no duplica efectos. Si el error se repetiría siempre (error_determinista),
+      se apartan solo los cambios del usuario que lo provoca y su carrito se
+      vuelve a leer de MongoDB.
+    - Si el proceso muere sin diario, se pierden las mutaciones aún no
+      escritas (a lo más INTERVALO_ESCRITURA). Con diario (CARRITO_DIARIO),
+      al iniciar se reproducen los lotes anotados que no llegaron a marcarse
+      como escritos antes de atender solicitudes, así que no se pierde
+      ninguna mutación confirmada.
+    - Vaciar quita los items que el carrito tenía en memoria, no todo el
+      documento: reproducirlo no borra lo que otro proceso agregó después.
+    - Con varios workers cada uno ve sus escrituras de inmediato y las de
+      los demás cuando su copia expira: TTL_ESTADO después de cargarla,
+      aunque se siga usando. La orden no usa la copia en memoria: escribe lo
+      pendiente y lee el carrito de MongoDB. En MongoDB las escrituras de
+      todos se combinan, porque son $push / $pull / $inc y no reemplazan el
+      documento.
+    - Cada proceso anota en su propio diario ("<CARRITO_DIARIO>.<pid>"), así
+      que los workers pueden compartir la variable. Al iniciar, un proceso
+      reproduce los diarios que ningún proceso vivo tiene bloqueados.
+    """
+
+    def __init__(self, ruta_diario: str = DIARIO_CARRITO):
+        if ruta_diario and fcntl is None:
+            print("[CARRITO] El diario requiere bloqueos de archivo (fcntl); queda desactivado")
+            ruta_diario = None
         self.repository = CarritoRepository()
-    
+        self._estados = OrderedDict()  # correo -> _EstadoCarrito, en orden LRU
+        self._cargas = {}  # correo -> tarea de carga en curso (single-flight)
+        self._pendientes = {}  # correo -> [operación], en orden
+        self._total_pendientes = 0
+        self._lote_en_curso = None  # (número, operaciones por usuario, cambios) del lote enviado o fallido
+        self._secuencia = 0
+        self._cargas_realizadas = 0
+        # Distingue los ids de operación y los ETags de este proceso
+        self._epoca = secrets.token_hex(4)
+        self._bloqueo_escritura = asyncio.Lock()
+        self._despertar = asyncio.Event()
+        self._tarea_escritura = None
+        self._ruta_diario = ruta_diario
+        self._diario = DiarioCarrito(f"{ruta_diario}.{os.getpid()}") if ruta_diario else None
+        self.contadores = {"operaciones": 0, "lotes": 0, "errores": 0, "cargas": 0, "reproducidas": 0,
+                           "apartadas": 0}
+
+    # --- Ciclo de vida ---
+
+    async def iniciar(self):
+        """Migra el esquema anterior, reproduce los diarios huérfanos e inicia la escritura periódica"""
+        migrados = await self.repository.migrar_items_sueltos()
+        if migrados:
+            print(f"[CARRITO] {migrados} items migrados al documento de su usuario")
+        if self._diario is not None:
+            for ruta, archivo in tomar_diarios_huerfanos(self._ruta_diario):
+                try:
+                    await self._reproducir_diario(_leer_entradas(archivo))
+                    os.remove(ruta)
+                except Exception as e:
+                    # Queda en disco: lo reproduce el siguiente inicio
+                    print(f"[CARRITO] No se pudo reproducir el diario {ruta}: {e}")
+                finally:
+                    archivo.close()
+        if self._tarea_escritura is None:
+            self._tarea_escritura = asyncio.create_task(self._escribir_periodicamente())
+
+    async def detener(self):
+        """Detiene la escritura periódica y escribe todo lo pendiente"""
+        if self._tarea_escritura is not None:
+            self._tarea_escritura.cancel()
+            try:
+                await self._tarea_escritura
+            except asyncio.CancelledError:
+                pass
+            self._tarea_escritura = None
+        try:
+            while self._pendientes:
+                await self.escribir_pendientes()
+        except Exception as e:
+            print(f"Error escribiendo carritos al apagar ({self._total_pendientes} operaciones pendientes): {e}")
+        if self._diario is not None:
+            self._diario.cerrar()
+
+    async def _reproducir_diario(self, entradas: list):
+        """Aplica las operaciones de un diario no escritas, con el mismo agrupamiento en lotes"""
+        for lote in lotes_del_diario(entradas):
+            apartados = set(await self._aplicar(_cambios_del_lote(lote)))
+            for operacion in lote:
+                self.contadores["apartadas" if operacion["u"] in apartados else "reproducidas"] += 1
+
+    async def _escribir_periodicamente(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._despertar.wait(), INTERVALO_ESCRITURA)
+            except asyncio.TimeoutError:
+                pass
+            self._despertar.clear()
+            try:
+                await self.escribir_pendientes()
+            except Exception as e:
+                print(f"Error escribiendo carritos: {e}")
+                await asyncio.sleep(ESPERA_REINTENTO_ESCRITURA)
+            self._recortar_memoria()
+
+    # --- Escritura por lotes ---
+
+    def _registrar(self, usuario_email: str, operacion: dict):
+        """Encola una operación ya aplicada en memoria (y la anota en el diario)"""
+        self._secuencia += 1
+        operacion["id"] = f"{self._epoca}-{self._secuencia}"
+        operacion["u"] = usuario_email
+        if self._diario is not None:
+            self._diario.anotar(operacion)
+        self._pendientes.setdefault(usuario_email, []).append(operacion)
+        self._total_pendientes += 1
+        self.contadores["operaciones"] += 1
+        if self._total_pendientes >= MAX_OPERACIONES_PENDIENTES:
+            self._despertar.set()
+
+    async def escribir_pendientes(self) -> int:
+        """Escribe un lote con las operaciones pendientes; retorna cuántas escribió"""
+        async with self._bloqueo_escritura:
+            if self._lote_en_curso is None:
+                if not self._pendientes:
+                    return 0
+                cantidades = {usuario: len(ops) for usuario, ops in self._pendientes.items()}
+                cambios = [cambio_neto(usuario, list(ops)) for usuario, ops in self._pendientes.items()]
+                self._lote_en_curso = (self._secuencia, cantidades, cambios)
+                if self._diario is not None:
+                    self._diario.anotar({"lote": self._secuencia})
+
+            numero, cantidades, cambios = self._lote_en_curso
+            try:
+                apartados = await self._aplicar(cambios)
+            except Exception:
+                self.contadores["errores"] += 1
+                raise
+            self._lote_en_curso = None
+            for usuario in apartados:
+                self.contadores["apartadas"] += cantidades[usuario]
+                self._expirar(usuario)
+
+            for usuario, cantidad in cantidades.items():
+                restantes = self._pendientes.get(usuario, [])[cantidad:]
+                if restantes:
+                    self._pendientes[usuario] = restantes
+                else:
+                    self._pendientes.pop(usuario, None)
+            escritas = sum(cantidades.values())
+            self._total_pendientes -= escritas
+            self.contadores["lotes"] += 1
+            if self._diario is not None:
+                self._diario.anotar({"escrito": numero})
+                if self._diario.lineas > MAX_LINEAS_DIARIO:
+                    # Compactar: solo quedan las pendientes (pocas, recién se escribió un lote)
+                    restantes = sorted(
+                        (op for ops in self._pendientes.values() for op in ops),
+                        key=lambda op: int(op["id"].rsplit("-", 1)[1])
+                    )
+                    self._diario.reescribir(restantes)
+            return escritas
+
+    async def _aplicar(self, cambios: list) -> list:
+        """
+        Escribe los cambios de un lote. Si fallan por un error determinista,
+        los escribe de a un usuario: los cambios del que provoca el error se
+        apartan (se informan y se descartan) en vez de reintentar para
+        siempre un lote que bloquearía las escrituras de todos.
+        Retorna los correos cuyos cambios se apartaron.
+        """
+        try:
+            await self.repository.aplicar_cambios(cambios)
+            return []
+        except Exception as e:
+            if not error_determinista(e):
+                raise
+        apartados = []
+        for cambio in cambios:
+            try:
+                await self.repository.aplicar_cambios([cambio])
+            except Exception as e:
+                if not error_determinista(e):
+                    raise
+                apartados.append(cambio["usuario_email"])
+                print(f"[CARRITO] Cambios de {cambio['usuario_email']} apartados, no se pueden escribir: {e}")
+        return apartados
+
+    # --- Estado en memoria ---
+
+    async def _estado(self, usuario_email: str) -> _EstadoCarrito:
+        """Estado en memoria del usuario; lo carga de MongoDB si no está o expiró"""
+        ahora = time.monotonic()
+        estado = self._estados.get(usuario_email)
+        # Con operaciones pendientes la copia en memoria es la única al día
+        if estado is not None and (usuario_email in self._pendientes or ahora - estado.cargado < TTL_ESTADO):
+            estado.ultimo_uso = ahora
+            self._estados.move_to_end(usuario_email)
+            return estado
+
+        tarea = self._cargas.get(usuario_email)
+        if tarea is None:
+            tarea = asyncio.ensure_future(self._cargar(usuario_email))
+            self._cargas[usuario_email] = tarea
+            tarea.add_done_callback(lambda _: self._cargas.pop(usuario_email, None))
+        return await asyncio.shield(tarea)
+
+    def _nuevo_estado(self, usuario_email: str, items: list) -> _EstadoCarrito:
+        self._cargas_realizadas += 1
+        estado = _EstadoCarrito(items, self._cargas_realizadas)
+        self._estados[usuario_email] = estado
+        self._estados.move_to_end(usuario_email)
+        return estado
+
+    async def _cargar(self, usuario_email: str) -> _EstadoCarrito:
+        items = await self.repository.obtener_por_usuario(usuario_email)
+        self.contadores["cargas"] += 1
+        # Si mientras tanto se vació el carrito en memoria, esa copia manda
+        existente = self._estados.get(usuario_email)
+        if existente is not None and usuario_email in self._pendientes:
+            return existente
+        return self._nuevo_estado(usuario_email, items or [])
+
+    def _expirar(self, usuario_email: str):
+        """Hace que la copia en memoria se vuelva a leer de MongoDB (cuando no tenga pendientes)"""
+        estado = self._estados.get(usuario_email)
+        if estado is not None:
+            estado.cargado = float("-inf")
+
+    def _recortar_memoria(self):
+        """Descarta estados sin uso por TTL_ESTADO o sobrantes que no tienen escrituras pendientes"""
+        ahora = time.monotonic()
+        for usuario, estado in list(self._estados.items()):
+            if len(self._estados) <= MAX_USUARIOS_EN_MEMORIA and ahora - estado.ultimo_uso < TTL_ESTADO:
+                break  # El resto se usó más recientemente
+            if usuario not in self._pendientes and usuario not in self._cargas:
+                del self._estados[usuario]
+
+    def _cambiar(self, usuario_email: str, estado: _EstadoCarrito, operacion: dict):
+        estado.version += 1
+        self._registrar(usuario_email, operacion)
+
+    async def _resolver_dueno(self, id_item: ObjectId):
+        """Correo del dueño de un item: primero en memoria, luego en MongoDB"""
+        clave = str(id_item)
+        for usuario, estado in self._estados.items():
+            if clave in estado.items:
+                return usuario
+        return await self.repository.buscar_dueno_item(id_item)
+
+    # --- Operaciones ---
+
     async def obtener_por_usuario(self, usuario_email: str = None):
-        """Obtiene el carrito de un usuario serializado"""
+        """Obtiene el carrito de un usuario serializado (o todos, desde MongoDB)"""
         if usuario_email:
-            items = await self.repository.obtener_por_usuario(usuario_email)
-        else:
-            items = await self.repository.obtener_todos()
-        return [serializar_carrito(item) for item in items]
-    
+            estado = await self._estado(usuario_email)
+            return [serializar_carrito(item) for item in estado.items.values()]
+        while self._pendientes:
+            await self.escribir_pendientes()
+        return [serializar_carrito(item) for item in await self.repository.obtener_todos()]
+
+    async def etag(self, usuario_email: str) -> str:
+        """ETag del carrito de un usuario, calculado en memoria"""
+        estado = await self._estado(usuario_email)
+        return f'"carrito-{self._epoca}-{estado.carga}-{estado.version}"'
+
+    async def obtener_items_orden(self, usuario_email: str) -> list:
+        """
+        Items del carrito con solo los campos que guarda una orden. Se leen de
+        MongoDB tras escribir lo pendiente: la copia en memoria puede no tener
+        lo que se cambió en otros workers.
+        """
+        while usuario_email in self._pendientes:
+            await self.escribir_pendientes()
+        tarea = self._cargas.get(usuario_email)
+        if tarea is not None:
+            await asyncio.shield(tarea)  # Que una carga anterior no reemplace a esta
+        estado = await self._cargar(usuario_email)
+        return [
+            {
+                "nombre": item.get("nombre", ""),
+                "precio": item.get("precio", 0),
+                "cantidad": item.get("cantidad", 1),
+                "imagen": item.get("imagen", "")
+            }
+            for item in estado.items.values()
+        ]
+
+    def _validar_item(self, item: dict) -> dict:
+        """
+        Normaliza un item a agregar; lanza ValueError si no es válido.
+        Solo se guardan producto_id, nombre, precio, imagen y cantidad.
+        """
+        if not isinstance(item, dict):
+            raise ValueError("Item inválido")
+        try:
+            cantidad = int(item.get("cantidad", 1))
+        except (ValueError, TypeError, OverflowError):
+            raise ValueError("cantidad inválida")
+        if not 1 <= cantidad <= MAX_CANTIDAD_ITEM:
+            raise ValueError(f"cantidad debe estar entre 1 y {MAX_CANTIDAD_ITEM}")
+        precio = item.get("precio")
+        if isinstance(precio, bool) or not isinstance(precio, (int, float)):
+            raise ValueError("precio es requerido y debe ser un número")
+        if not math.isfinite(precio) or not 0 <= precio <= MAX_PRECIO_ITEM:
+            raise ValueError(f"precio debe estar entre 0 y {MAX_PRECIO_ITEM}")
+        for campo in ("producto_id", "nombre", "imagen"):
+            valor = item.get(campo)
+            if isinstance(valor, bool) or not isinstance(valor, (str, int, type(None))):
+                raise ValueError(f"{campo} inválido")
+            if len(str(valor or "")) > MAX_LARGO_TEXTO:
+                raise ValueError(f"{campo} admite a lo más {MAX_LARGO_TEXTO} caracteres")
+        clave = clave_producto(item)
+        if not clave:
+            raise ValueError("producto_id o nombre es requerido")
+        return {
+            "producto_id": clave,
+            "nombre": str(item.get("nombre") or ""),
+            "precio": precio,
+            "imagen": str(item.get("imagen") or ""),
+            "cantidad": cantidad
+        }
+
+    def _agregar_en_estado(self, usuario_email: str, estado: _EstadoCarrito, nuevo: dict) -> ObjectId:
+        """
+        Si el producto ya está en el carrito suma la cantidad a esa línea;
+        si no, agrega una línea nueva. Retorna el _id de la línea.
+        """
+        for id_item, existente in estado.items.items():
+            if clave_producto(existente) == nuevo["producto_id"]:
+                cantidad = existente.get("cantidad", 1)
+                efectivo = min(cantidad + nuevo["cantidad"], MAX_CANTIDAD_ITEM) - cantidad
+                if efectivo > 0:
+                    existente["cantidad"] = cantidad + efectivo
+                    self._cambiar(usuario_email, estado, {"tipo": "cantidad", "item_id": id_item, "delta": efectivo})
+                return existente["_id"]
+        if len(estado.items) >= MAX_LINEAS_CARRITO:
+            raise ValueError(f"El carrito admite a lo más {MAX_LINEAS_CARRITO} productos distintos")
+        nuevo["_id"] = ObjectId()
+        estado.items[str(nuevo["_id"])] = nuevo
+        self._cambiar(usuario_email, estado, {"tipo": "agregar", "item": {**nuevo, "_id": str(nuevo["_id"])}})
+        return nuevo["_id"]
+
     async def agregar_item(self, item: dict):
-        """Agrega un item al carrito con validaciones"""
+        """
+        Agrega un producto al carrito con validaciones; si ya estaba, suma la
+        cantidad a su línea en lugar de duplicarla. Retorna el _id de la línea.
+        """
         if "usuario_email" not in item:
             raise ValueError("usuario_email es requerido")
-        
-        # Verificar si ya existe
-        existente = await self.repository.buscar_item(
-            item["usuario_email"],
-            item.get("nombre")
-        )
-        if existente:
-            raise ValueError("El producto ya está en el carrito")
-        
-        return await self.repository.agregar_item(item)
-    
-    async def eliminar_item(self, id_item: str, usuario_email: str = None):
-        """Elimina un item del carrito"""
-        return await self.repository.eliminar_item(id_item, usuario_email)
-    
-    async def vaciar_carrito(self, usuario_email: str = None):
-        """Vacía el carrito"""
-        await self.repository.vaciar_carrito(usuario_email)
+        nuevo = self._validar_item(item)
+        estado = await self._estado(item["usuario_email"])
+        return self._agregar_en_estado(item["usuario_email"], estado, nuevo)
+
+    async def agregar_items(self, usuario_email: str, items: list) -> list:
+        """
+        Agrega varios productos de una vez. Se validan todos antes de aplicar
+        alguno, y se escriben juntos en el mismo bulk_write del siguiente lote.
+        Retorna el _id de la línea de cada item, en el mismo orden.
+        """
+        if not usuario_email:
+            raise ValueError("usuario_email es requerido")
+        if not isinstance(items, list) or not items:
+            raise ValueError("items debe ser una lista no vacía")
+        if len(items) > MAX_ITEMS_POR_LOTE:
+            raise ValueError(f"Máximo {MAX_ITEMS_POR_LOTE} items por solicitud")
+        nuevos = [self._validar_item(item) for item in items]
+        estado = await self._estado(usuario_email)
+        lineas = {clave_producto(existente) for existente in estado.items.values()}
+        if len(lineas | {nuevo["producto_id"] for nuevo in nuevos}) > MAX_LINEAS_CARRITO:
+            raise ValueError(f"El carrito admite a lo más {MAX_LINEAS_CARRITO} productos distintos")
+        return [self._agregar_en_estado(usuario_email, estado, nuevo) for nuevo in nuevos]
 
+    async def eliminar_item(self, id_item: str, usuario_email: str = None) -> bool:
+        """Elimina un item del carrito; retorna False si no existe"""
+        if not ObjectId.is_valid(id_item):
+            return False
+        usuario_email = usuario_email or await self._resolver_dueno(ObjectId(id_item))
+        if not usuario_email:
+            return False
+        estado = await self._estado(usuario_email)
+        if estado.items.pop(id_item, None) is None:
+            return False
+        self._cambiar(usuario_email, estado, {"tipo": "quitar", "item_id": id_item})
+        return True
 
+    async def cambiar_cantidad(self, id_item: str, delta: int, usuario_email: str = None):
+        """
+        Suma `delta` a la cantidad de un item (entre 1 y MAX_CANTIDAD_ITEM).
+        Retorna el item actualizado o None si no existe.
+        """
+        if not ObjectId.is_valid(id_item):
+            return None
+        usuario_email = usuario_email or await self._resolver_dueno(ObjectId(id_item))
+        if not usuario_email:
+            return None
+        estado = await self._estado(usuario_email)
+        item = estado.items.get(id_item)
+        if item is None:
+            return None
+        delta = max(-MAX_CANTIDAD_ITEM, min(delta, MAX_CANTIDAD_ITEM))
+        nueva = max(1, min(item.get("cantidad", 1) + delta, MAX_CANTIDAD_ITEM))
+        efectivo = nueva - item.get("cantidad", 1)
+        if efectivo:
+            item["cantidad"] = nueva
+            self._cambiar(usuario_email, estado, {"tipo": "cantidad", "item_id": id_item, "delta": efectivo})
+        return item
+
+    async def vaciar_carrito(self, usuario_email: str = None):
+        """Vacía el carrito de un usuario, o todos los carritos si no se indica"""
+        if usuario_email:
+            # Se quitan los items conocidos (si no está en memoria se lee una vez):
+            # así la operación no borra lo que otro proceso agregue después
+            estado = await self._estado(usuario_email)
+            item_ids = list(estado.items)
+            estado.items.clear()
+            self._cambiar(usuario_email, estado, {"tipo": "vaciar", "item_ids": item_ids})
+            return
+        async with self._bloqueo_escritura:
+            await self.repository.vaciar_todos()
+            self._pendientes.clear()
+            self._total_pendientes = 0
+            self._lote_en_curso = None
+            self._estados.clear()
+            if self._diario is not None:
+                self._diario.reescribir([])
 
+    def estadisticas(self) -> dict:
+        return {
+            **self.contadores,
+            "pendientes": self._total_pendientes,
+            "usuarios_con_pendientes": len(self._pendientes),
+            "usuarios_en_memoria": len(self._estados),
+            "diario": self._diario.ruta if self._diario else None
+        }
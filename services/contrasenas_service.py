@@ -0,0 +1,91 @@
+"""
+Servicio de Contraseñas
+Capa de lógica de negocio: hashing y verificación de contraseñas con scrypt
+en un pool de hilos acotado (fuera del event loop), con costo calibrado
+para la máquina y migración de los hashes SHA-256 anteriores al iniciar sesión
+"""
+import os
+import time
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+from models.auth import hash_password, verificar_password, necesita_rehash, COSTO_MAXIMO
+
+COSTO_MINIMO = 12  # N = 2^12: piso aunque la máquina sea lenta
+COSTO_PREDETERMINADO = 14  # Si se usa el servicio sin iniciar() (sin calibrar)
+OBJETIVO_HASH_MS = float(os.getenv("CONTRASENA_OBJETIVO_MS", "50"))  # Tiempo buscado por hash
+COSTO_CONFIGURADO = os.getenv("CONTRASENA_COSTO")  # log2(N) fijo; sin él se calibra al iniciar
+HILOS_HASH = int(os.getenv("CONTRASENA_HILOS", "0")) or min(4, os.cpu_count() or 1)
+
+def calibrar_costo(objetivo_segundos: float) -> int:
+    """
+    Mayor costo (log2 de N) cuyo hash tarda a lo sumo `objetivo_segundos`
+    en esta máquina. El tiempo de scrypt se duplica con cada punto de costo.
+    """
+    costo = COSTO_MINIMO
+    while costo < COSTO_MAXIMO:
+        inicio = time.perf_counter()
+        hash_password("calibracion", costo + 1)
+        if time.perf_counter() - inicio > objetivo_segundos:
+            break
+        costo += 1
+    return costo
+
+class ContrasenasService:
+    """
+    Servicio de contraseñas.
+    scrypt libera el GIL, así que corre en un pool de hilos: el event loop
+    sigue atendiendo otras peticiones mientras se calcula un hash. Un
+    semáforo del tamaño del pool hace que el exceso espere en el loop (y
+    se cancele si el cliente se va) en lugar de encolarse en el pool.
+    """
+
+    def __init__(self, hilos: int = HILOS_HASH, costo: int = None):
+        self.hilos = hilos
+        self.costo = costo if costo is not None else (int(COSTO_CONFIGURADO) if COSTO_CONFIGURADO else None)
+        self._pool = None
+        self._cupos = None
+
+    def _asegurar_pool(self):
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(max_workers=self.hilos, thread_name_prefix="contrasenas")
+            self._cupos = asyncio.Semaphore(self.hilos)
+
+    async def _en_pool(self, funcion, *args):
+        self._asegurar_pool()
+        async with self._cupos:
+            return await asyncio.get_running_loop().run_in_executor(self._pool, funcion, *args)
+
+    async def iniciar(self):
+        """Crea el pool y, si no hay costo configurado, lo calibra contra OBJETIVO_HASH_MS"""
+        self._asegurar_pool()
+        if self.costo is None:
+            self.costo = await self._en_pool(calibrar_costo, OBJETIVO_HASH_MS / 1000)
+        print(f"[CONTRASEÑAS] scrypt N=2^{self.costo}, {self.hilos} hilos")
+
+    def detener(self):
+        """Libera el pool de hilos"""
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    @property
+    def costo_actual(self) -> int:
+        return self.costo if self.costo is not None else COSTO_PREDETERMINADO
+
+    async def hashear(self, password: str) -> str:
+        """Hash scrypt de una contraseña nueva con el costo actual"""
+        return await self._en_pool(hash_password, password, self.costo_actual)
+
+    async def verificar(self, password: str, hash_guardado: str):
+        """
+        Verifica una contraseña. Retorna (válida, hash_nuevo): hash_nuevo no
+        es None cuando la contraseña es válida pero el hash guardado es
+        SHA-256 legado o tiene otro costo, y debe reemplazarse.
+        """
+        hash_guardado = hash_guardado or ""
+        if not await self._en_pool(verificar_password, password, hash_guardado):
+            return False, None
+        if necesita_rehash(hash_guardado, self.costo_actual):
+            return True, await self.hashear(password)
+        return True, None
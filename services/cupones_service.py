@@ -0,0 +1,302 @@
+"""
+Servicio de Cupones
+Capa de lógica de negocio: compila los cupones de `cupones` en un índice en
+memoria por código y calcula su efecto en el servidor al crear una orden
+"""
+import asyncio
+from datetime import datetime, timezone
+
+from pymongo.errors import DuplicateKeyError
+from repositories.cupones_repository import CuponesRepository
+from repositories.revisiones_repository import RevisionesRepository
+
+INTERVALO_RECARGA_SEGUNDOS = 30  # Cada cuánto se revisa si los cupones cambiaron
+CLAVE_REVISION = "cupones"  # Contador en `revisiones` que cambia con cada edición
+TIPOS_CUPON = {"percent": "% de descuento", "fixed": "Descuento fijo", "free_shipping": "Envío gratis"}
+MAX_CUPONES_POR_ORDEN = 3
+
+def normalizar_codigo(codigo) -> str:
+    return (codigo or "").strip().upper()
+
+def _fecha(valor, campo: str):
+    """
+    Fecha ISO 8601 normalizada a UTC, como texto. Una fecha sin zona horaria
+    se interpreta en la hora local del servidor.
+    """
+    if valor is None or valor == "":
+        return None
+    try:
+        if not isinstance(valor, datetime):
+            valor = datetime.fromisoformat(valor)
+        return valor.astimezone(timezone.utc).isoformat()
+    except (TypeError, ValueError, OverflowError, OSError):
+        raise ValueError(f"{campo} debe ser una fecha ISO 8601")
+
+def _entero_opcional(valor, campo: str, minimo: int):
+    if valor is None or valor == "":
+        return None
+    if isinstance(valor, bool) or not isinstance(valor, int) or valor < minimo:
+        raise ValueError(f"{campo} debe ser un entero mayor o igual a {minimo}")
+    return valor
+
+def validar_cupon(datos: dict) -> dict:
+    """
+    Valida y normaliza las reglas de un cupón. Formato:
+    {
+        "codigo": str, "tipo": "percent" | "fixed" | "free_shipping",
+        "valor": int,  # porcentaje (1-100) o monto en CLP; no aplica a free_shipping
+        "etiqueta": str, "activo": bool,
+        "inicio": fecha ISO o None, "expiracion": fecha ISO o None,  # se guardan en UTC
+        "subtotal_minimo": int,
+        "max_usos": int o None,  # entre todos los usuarios
+        "max_usos_por_usuario": int o None,
+        "acumulable": bool  # si se puede combinar con otros cupones acumulables
+    }
+    Lanza ValueError si las reglas no son válidas.
+    """
+    codigo = normalizar_codigo(datos.get("codigo"))
+    if not codigo or ":" in codigo:
+        raise ValueError("codigo es obligatorio y no puede contener ':'")
+    tipo = datos.get("tipo")
+    if tipo not in TIPOS_CUPON:
+        raise ValueError(f"tipo inválido. Opciones: {', '.join(TIPOS_CUPON)}")
+    valor = None
+    if tipo != "free_shipping":
+        valor = _entero_opcional(datos.get("valor"), "valor", 1)
+        if valor is None or (tipo == "percent" and valor > 100):
+            raise ValueError("valor es obligatorio (1-100 para porcentajes)")
+    cupon = {
+        "codigo": codigo,
+        "tipo": tipo,
+        "valor": valor,
+        "etiqueta": str(datos.get("etiqueta") or TIPOS_CUPON[tipo]),
+        "activo": bool(datos.get("activo", True)),
+        "inicio": _fecha(datos.get("inicio"), "inicio"),
+        "expiracion": _fecha(datos.get("expiracion"), "expiracion"),
+        "subtotal_minimo": _entero_opcional(datos.get("subtotal_minimo"), "subtotal_minimo", 0) or 0,
+        "max_usos": _entero_opcional(datos.get("max_usos"), "max_usos", 1),
+        "max_usos_por_usuario": _entero_opcional(datos.get("max_usos_por_usuario"), "max_usos_por_usuario", 1),
+        "acumulable": bool(datos.get("acumulable", False)),
+    }
+    if (cupon["inicio"] and cupon["expiracion"]
+            and datetime.fromisoformat(cupon["inicio"]) >= datetime.fromisoformat(cupon["expiracion"])):
+        raise ValueError("inicio debe ser anterior a expiracion")
+    return cupon
+
+class Cupon:
+    """Cupón compilado: fechas ya convertidas (con zona UTC) y reglas listas para evaluar. Es inmutable."""
+
+    __slots__ = ("reglas", "codigo", "tipo", "valor", "activo", "inicio", "expiracion",
+                 "subtotal_minimo", "max_usos", "max_usos_por_usuario", "acumulable")
+
+    def __init__(self, reglas: dict):
+        self.reglas = reglas
+        self.codigo = reglas["codigo"]
+        self.tipo = reglas["tipo"]
+        self.valor = reglas["valor"]
+        self.activo = reglas["activo"]
+        self.inicio = datetime.fromisoformat(reglas["inicio"]) if reglas["inicio"] else None
+        self.expiracion = datetime.fromisoformat(reglas["expiracion"]) if reglas["expiracion"] else None
+        self.subtotal_minimo = reglas["subtotal_minimo"]
+        self.max_usos = reglas["max_usos"]
+        self.max_usos_por_usuario = reglas["max_usos_por_usuario"]
+        self.acumulable = reglas["acumulable"]
+
+    def vigente(self, ahora: datetime) -> bool:
+        return (
+            self.activo
+            and (self.inicio is None or ahora >= self.inicio)
+            and (self.expiracion is None or ahora < self.expiracion)
+        )
+
+    def descuento(self, subtotal: int) -> int:
+        """Descuento sobre el subtotal (0 para envío gratis)"""
+        if self.tipo == "percent":
+            return subtotal * self.valor // 100
+        if self.tipo == "fixed":
+            return min(subtotal, self.valor)
+        return 0
+
+    def publico(self) -> dict:
+        """Vista para el cliente (mismas claves que usaba el carrito)"""
+        return {
+            "code": self.codigo,
+            "type": self.tipo,
+            "value": self.valor,
+            "label": self.reglas["etiqueta"],
+            "acumulable": self.acumulable,
+            "subtotal_minimo": self.subtotal_minimo,
+            "expiracion": self.reglas["expiracion"],
+        }
+
+class CuponesService:
+    """
+    Servicio que mantiene el índice de cupones compilado y lo recarga en
+    caliente. Los límites de uso no se evalúan en memoria: se reservan con
+    updates condicionados en la base de datos al crear la orden y se liberan
+    si la orden se cancela.
+    """
+
+    def __init__(self, cupones_por_defecto: list = ()):
+        self.repository = CuponesRepository()
+        self.revisiones = RevisionesRepository()
+        # Los cupones por defecto no tienen límites de uso; uno guardado con el mismo código los reemplaza
+        self._por_defecto = {c["codigo"]: Cupon(c) for c in map(validar_cupon, cupones_por_defecto)}
+        self._indice = dict(self._por_defecto)
+        self._version = None
+        self._tarea_recarga = None
+
+    async def cargar(self):
+        """Carga los cupones desde la base de datos y compila el índice"""
+        version = (await self.revisiones.obtener([CLAVE_REVISION]))[CLAVE_REVISION]
+        indice = dict(self._por_defecto)
+        for documento in await self.repository.obtener_todos():
+            try:
+                cupon = Cupon(validar_cupon(documento))
+            except ValueError as e:
+                print(f"Cupón {documento.get('codigo')} ignorado: {e}")
+                continue
+            indice[cupon.codigo] = cupon
+        self._indice = indice
+        self._version = version
+
+    async def verificar_cambios(self):
+        """Recompila si otro proceso editó los cupones (compara solo la revisión)"""
+        version = (await self.revisiones.obtener([CLAVE_REVISION]))[CLAVE_REVISION]
+        if version != self._version:
+            await self.cargar()
+
+    async def _recargar_periodicamente(self, intervalo: float):
+        while True:
+            await asyncio.sleep(intervalo)
+            try:
+                await self.verificar_cambios()
+            except Exception as e:
+                print(f"Error recargando cupones: {e}")
+
+    def iniciar_recarga_automatica(self, intervalo: float = INTERVALO_RECARGA_SEGUNDOS):
+        """Inicia la revisión periódica de cambios en los cupones"""
+        if self._tarea_recarga is None:
+            self._tarea_recarga = asyncio.create_task(self._recargar_periodicamente(intervalo))
+
+    async def detener_recarga_automatica(self):
+        if self._tarea_recarga is not None:
+            self._tarea_recarga.cancel()
+            try:
+                await self._tarea_recarga
+            except asyncio.CancelledError:
+                pass
+            self._tarea_recarga = None
+
+    def obtener(self, codigo: str, subtotal: int = None):
+        """
+        Cupón vigente por código (None si no existe, está inactivo o expiró).
+        Con `subtotal`, lanza ValueError si no alcanza el mínimo.
+        """
+        cupon = self._indice.get(normalizar_codigo(codigo))
+        if cupon is None or not cupon.vigente(datetime.now(timezone.utc)):
+            return None
+        if subtotal is not None and subtotal < cupon.subtotal_minimo:
+            raise ValueError(f"El cupón {cupon.codigo} requiere un subtotal de al menos ${cupon.subtotal_minimo:,}".replace(",", "."))
+        return cupon
+
+    def aplicar(self, codigos: list, subtotal: int, envio: int) -> dict:
+        """
+        Calcula el efecto de los cupones sobre una orden. Los porcentajes se
+        calculan sobre el subtotal y el descuento total nunca lo supera.
+        Retorna {"descuento", "envio", "cupones": [{"codigo", "tipo", "descuento"}]}.
+        Lanza ValueError si un cupón no es válido o no se puede combinar.
+        """
+        codigos = list(dict.fromkeys(normalizar_codigo(c) for c in codigos if normalizar_codigo(c)))
+        if len(codigos) > MAX_CUPONES_POR_ORDEN:
+            raise ValueError(f"Se pueden usar como máximo {MAX_CUPONES_POR_ORDEN} cupones por orden")
+        cupones = []
+        for codigo in codigos:
+            cupon = self.obtener(codigo, subtotal)
+            if cupon is None:
+                raise ValueError(f"Cupón inválido o expirado: {codigo}")
+            cupones.append(cupon)
+        if len(cupones) > 1:
+            no_acumulable = next((c for c in cupones if not c.acumulable), None)
+            if no_acumulable is not None:
+                raise ValueError(f"El cupón {no_acumulable.codigo} no se puede combinar con otros")
+
+        descuento_total = 0
+        aplicados = []
+        for cupon in cupones:
+            descuento = min(cupon.descuento(subtotal), subtotal - descuento_total)
+            descuento_total += descuento
+            if cupon.tipo == "free_shipping":
+                envio = 0
+            aplicados.append({"codigo": cupon.codigo, "tipo": cupon.tipo, "descuento": descuento})
+        return {"descuento": descuento_total, "envio": envio, "cupones": aplicados}
+
+    async def reservar(self, aplicados: list, usuario_email: str, session=None):
+        """
+        Registra el uso de los cupones de una orden, respetando los límites
+        global y por usuario de forma atómica. Lanza ValueError si alguno ya
+        no tiene cupo; sin transacción, deshace los usos ya registrados.
+        """
+        reservados = []
+        try:
+            for aplicado in aplicados:
+                cupon = self._indice.get(aplicado["codigo"])
+                maximo_usuario = cupon.max_usos_por_usuario if cupon else None
+                maximo_global = cupon.max_usos if cupon else None
+                if not await self.repository.reservar_uso_usuario(
+                    aplicado["codigo"], usuario_email, maximo_usuario, session
+                ):
+                    raise ValueError(f"Ya usaste el cupón {aplicado['codigo']} el máximo de veces permitido")
+                if not await self.repository.reservar_uso(aplicado["codigo"], maximo_global, session):
+                    # El uso del usuario ya se sumó: se descuenta antes de deshacer los anteriores
+                    await self.repository.liberar_uso_usuario(aplicado["codigo"], usuario_email, session)
+                    raise ValueError(f"El cupón {aplicado['codigo']} alcanzó su límite de usos")
+                reservados.append(aplicado)
+        except Exception:
+            if session is None:
+                await self.liberar(reservados, usuario_email)
+            raise
+
+    async def liberar(self, aplicados: list, usuario_email: str, session=None):
+        """Devuelve los usos de los cupones de una orden que no se concretó"""
+        for aplicado in aplicados:
+            await self.repository.liberar_uso(aplicado["codigo"], session)
+            if usuario_email:
+                await self.repository.liberar_uso_usuario(aplicado["codigo"], usuario_email, session)
+
+    async def listar(self) -> list:
+        """Cupones guardados con sus usos (para administración)"""
+        return [
+            {**validar_cupon(documento), "usos": documento.get("usos", 0)}
+            for documento in await self.repository.obtener_todos()
+        ]
+
+    async def _registrar_edicion(self):
+        await self.revisiones.incrementar([CLAVE_REVISION])
+        await self.cargar()
+
+    async def crear(self, datos: dict) -> dict:
+        """Crea un cupón; lanza ValueError si las reglas no son válidas o el código ya existe"""
+        cupon = validar_cupon(datos)
+        try:
+            await self.repository.crear(cupon)
+        except DuplicateKeyError:
+            raise ValueError(f"Ya existe el cupón {cupon['codigo']}")
+        await self._registrar_edicion()
+        return cupon
+
+    async def actualizar(self, codigo: str, datos: dict):
+        """Reemplaza las reglas de un cupón (None si no existe)"""
+        cupon = validar_cupon({**datos, "codigo": normalizar_codigo(codigo)})
+        documento = await self.repository.actualizar(cupon["codigo"], cupon)
+        if documento is None:
+            return None
+        await self._registrar_edicion()
+        return {**cupon, "usos": documento.get("usos", 0)}
+
+    async def eliminar(self, codigo: str) -> bool:
+        """Elimina un cupón"""
+        eliminado = await self.repository.eliminar(normalizar_codigo(codigo))
+        if eliminado:
+            await self._registrar_edicion()
+        return eliminado
@@ -2,9 +2,25 @@
 Servicio de Envío
 Capa de lógica de negocio: cálculo de costos de envío
 """
+import os
 import math
+import time
+import asyncio
 import httpx
 
+# NumPy es opcional: solo se usa para el cálculo de envío por lotes
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from services.geocache_service import GeocacheService, NO_CACHEADO, normalizar_direccion
+from services.resiliencia import LimitadorTasa, CircuitBreaker, ServicioNoDisponible
+from services.sucursales_service import SucursalesService
+from services.tarifas_service import TarifasService
+from repositories.usuarios_repository import UsuariosRepository
+from models.metricas import geocodificacion_segundos, nominatim_segundos
+
 # Configuración de envío
 RESTAURANT_LAT = -33.4417
 RESTAURANT_LON = -70.6400
@@ -12,6 +28,86 @@ DISTANCIA_LIMITE_KM = 5.0  # 5 km
 COSTO_ENVIO_LEJOS = 3000  # $3000 si está a más de 5km
 COSTO_ENVIO_CERCA = 0  # Gratis si está a 5km o menos
 
+# Reglas de tarifas usadas mientras no se configuren otras en la base de datos
+REGLAS_TARIFAS_POR_DEFECTO = {
+    "tramos": [{"hasta_km": DISTANCIA_LIMITE_KM, "costo": COSTO_ENVIO_CERCA}],
+    "costo_estandar": COSTO_ENVIO_LEJOS,
+    "recargos": [],
+    "envio_gratis_desde": None
+}
+
+# Configuración de geocodificación (Nominatim)
+NOMINATIM_URL = os.getenv("NOMINATIM_URL", "https://nominatim.openstreetmap.org/search")
+GEOCODIFICACION_TIMEOUT = 5.0
+GEOCODIFICACION_MAX_CONEXIONES = 10
+GEOCODIFICACION_MAX_KEEPALIVE = 5
+NOMINATIM_SOLICITUDES_POR_SEGUNDO = 1.0  # Política de uso de Nominatim
+NOMINATIM_MAX_ESPERA = 1.0  # Segundos máximos esperando turno antes de desistir
+CIRCUITO_UMBRAL_FALLOS = 5  # Fallos consecutivos para abrir el circuito
+CIRCUITO_ENFRIAMIENTO = 30.0  # Segundos que el circuito permanece abierto
+
+# HTTP/2 solo si el paquete opcional "h2" está instalado
+try:
+    import h2  # noqa: F401
+    HTTP2_DISPONIBLE = True
+except ImportError:
+    HTTP2_DISPONIBLE = False
+
+# Tabla de tarifas compilada compartida por todos los cálculos de envío
+tarifas = TarifasService(REGLAS_TARIFAS_POR_DEFECTO)
+
+# Caché de geocodificación compartida por todo el proceso
+geocache = GeocacheService()
+
+# Protección de la llamada a Nominatim: límite de tasa y circuit breaker
+limitador_nominatim = LimitadorTasa(
+    tasa=NOMINATIM_SOLICITUDES_POR_SEGUNDO,
+    max_espera=NOMINATIM_MAX_ESPERA
+)
+circuito_nominatim = CircuitBreaker(
+    umbral_fallos=CIRCUITO_UMBRAL_FALLOS,
+    enfriamiento=CIRCUITO_ENFRIAMIENTO
+)
+
+# Cliente HTTP compartido (se crea al iniciar la app y se cierra al apagarla)
+_cliente_http = None
+
+# Geocodificaciones en curso por dirección normalizada (single-flight)
+_geocodificaciones_en_curso = {}
+
+def crear_cliente_http() -> httpx.AsyncClient:
+    """Crea el cliente HTTP con pool de conexiones y keep-alive"""
+    return httpx.AsyncClient(
+        http2=HTTP2_DISPONIBLE,
+        timeout=GEOCODIFICACION_TIMEOUT,
+        limits=httpx.Limits(
+            max_connections=GEOCODIFICACION_MAX_CONEXIONES,
+            max_keepalive_connections=GEOCODIFICACION_MAX_KEEPALIVE
+        ),
+        headers={"User-Agent": "LibreYRico/1.0"}
+    )
+
+async def iniciar_cliente_http():
+    """Inicializa el cliente HTTP compartido (llamar al iniciar la app)"""
+    global _cliente_http
+    if _cliente_http is None or _cliente_http.is_closed:
+        _cliente_http = crear_cliente_http()
+    return _cliente_http
+
+async def cerrar_cliente_http():
+    """Cierra el cliente HTTP compartido (llamar al apagar la app)"""
+    global _cliente_http
+    if _cliente_http is not None:
+        await _cliente_http.aclose()
+        _cliente_http = None
+
+def obtener_cliente_http() -> httpx.AsyncClient:
+    """Retorna el cliente compartido, creándolo si la app no lo inicializó"""
+    global _cliente_http
+    if _cliente_http is None or _cliente_http.is_closed:
+        _cliente_http = crear_cliente_http()
+    return _cliente_http
+
 def calcular_distancia_haversine(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
     """
     Calcula la distancia entre dos puntos geográficos usando la fórmula de Haversine.
@@ -37,98 +133,267 @@ def calcular_distancia_haversine(lat1: float, lon1: float, lat2: float, lon2: fl
     distancia = R * c
     return distancia
 
+# Registro de sucursales con índice espacial en memoria (se carga al iniciar la app).
+# Si no hay sucursales registradas se usa la ubicación del restaurante.
+sucursales = SucursalesService(distancia=calcular_distancia_haversine)
+
+def sucursal_mas_cercana(lat_cliente: float, lon_cliente: float) -> tuple:
+    """
+    Retorna (sucursal, distancia_km) de la sucursal más cercana al cliente.
+    Sin sucursales registradas, la sucursal es None y la distancia es al restaurante.
+    """
+    resultado = sucursales.mas_cercana(lat_cliente, lon_cliente)
+    if resultado is not None:
+        return resultado
+    return None, calcular_distancia_haversine(RESTAURANT_LAT, RESTAURANT_LON, lat_cliente, lon_cliente)
+
+def calcular_distancias_haversine_lote(lat_origen: float, lon_origen: float, latitudes, longitudes):
+    """
+    Versión vectorizada de calcular_distancia_haversine: calcula de una vez la
+    distancia desde un origen a muchos puntos (o, con broadcasting, desde
+    varios orígenes a muchos puntos).
+    Las coordenadas faltantes (None/NaN) producen NaN.
+    Retorna un arreglo NumPy de distancias en kilómetros.
+    """
+    if np is None:
+        raise RuntimeError("NumPy no está instalado; es necesario para el cálculo por lotes")
+    
+    R = 6371.0
+    lat1 = np.radians(lat_origen)
+    lon1 = np.radians(lon_origen)
+    lat2 = np.radians(np.asarray(latitudes, dtype=np.float64))
+    lon2 = np.radians(np.asarray(longitudes, dtype=np.float64))
+    
+    dlat = lat2 - lat1
+    dlon = lon2 - lon1
+    
+    a = np.sin(dlat / 2)**2 + np.cos(lat1) * np.cos(lat2) * np.sin(dlon / 2)**2
+    c = 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+    return R * c
+
+def calcular_costos_envio_lote(latitudes, longitudes) -> dict:
+    """
+    Calcula distancia a la sucursal más cercana, elegibilidad y costo de envío
+    para muchos clientes a la vez, usando la tabla de tarifas vigente.
+    Los clientes sin coordenadas pagan el costo estándar.
+    Retorna: {
+        "distancia_km": ndarray[float] (NaN si no hay coordenadas),
+        "dentro_radio": ndarray[bool],
+        "costo": ndarray[int],
+        "sucursal_id": list (None si no hay sucursales o coordenadas)
+    }
+    """
+    ids, lats_sucursal, lons_sucursal = sucursales.coordenadas()
+    if not ids:
+        distancias = calcular_distancias_haversine_lote(RESTAURANT_LAT, RESTAURANT_LON, latitudes, longitudes)
+        sucursal_ids = [None] * len(distancias)
+    else:
+        # Matriz sucursales x clientes; se toma la sucursal más cercana de cada cliente
+        matriz = calcular_distancias_haversine_lote(
+            np.asarray(lats_sucursal)[:, None], np.asarray(lons_sucursal)[:, None],
+            np.asarray(latitudes, dtype=np.float64)[None, :],
+            np.asarray(longitudes, dtype=np.float64)[None, :]
+        )
+        indices = np.argmin(np.where(np.isnan(matriz), np.inf, matriz), axis=0)
+        distancias = matriz[indices, np.arange(matriz.shape[1])]
+        sucursal_ids = [None if math.isnan(d) else ids[i] for i, d in zip(indices.tolist(), distancias.tolist())]
+    
+    costos = tarifas.tabla.costos_lote(distancias)
+    dentro_radio = costos == 0
+    return {
+        "distancia_km": distancias,
+        "dentro_radio": dentro_radio,
+        "costo": costos,
+        "sucursal_id": sucursal_ids
+    }
+
 async def geocodificar_direccion(direccion: str) -> tuple:
     """
     Convierte una dirección en coordenadas (latitud, longitud).
-    Usa Nominatim (OpenStreetMap) que es gratuito.
+    Consulta primero la caché (memoria y MongoDB); solo si no está cacheada
+    se llama a Nominatim y se guarda el resultado, incluso si falla.
+    Las llamadas concurrentes para la misma dirección comparten una única
+    resolución en curso.
     Retorna (lat, lon) o None si falla.
     """
+    clave = normalizar_direccion(direccion)
+    if not clave:
+        return None
+    
+    tarea = _geocodificaciones_en_curso.get(clave)
+    if tarea is None:
+        tarea = asyncio.ensure_future(_resolver_direccion(clave, direccion))
+        _geocodificaciones_en_curso[clave] = tarea
+        tarea.add_done_callback(lambda _: _geocodificaciones_en_curso.pop(clave, None))
+    else:
+        geocache.contadores["coalescidas"] += 1
+    
+    # shield: si una petición se cancela, las demás siguen esperando el resultado
+    return await asyncio.shield(tarea)
+
+async def _resolver_direccion(clave: str, direccion: str):
+    """Resuelve una dirección desde la caché o, si no está, desde Nominatim"""
+    inicio = time.perf_counter()
+    coordenadas = await geocache.obtener(clave)
+    if coordenadas is not NO_CACHEADO:
+        geocodificacion_segundos.observar(time.perf_counter() - inicio, "cache")
+        return coordenadas
+    
     try:
-        url = f"https://nominatim.openstreetmap.org/search"
-        params = {
-            "q": direccion,
-            "format": "json",
-            "limit": 1,
-            "countrycodes": "cl"  # Solo Chile
-        }
-        headers = {
-            "User-Agent": "LibreYRico/1.0"
-        }
-        
-        async with httpx.AsyncClient() as client:
-            response = await client.get(url, params=params, headers=headers, timeout=5.0)
-            
-            if response.status_code == 200:
-                data = response.json()
-                if data and len(data) > 0:
-                    lat = float(data[0]["lat"])
-                    lon = float(data[0]["lon"])
-                    return (lat, lon)
+        coordenadas = await consultar_nominatim(direccion)
+    except ServicioNoDisponible:
+        # Fallo transitorio del servicio: no se cachea, se usa el envío estándar
+        geocodificacion_segundos.observar(time.perf_counter() - inicio, "error")
         return None
+    await geocache.guardar(clave, coordenadas)
+    geocodificacion_segundos.observar(time.perf_counter() - inicio, "nominatim")
+    return coordenadas
+
+async def consultar_nominatim(direccion: str) -> tuple:
+    """
+    Geocodifica una dirección usando Nominatim (OpenStreetMap) que es gratuito,
+    respetando su límite de tasa y protegida por un circuit breaker.
+    Retorna (lat, lon), None si la dirección no se encontró, o lanza
+    ServicioNoDisponible si Nominatim falla o no se puede consultar ahora.
+    """
+    try:
+        return await circuito_nominatim.llamar(_consultar_nominatim_limitado, direccion)
+    except ServicioNoDisponible:
+        raise
     except Exception as e:
         print(f"Error en geocodificación: {e}")
-        return None
+        raise ServicioNoDisponible(str(e)) from e
+
+async def _consultar_nominatim_limitado(direccion: str) -> tuple:
+    """Hace la solicitud HTTP a Nominatim; lanza excepción ante errores del servicio"""
+    await limitador_nominatim.adquirir()
+    params = {
+        "q": direccion,
+        "format": "json",
+        "limit": 1,
+        "countrycodes": "cl"  # Solo Chile
+    }
+    
+    inicio = time.perf_counter()
+    resultado = "error"
+    try:
+        response = await obtener_cliente_http().get(NOMINATIM_URL, params=params)
+        response.raise_for_status()
+        resultado = "ok"
+    finally:
+        nominatim_segundos.observar(time.perf_counter() - inicio, resultado)
+    
+    data = response.json()
+    if data and len(data) > 0:
+        lat = float(data[0]["lat"])
+        lon = float(data[0]["lon"])
+        return (lat, lon)
+    return None
+
+def estadisticas_geocodificacion() -> dict:
+    """Estado observable de la geocodificación: caché, límite de tasa y circuito"""
+    return {
+        "cache": geocache.estadisticas(),
+        "limitador": limitador_nominatim.estadisticas(),
+        "circuito": circuito_nominatim.estadisticas()
+    }
+
+def _resultado_envio(costo: int, distancia_km: float = None, sucursal: dict = None, mensaje: str = None) -> dict:
+    """Arma la respuesta de cálculo de envío"""
+    dentro_radio = costo == 0
+    if distancia_km is not None:
+        mensaje = f"Envío {'gratis' if dentro_radio else f'${costo}'} (distancia: {round(distancia_km, 2)} km)"
+    elif dentro_radio:
+        mensaje = "Envío gratis"
+    return {
+        "costo": costo,
+        "distancia_km": round(distancia_km, 2) if distancia_km is not None else None,
+        "dentro_radio": dentro_radio,
+        "sucursal": sucursal,
+        "mensaje": mensaje
+    }
 
-async def calcular_costo_envio(direccion_cliente: str = None, lat_cliente: float = None, lon_cliente: float = None) -> dict:
+async def calcular_costo_envio(direccion_cliente: str = None, lat_cliente: float = None,
+                               lon_cliente: float = None, subtotal: int = None) -> dict:
     """
-    Calcula el costo de envío basado en la distancia desde el restaurante.
+    Calcula el costo de envío según la tabla de tarifas vigente, usando la
+    distancia a la sucursal más cercana (o al restaurante si no hay sucursales).
     Puede usar coordenadas directamente (más rápido) o geocodificar una dirección.
+    Si se indica el subtotal, se aplica el envío gratis por monto.
     Retorna: {
         "costo": int,
         "distancia_km": float,
-        "dentro_radio": bool
+        "dentro_radio": bool,  # True si el envío es gratis
+        "sucursal": dict o None
     }
     """
-    # Si se proporcionan coordenadas directamente, usarlas (más rápido y preciso)
-    if lat_cliente is not None and lon_cliente is not None:
-        distancia_km = calcular_distancia_haversine(
-            RESTAURANT_LAT, RESTAURANT_LON,
-            lat_cliente, lon_cliente
-        )
-        dentro_radio = distancia_km <= DISTANCIA_LIMITE_KM
-        costo = COSTO_ENVIO_CERCA if dentro_radio else COSTO_ENVIO_LEJOS
-        
-        return {
-            "costo": costo,
-            "distancia_km": round(distancia_km, 2),
-            "dentro_radio": dentro_radio,
-            "mensaje": f"Envío {'gratis' if dentro_radio else f'${costo}'} (distancia: {round(distancia_km, 2)} km)"
-        }
+    tabla = tarifas.tabla
     
     # Si no hay coordenadas, intentar geocodificar la dirección
-    if not direccion_cliente:
-        return {
-            "costo": COSTO_ENVIO_LEJOS,
-            "distancia_km": None,
-            "dentro_radio": False,
-            "mensaje": "Dirección no proporcionada, se aplica costo de envío estándar"
-        }
+    if lat_cliente is None or lon_cliente is None:
+        if not direccion_cliente:
+            return _resultado_envio(
+                tabla.costo(None, subtotal),
+                mensaje="Dirección no proporcionada, se aplica costo de envío estándar"
+            )
+        
+        coordenadas = await geocodificar_direccion(direccion_cliente)
+        if not coordenadas:
+            return _resultado_envio(
+                tabla.costo(None, subtotal),
+                mensaje="No se pudo calcular la distancia, se aplica costo de envío estándar"
+            )
+        lat_cliente, lon_cliente = coordenadas
     
-    # Geocodificar dirección del cliente
-    coordenadas = await geocodificar_direccion(direccion_cliente)
+    sucursal, distancia_km = sucursal_mas_cercana(lat_cliente, lon_cliente)
+    return _resultado_envio(tabla.costo(distancia_km, subtotal), distancia_km, sucursal)
+
+async def calcular_envio_usuario(usuario: dict, subtotal: int = None) -> dict:
+    """
+    Calcula el envío de un usuario priorizando sus coordenadas guardadas.
+    Si no las tiene, geocodifica su domicilio (con caché) y guarda las
+    coordenadas resueltas en el usuario para no volver a geocodificarlo.
+    """
+    usuario = usuario or {}
+    lat = usuario.get("latitud")
+    lon = usuario.get("longitud")
+    direccion = usuario.get("domicilio", "")
     
+    # Si tiene coordenadas, usarlas directamente (más rápido)
+    if lat is not None and lon is not None:
+        return await calcular_costo_envio(lat_cliente=lat, lon_cliente=lon, subtotal=subtotal)
+    
+    coordenadas = await geocodificar_direccion(direccion) if direccion else None
     if not coordenadas:
-        return {
-            "costo": COSTO_ENVIO_LEJOS,
-            "distancia_km": None,
-            "dentro_radio": False,
-            "mensaje": "No se pudo calcular la distancia, se aplica costo de envío estándar"
-        }
-    
-    lat_cliente, lon_cliente = coordenadas
-    distancia_km = calcular_distancia_haversine(
-        RESTAURANT_LAT, RESTAURANT_LON,
-        lat_cliente, lon_cliente
-    )
-    dentro_radio = distancia_km <= DISTANCIA_LIMITE_KM
-    costo = COSTO_ENVIO_CERCA if dentro_radio else COSTO_ENVIO_LEJOS
+        return await calcular_costo_envio(direccion_cliente=direccion, subtotal=subtotal)
     
-    return {
-        "costo": costo,
-        "distancia_km": round(distancia_km, 2),
-        "dentro_radio": dentro_radio,
-        "mensaje": f"Envío {'gratis' if dentro_radio else f'${costo}'} (distancia: {round(distancia_km, 2)} km)"
-    }
-
-
+    lat, lon = coordenadas
+    if usuario.get("correo"):
+        await UsuariosRepository().guardar_coordenadas(usuario["correo"], direccion, lat, lon)
+    return await calcular_costo_envio(lat_cliente=lat, lon_cliente=lon, subtotal=subtotal)
 
+async def recalcular_envio_usuarios(tamano_lote: int = 1000):
+    """
+    Recalcula la elegibilidad de envío de todos los usuarios con coordenadas,
+    procesando cada lote de forma vectorizada.
+    Genera un dict por usuario a medida que se procesa cada lote.
+    """
+    repository = UsuariosRepository()
+    async for lote in repository.iterar_coordenadas_por_lotes(tamano_lote):
+        resultado = calcular_costos_envio_lote(
+            [u.get("latitud") for u in lote],
+            [u.get("longitud") for u in lote]
+        )
+        distancias = np.round(resultado["distancia_km"], 2).tolist()
+        dentro_radio = resultado["dentro_radio"].tolist()
+        costos = resultado["costo"].tolist()
+        for i, usuario in enumerate(lote):
+            tiene_coordenadas = not math.isnan(distancias[i])
+            yield {
+                "correo": usuario.get("correo", ""),
+                "sucursal_id": resultado["sucursal_id"][i],
+                "costo": costos[i],
+                "distancia_km": distancias[i] if tiene_coordenadas else None,
+                "dentro_radio": dentro_radio[i],
+                "sin_coordenadas": not tiene_coordenadas
+            }
@@ -0,0 +1,156 @@
+"""
+Formatos de Intercambio
+Capa de lógica de negocio: lectura y escritura incremental de NDJSON y CSV
+para importaciones y exportaciones en streaming (memoria constante)
+"""
+import io
+import csv
+import json
+from models.codificacion import codificar_json
+
+FORMATOS = ("ndjson", "csv")
+TIPOS_CONTENIDO = {"ndjson": "application/x-ndjson", "csv": "text/csv; charset=utf-8"}
+FILAS_POR_BLOQUE = 1000  # Filas que se codifican juntas en cada bloque enviado
+
+def detectar_formato(formato: str = None, tipo_contenido: str = None) -> str:
+    """Formato pedido explícitamente o deducido del Content-Type; lanza ValueError si no se reconoce"""
+    if formato:
+        if formato not in FORMATOS:
+            raise ValueError(f"Formato inválido. Opciones: {', '.join(FORMATOS)}")
+        return formato
+    tipo = (tipo_contenido or "").split(";")[0].strip().lower()
+    if tipo in ("text/csv", "application/csv"):
+        return "csv"
+    if tipo in ("application/x-ndjson", "application/ndjson", "application/jsonl", "application/json-lines"):
+        return "ndjson"
+    raise ValueError("Indique el formato (?formato=ndjson|csv) o un Content-Type de NDJSON o CSV")
+
+async def leer_lineas(bloques):
+    """
+    Convierte un flujo asíncrono de bytes en líneas de texto (con su salto de
+    línea), sin acumular más que la línea en curso
+    """
+    pendiente = b""
+    primera = True
+    async for bloque in bloques:
+        pendiente += bloque
+        *lineas, pendiente = pendiente.split(b"\n")
+        for linea in lineas:
+            # utf-8-sig descarta el BOM que agregan algunas planillas
+            yield linea.decode("utf-8-sig" if primera else "utf-8") + "\n"
+            primera = False
+    if pendiente:
+        yield pendiente.decode("utf-8-sig" if primera else "utf-8")
+
+async def registros_ndjson(lineas):
+    """Genera (número de línea, registro, error) por cada línea no vacía"""
+    numero = 0
+    async for linea in lineas:
+        numero += 1
+        if not linea.strip():
+            continue
+        try:
+            registro = json.loads(linea)
+        except ValueError as e:
+            yield numero, None, f"JSON inválido: {e}"
+            continue
+        if not isinstance(registro, dict):
+            yield numero, None, "Cada línea debe ser un objeto JSON"
+            continue
+        yield numero, registro, None
+
+# Estados del campo en curso al recorrer una línea CSV
+_INICIO_CAMPO, _EN_CAMPO, _EN_COMILLAS, _COMILLA_EN_COMILLAS = range(4)
+
+def _comillas_abiertas(linea: str, abiertas: bool) -> bool:
+    """
+    Indica si al final de la línea sigue abierto un campo entre comillas, con
+    las reglas de csv.reader: las comillas solo abren un campo si son su
+    primer carácter (Pizza 12" es texto) y dentro de él "" es una comilla.
+    """
+    if not abiertas and '"' not in linea:
+        return False
+    estado = _EN_COMILLAS if abiertas else _INICIO_CAMPO
+    for caracter in linea:
+        if estado == _EN_COMILLAS:
+            if caracter == '"':
+                estado = _COMILLA_EN_COMILLAS
+        elif caracter == ",":
+            estado = _INICIO_CAMPO
+        elif estado == _INICIO_CAMPO:
+            estado = _EN_COMILLAS if caracter == '"' else _EN_CAMPO
+        elif estado == _COMILLA_EN_COMILLAS:
+            estado = _EN_COMILLAS if caracter == '"' else _EN_CAMPO
+    return estado == _EN_COMILLAS
+
+async def registros_csv(lineas):
+    """
+    Genera (número de línea, registro, error) por cada fila; la primera fila
+    es el encabezado. Las celdas vacías se omiten del registro. Una fila con
+    un campo entre comillas sin cerrar continúa en las líneas siguientes.
+    """
+    encabezado = None
+    acumulado, inicio, numero, abiertas = "", 0, 0, False
+    async for linea in lineas:
+        numero += 1
+        if not acumulado:
+            inicio = numero
+        acumulado += linea
+        abiertas = _comillas_abiertas(linea, abiertas)
+        if abiertas:
+            continue
+        fila, acumulado = acumulado, ""
+        if not fila.strip():
+            continue
+        try:
+            celdas = next(csv.reader([fila]))
+        except csv.Error as e:
+            yield inicio, None, f"CSV inválido: {e}"
+            continue
+        if encabezado is None:
+            encabezado = [c.strip() for c in celdas]
+            continue
+        if len(celdas) > len(encabezado):
+            yield inicio, None, "La fila tiene más columnas que el encabezado"
+            continue
+        yield inicio, {c: v for c, v in zip(encabezado, celdas) if v != ""}, None
+    if acumulado.strip():
+        yield inicio, None, "CSV inválido: comillas sin cerrar"
+
+async def registros(bloques, formato: str):
+    """Registros de un cuerpo en streaming según su formato"""
+    lineas = leer_lineas(bloques)
+    generador = registros_csv(lineas) if formato == "csv" else registros_ndjson(lineas)
+    async for resultado in generador:
+        yield resultado
+
+async def codificar_ndjson(documentos):
+    """Codifica documentos como NDJSON en bloques de bytes (ObjectId y fechas incluidos)"""
+    bloque = []
+    async for documento in documentos:
+        bloque.append(codificar_json(documento))
+        if len(bloque) >= FILAS_POR_BLOQUE:
+            yield b"\n".join(bloque) + b"\n"
+            bloque = []
+    if bloque:
+        yield b"\n".join(bloque) + b"\n"
+
+async def codificar_csv(documentos, columnas: list):
+    """Codifica documentos como CSV (con encabezado) en bloques de texto"""
+    salida = io.StringIO()
+    escritor = csv.writer(salida, lineterminator="\n")
+    escritor.writerow(columnas)
+    filas = 0
+    async for documento in documentos:
+        escritor.writerow(["" if documento.get(c) is None else documento.get(c) for c in columnas])
+        filas += 1
+        if filas >= FILAS_POR_BLOQUE:
+            yield salida.getvalue()
+            salida.seek(0)
+            salida.truncate()
+            filas = 0
+    yield salida.getvalue()
+
+def codificar(documentos, formato: str, columnas: list):
+    """Generador de bloques (bytes o texto) para StreamingResponse en el formato pedido"""
+    return codificar_csv(documentos, columnas) if formato == "csv" else codificar_ndjson(documentos)
@@ -0,0 +1,133 @@
+"""
+Servicio de Caché de Geocodificación
+Capa de lógica de negocio: caché en dos niveles (LRU en memoria + MongoDB)
+para no geocodificar la misma dirección más de una vez dentro del TTL
+"""
+import re
+import time
+import datetime
+import unicodedata
+from collections import OrderedDict
+
+from repositories.geocodificacion_repository import GeocodificacionRepository
+
+# Configuración de la caché
+GEOCACHE_TTL_SEGUNDOS = 30 * 24 * 3600  # 30 días para direcciones resueltas
+GEOCACHE_TTL_NEGATIVO_SEGUNDOS = 3600  # 1 hora para direcciones que no se pudieron resolver
+GEOCACHE_MAX_ENTRADAS = 10000  # Tamaño máximo de la LRU en memoria
+
+# Marcador para distinguir "no está en caché" de "está en caché como fallida"
+NO_CACHEADO = object()
+
+def normalizar_direccion(direccion: str) -> str:
+    """
+    Normaliza una dirección para usarla como clave de caché:
+    minúsculas, sin tildes, sin puntuación sobrante y con espacios colapsados.
+    """
+    texto = unicodedata.normalize("NFKD", direccion or "")
+    texto = "".join(c for c in texto if not unicodedata.combining(c))
+    texto = texto.lower()
+    texto = re.sub(r"[^\w\s#-]", " ", texto)
+    texto = re.sub(r"\s+", " ", texto)
+    return texto.strip()
+
+class GeocacheService:
+    """Caché de geocodificación: LRU en proceso respaldada por MongoDB"""
+
+    def __init__(self, ttl_segundos: float = GEOCACHE_TTL_SEGUNDOS,
+                 ttl_negativo_segundos: float = GEOCACHE_TTL_NEGATIVO_SEGUNDOS,
+                 max_entradas: int = GEOCACHE_MAX_ENTRADAS):
+        self.repository = GeocodificacionRepository()
+        self.ttl_segundos = ttl_segundos
+        self.ttl_negativo_segundos = ttl_negativo_segundos
+        self.max_entradas = max_entradas
+        # clave -> (coordenadas o None, instante monotónico de expiración)
+        self._lru = OrderedDict()
+        self.contadores = {
+            "hits_memoria": 0,
+            "hits_mongo": 0,
+            "hits_negativos": 0,
+            "misses": 0,
+            "coalescidas": 0,
+            "errores_mongo": 0
+        }
+
+    def _guardar_en_memoria(self, clave: str, coordenadas, ttl: float):
+        """Guarda una entrada en la LRU, desalojando la menos usada si se llena"""
+        self._lru[clave] = (coordenadas, time.monotonic() + ttl)
+        self._lru.move_to_end(clave)
+        while len(self._lru) > self.max_entradas:
+            self._lru.popitem(last=False)
+
+    def _ttl_para(self, coordenadas) -> float:
+        return self.ttl_segundos if coordenadas is not None else self.ttl_negativo_segundos
+
+    async def obtener(self, clave: str):
+        """
+        Busca una dirección normalizada en la caché.
+        Retorna (lat, lon), None (fallo cacheado) o NO_CACHEADO.
+        """
+        entrada = self._lru.get(clave)
+        if entrada is not None:
+            coordenadas, expira = entrada
+            if expira > time.monotonic():
+                self._lru.move_to_end(clave)
+                self.contadores["hits_memoria"] += 1
+                if coordenadas is None:
+                    self.contadores["hits_negativos"] += 1
+                return coordenadas
+            del self._lru[clave]
+
+        try:
+            ahora = datetime.datetime.now(datetime.timezone.utc)
+            documento = await self.repository.obtener(clave, ahora)
+        except Exception as e:
+            print(f"Error leyendo caché de geocodificación: {e}")
+            self.contadores["errores_mongo"] += 1
+            documento = None
+
+        if documento is None:
+            self.contadores["misses"] += 1
+            return NO_CACHEADO
+
+        coordenadas = None
+        if documento.get("encontrado"):
+            coordenadas = (documento["latitud"], documento["longitud"])
+
+        # Respetar la expiración persistida al poblar la LRU
+        expiracion = documento["expiracion"]
+        if expiracion.tzinfo is None:
+            expiracion = expiracion.replace(tzinfo=datetime.timezone.utc)
+        restante = (expiracion - ahora).total_seconds()
+        self._guardar_en_memoria(clave, coordenadas, min(restante, self._ttl_para(coordenadas)))
+
+        self.contadores["hits_mongo"] += 1
+        if coordenadas is None:
+            self.contadores["hits_negativos"] += 1
+        return coordenadas
+
+    async def guardar(self, clave: str, coordenadas):
+        """Guarda el resultado (exitoso o fallido) en ambos niveles"""
+        ttl = self._ttl_para(coordenadas)
+        self._guardar_en_memoria(clave, coordenadas, ttl)
+        try:
+            ahora = datetime.datetime.now(datetime.timezone.utc)
+            expiracion = ahora + datetime.timedelta(seconds=ttl)
+            await self.repository.guardar(clave, coordenadas, expiracion, ahora)
+        except Exception as e:
+            print(f"Error guardando caché de geocodificación: {e}")
+            self.contadores["errores_mongo"] += 1
+
+    def limpiar_memoria(self):
+        """Vacía la LRU en memoria (la caché persistente se mantiene)"""
+        self._lru.clear()
+
+    def estadisticas(self) -> dict:
+        """Retorna los contadores de aciertos/fallos y el tamaño de la LRU"""
+        hits = self.contadores["hits_memoria"] + self.contadores["hits_mongo"]
+        total = hits + self.contadores["misses"]
+        return {
+            **self.contadores,
+            "entradas_memoria": len(self._lru),
+            "tasa_aciertos": round(hits / total, 4) if total else None
+        }
@@ -0,0 +1,128 @@
+"""
+Índice Espacial
+Capa de lógica de negocio: índice en memoria por celdas de grilla para
+buscar el punto más cercano sin recorrer todos los puntos
+"""
+import math
+
+# Kilómetros por grado de latitud (aprox. constante)
+KM_POR_GRADO = 111.32
+
+class IndiceEspacial:
+    """
+    Agrupa puntos en celdas de `tamano_celda` grados. Agregar o quitar un punto
+    solo toca su celda; la búsqueda del más cercano recorre anillos de celdas
+    alrededor de la consulta y se detiene cuando ningún anillo siguiente
+    puede contener un punto más cercano.
+    """
+
+    def __init__(self, distancia, tamano_celda: float = 0.05):
+        # distancia(lat1, lon1, lat2, lon2) -> km
+        self.distancia = distancia
+        self.tamano_celda = tamano_celda
+        self._celdas = {}  # (fila, columna) -> {id: (lat, lon)}
+        self._puntos = {}  # id -> (lat, lon, celda)
+        # Extensión de las celdas ocupadas, para acotar la búsqueda
+        self._min_celda = None
+        self._max_celda = None
+
+    def __len__(self):
+        return len(self._puntos)
+
+    def _celda(self, lat: float, lon: float) -> tuple:
+        return (math.floor(lat / self.tamano_celda), math.floor(lon / self.tamano_celda))
+
+    def agregar(self, id_punto, lat: float, lon: float):
+        """Agrega (o mueve) un punto actualizando solo su celda"""
+        if id_punto in self._puntos:
+            self.eliminar(id_punto)
+        celda = self._celda(lat, lon)
+        self._celdas.setdefault(celda, {})[id_punto] = (lat, lon)
+        self._puntos[id_punto] = (lat, lon, celda)
+        if self._min_celda is None:
+            self._min_celda, self._max_celda = celda, celda
+        else:
+            self._min_celda = (min(self._min_celda[0], celda[0]), min(self._min_celda[1], celda[1]))
+            self._max_celda = (max(self._max_celda[0], celda[0]), max(self._max_celda[1], celda[1]))
+
+    def eliminar(self, id_punto) -> bool:
+        """Quita un punto de su celda; retorna False si no estaba"""
+        punto = self._puntos.pop(id_punto, None)
+        if punto is None:
+            return False
+        celda = punto[2]
+        bucket = self._celdas[celda]
+        del bucket[id_punto]
+        if not bucket:
+            del self._celdas[celda]
+        if not self._puntos:
+            self._min_celda, self._max_celda = None, None
+        return True
+
+    def limpiar(self):
+        self._celdas.clear()
+        self._puntos.clear()
+        self._min_celda, self._max_celda = None, None
+
+    def _celdas_del_anillo(self, centro: tuple, radio: int):
+        """Celdas a distancia de Chebyshev exactamente `radio` del centro"""
+        fila, columna = centro
+        if radio == 0:
+            yield centro
+            return
+        for c in range(columna - radio, columna + radio + 1):
+            yield (fila - radio, c)
+            yield (fila + radio, c)
+        for f in range(fila - radio + 1, fila + radio):
+            yield (f, columna - radio)
+            yield (f, columna + radio)
+
+    def mas_cercano(self, lat: float, lon: float):
+        """
+        Retorna (id, distancia_km) del punto más cercano, o None si el índice
+        está vacío.
+        """
+        if not self._puntos:
+            return None
+
+        centro = self._celda(lat, lon)
+        # Anillo a partir del cual ya no quedan celdas ocupadas
+        radio_max = max(
+            abs(centro[0] - self._min_celda[0]), abs(centro[0] - self._max_celda[0]),
+            abs(centro[1] - self._min_celda[1]), abs(centro[1] - self._max_celda[1])
+        )
+
+        # Los anillos más cercanos que la extensión ocupada están vacíos
+        radio_min = max(
+            self._min_celda[0] - centro[0], centro[0] - self._max_celda[0],
+            self._min_celda[1] - centro[1], centro[1] - self._max_celda[1], 0
+        )
+
+        mejor_id, mejor_distancia = None, float("inf")
+        for radio in range(radio_min, radio_max + 1):
+            # Lejos de los puntos los anillos tienen más celdas vacías que celdas
+            # ocupadas: es más barato revisar directamente todos los puntos
+            if 8 * radio > len(self._celdas):
+                for id_punto, (p_lat, p_lon, _) in self._puntos.items():
+                    d = self.distancia(lat, lon, p_lat, p_lon)
+                    if d < mejor_distancia:
+                        mejor_id, mejor_distancia = id_punto, d
+                break
+            for celda in self._celdas_del_anillo(centro, radio):
+                bucket = self._celdas.get(celda)
+                if not bucket:
+                    continue
+                for id_punto, (p_lat, p_lon) in bucket.items():
+                    d = self.distancia(lat, lon, p_lat, p_lon)
+                    if d < mejor_distancia:
+                        mejor_id, mejor_distancia = id_punto, d
+
+            # Cualquier punto fuera de este anillo está al menos a `radio` celdas;
+            # se usa el ancho en longitud más angosto del área para no subestimar
+            if mejor_id is not None:
+                lat_extrema = min(abs(lat) + (radio + 1) * self.tamano_celda, 89.9)
+                ancho_km = self.tamano_celda * KM_POR_GRADO * math.cos(math.radians(lat_extrema))
+                if mejor_distancia <= radio * ancho_km:
+                    break
+
+        return mejor_id, mejor_distancia
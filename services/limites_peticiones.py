@@ -0,0 +1,179 @@
+"""
+Límites de Peticiones
+Capa de lógica de negocio: limitación por IP y por usuario (GCRA) de los
+endpoints sensibles, aplicada en un middleware ASGI antes de que corra el
+controlador o se toque la base de datos
+"""
+import os
+import json
+import time
+
+# Endpoints limitados: (método, ruta) -> {dimensión: (peticiones, período en segundos)}
+# "usuario" es el correo del cuerpo JSON; "ip" la dirección del cliente.
+LIMITES = {
+    ("POST", "/usuarios/login"): {"ip": (20, 60), "usuario": (5, 60)},
+    ("POST", "/usuarios/validar-correo"): {"ip": (20, 60), "usuario": (5, 60)},
+    ("POST", "/usuarios/solicitar-cambio-password"): {"ip": (5, 60), "usuario": (3, 900)},
+}
+MAX_CUERPO_INSPECCIONADO = 16 * 1024  # En endpoints con límite por usuario, cuerpos más grandes reciben 413
+INTERVALO_LIMPIEZA_SEGUNDOS = 30.0
+CONFIAR_X_FORWARDED_FOR = os.getenv("CONFIAR_X_FORWARDED_FOR", "0") == "1"  # Solo detrás de un proxy propio
+
+class LimitesPeticiones:
+    """
+    GCRA (generic cell rate algorithm): por cada clave se guarda un solo
+    número, el instante teórico de la próxima llegada (TAT). Admitir o
+    rechazar es O(1); una clave cuyo TAT ya pasó equivale a no tener
+    historial, así que la limpieza periódica simplemente las descarta.
+    """
+
+    def __init__(self, limites: dict = LIMITES):
+        # Por endpoint y dimensión: (intervalo entre peticiones, tolerancia de ráfaga)
+        self.limites = {
+            ruta: {dimension: (periodo / peticiones, periodo - periodo / peticiones)
+                   for dimension, (peticiones, periodo) in dimensiones.items()}
+            for ruta, dimensiones in limites.items()
+        }
+        self._tat = {}  # (ruta, dimensión, valor) -> instante teórico de llegada
+        self._proxima_limpieza = time.monotonic() + INTERVALO_LIMPIEZA_SEGUNDOS
+        self.contadores = {
+            f"{metodo} {ruta}": {"permitidas": 0, "rechazadas_ip": 0, "rechazadas_usuario": 0,
+                                 "rechazadas_cuerpo": 0}
+            for metodo, ruta in limites
+        }
+
+    def regla(self, metodo: str, ruta: str):
+        """Límites del endpoint (None si no está limitado)"""
+        return self.limites.get((metodo, ruta))
+
+    def consumir(self, ruta: tuple, dimension: str, valor: str, ahora: float) -> float:
+        """Registra una petición; retorna 0 si se admite o los segundos a esperar si no"""
+        intervalo, tolerancia = self.limites[ruta][dimension]
+        clave = (ruta, dimension, valor)
+        tat = max(self._tat.get(clave, ahora), ahora)
+        exceso = tat - ahora - tolerancia
+        if exceso > 0:
+            return exceso
+        self._tat[clave] = tat + intervalo
+        return 0.0
+
+    def registrar(self, ruta: tuple, resultado: str):
+        self.contadores[f"{ruta[0]} {ruta[1]}"][resultado] += 1
+
+    def limpiar(self, ahora: float):
+        """Descarta las claves ya recuperadas (como mucho cada INTERVALO_LIMPIEZA_SEGUNDOS)"""
+        if ahora < self._proxima_limpieza:
+            return
+        self._tat = {clave: tat for clave, tat in self._tat.items() if tat > ahora}
+        self._proxima_limpieza = ahora + INTERVALO_LIMPIEZA_SEGUNDOS
+
+    def estadisticas(self) -> dict:
+        return {"endpoints": self.contadores, "claves_activas": len(self._tat)}
+
+def _ip_cliente(scope) -> str:
+    if CONFIAR_X_FORWARDED_FOR:
+        for nombre, valor in scope.get("headers", []):
+            if nombre == b"x-forwarded-for":
+                return valor.decode("latin-1").split(",")[0].strip()
+    cliente = scope.get("client")
+    return cliente[0] if cliente else ""
+
+def _correo_del_cuerpo(cuerpo: bytes) -> str:
+    try:
+        datos = json.loads(cuerpo)
+    except ValueError:
+        return ""
+    correo = datos.get("correo") if isinstance(datos, dict) else None
+    return correo.strip().lower() if isinstance(correo, str) else ""
+
+class MiddlewareLimites:
+    """
+    Middleware ASGI: en los endpoints de LIMITES aplica primero el límite por
+    IP y luego, si lo hay, el límite por correo (leyendo el cuerpo, que luego
+    se entrega intacto al controlador). El exceso recibe 429 con Retry-After.
+    Un cuerpo mayor que MAX_CUERPO_INSPECCIONADO recibe 413: si pasara sin
+    leerse, rellenar el JSON bastaría para saltarse el límite por correo.
+    """
+
+    def __init__(self, app, limitador: LimitesPeticiones):
+        self.app = app
+        self.limitador = limitador
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        ruta = (scope["method"], scope["path"])
+        regla = self.limitador.regla(*ruta)
+        if regla is None:
+            return await self.app(scope, receive, send)
+
+        ahora = time.monotonic()
+        self.limitador.limpiar(ahora)
+        if "ip" in regla:
+            espera = self.limitador.consumir(ruta, "ip", _ip_cliente(scope), ahora)
+            if espera:
+                self.limitador.registrar(ruta, "rechazadas_ip")
+                return await self._rechazar(send, espera)
+
+        if "usuario" in regla:
+            mensajes, cuerpo = await self._leer_cuerpo(receive)
+            if cuerpo is None:
+                self.limitador.registrar(ruta, "rechazadas_cuerpo")
+                return await self._responder(send, 413, "El cuerpo de la solicitud es demasiado grande.")
+            correo = _correo_del_cuerpo(cuerpo)
+            if correo:
+                espera = self.limitador.consumir(ruta, "usuario", correo, ahora)
+                if espera:
+                    self.limitador.registrar(ruta, "rechazadas_usuario")
+                    return await self._rechazar(send, espera)
+            receive = self._repetir(mensajes, receive)
+
+        self.limitador.registrar(ruta, "permitidas")
+        await self.app(scope, receive, send)
+
+    async def _leer_cuerpo(self, receive):
+        """Lee el cuerpo (mensajes para reenviarlo, bytes o None si excede el máximo)"""
+        mensajes, partes, largo = [], [], 0
+        while True:
+            mensaje = await receive()
+            mensajes.append(mensaje)
+            if mensaje["type"] != "http.request":
+                return mensajes, b""  # Desconexión: el controlador la recibe al leer
+            partes.append(mensaje.get("body", b""))
+            largo += len(partes[-1])
+            if largo > MAX_CUERPO_INSPECCIONADO:
+                return mensajes, None
+            if not mensaje.get("more_body", False):
+                return mensajes, b"".join(partes)
+
+    @staticmethod
+    def _repetir(mensajes: list, receive):
+        """receive que entrega primero los mensajes ya leídos"""
+        pendientes = list(mensajes)
+
+        async def recibir():
+            if pendientes:
+                return pendientes.pop(0)
+            return await receive()
+        return recibir
+
+    @classmethod
+    async def _rechazar(cls, send, espera: float):
+        await cls._responder(
+            send, 429, "Demasiadas solicitudes. Intenta nuevamente más tarde.",
+            [(b"retry-after", str(max(1, int(espera + 0.999))).encode())]
+        )
+
+    @staticmethod
+    async def _responder(send, estado: int, detalle: str, headers: list = ()):
+        cuerpo = json.dumps({"detail": detalle}).encode("utf-8")
+        await send({
+            "type": "http.response.start",
+            "status": estado,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(cuerpo)).encode()),
+                *headers,
+            ],
+        })
+        await send({"type": "http.response.body", "body": cuerpo})
@@ -0,0 +1,296 @@
+"""
+Servicio de Órdenes
+Capa de lógica de negocio: checkout (creación, pago y cancelación de órdenes)
+con el mínimo de viajes a la base de datos
+"""
+import asyncio
+from datetime import date, datetime, timedelta
+from bson import ObjectId
+from bson.errors import InvalidId
+
+from repositories.database import ejecutar_en_transaccion
+from repositories.ordenes_repository import OrdenesRepository, condicion_estado
+from repositories.usuarios_repository import UsuariosRepository
+from services.envio_service import calcular_envio_usuario
+from services.productos_service import codificar_cursor, decodificar_cursor
+from services import formatos
+from models.serializers import (
+    serializar_orden, serializar_orden_resumen, PROYECCION_ORDEN, PROYECCION_ORDEN_RESUMEN
+)
+
+LIMITE_PREDETERMINADO_ORDENES = 50
+LIMITE_MAXIMO_ORDENES = 200
+COLUMNAS_EXPORTACION = [
+    "_id", "fecha_creacion", "usuario_email", "estado", "productos", "subtotal",
+    "descuento", "envio", "total", "cupon_codigo", "metodo_pago_usado",
+    "fecha_pago", "fecha_cancelacion", "direccion_envio"
+]
+
+def medio_pago_del_usuario(usuario: dict, medio_pago_id):
+    """ObjectId del medio de pago si es uno de los medios del documento del usuario; si no, None"""
+    if not usuario or not medio_pago_id:
+        return None
+    try:
+        medio_oid = ObjectId(medio_pago_id)
+    except (InvalidId, TypeError):
+        return None
+    if any(m.get("_id") == medio_oid for m in usuario.get("medios_pago", [])):
+        return medio_oid
+    return None
+
+def filtro_historial(usuario_email: str = None, estado: str = None, fecha: str = None) -> dict:
+    """
+    Filtro del historial por usuario, estado y día de creación (AAAA-MM-DD).
+    Lanza ValueError si la fecha no es válida.
+    """
+    filtro = {}
+    if usuario_email:
+        filtro["usuario_email"] = usuario_email
+    if estado:
+        filtro["estado"] = condicion_estado(estado)
+    if fecha:
+        try:
+            dia = date.fromisoformat(fecha)
+        except ValueError:
+            raise ValueError("fecha debe tener el formato AAAA-MM-DD")
+        # fecha_creacion es ISO 8601: el orden de los textos es el de las fechas
+        filtro["fecha_creacion"] = {"$gte": dia.isoformat(), "$lt": (dia + timedelta(days=1)).isoformat()}
+    return filtro
+
+class OrdenesService:
+    """
+    Servicio para lógica de negocio de órdenes.
+    - Crear: carrito y usuario se leen en paralelo y la respuesta se arma con
+      el documento insertado, sin volver a leerlo.
+    - Pagar / cancelar: un solo find_one_and_update condicionado al estado
+      "pendiente", de modo que dos solicitudes simultáneas no pueden pagar (o
+      cancelar) la misma orden. El estado actual solo se lee para explicar
+      un rechazo.
+    - El medio de pago elegido al crear se verifica contra el usuario ya
+      leído; al pagar con ese medio la propiedad se exige en el mismo update,
+      sin buscar al dueño.
+    """
+
+    def __init__(self, carrito, analitica, cupones):
+        self.repository = OrdenesRepository()
+        # CarritoService compartido: su estado en memoria es el carrito vigente
+        self.carrito = carrito
+        # AnaliticaService: sus acumulados se actualizan con cada pago o cancelación
+        self.analitica = analitica
+        # CuponesService: calcula el descuento y reserva los usos de los cupones
+        self.cupones = cupones
+        self.usuarios = UsuariosRepository()
+
+    async def crear_desde_carrito(self, usuario_email: str, orden_data: dict, usuario: dict = None) -> dict:
+        """
+        Crea una orden pendiente con el carrito del usuario. El descuento y el
+        envío se calculan aquí con los cupones indicados (`cupones` o
+        `cupon_codigo`); los montos que envíe el cliente se ignoran.
+        `usuario` es el documento ya obtenido (p. ej. de la sesión), si lo hay.
+        Lanza ValueError si el carrito está vacío o un cupón no es aplicable.
+        """
+        if usuario is None:
+            carrito_items, usuario = await asyncio.gather(
+                self.carrito.obtener_items_orden(usuario_email),
+                self.usuarios.obtener_por_correo(usuario_email)
+            )
+        else:
+            carrito_items = await self.carrito.obtener_items_orden(usuario_email)
+        if not carrito_items:
+            raise ValueError("El carrito está vacío")
+        for item in carrito_items:
+            item.setdefault("nombre", "")
+            item.setdefault("precio", 0)
+            item.setdefault("cantidad", 1)
+            item.setdefault("imagen", "")
+
+        subtotal = sum(item["precio"] * item["cantidad"] for item in carrito_items)
+        direccion = usuario.get("domicilio", "") if usuario else ""
+
+        codigos = orden_data.get("cupones") or [orden_data.get("cupon_codigo") or ""]
+        if not isinstance(codigos, list):
+            raise ValueError("cupones debe ser una lista de códigos")
+        # Se valida antes de geocodificar para rechazar pronto un cupón inválido
+        self.cupones.aplicar(codigos, subtotal, 0)
+
+        distancia_info = await calcular_envio_usuario(usuario, subtotal)
+        efecto = self.cupones.aplicar(codigos, subtotal, distancia_info["costo"])
+        descuento, envio = efecto["descuento"], efecto["envio"]
+        total = subtotal - descuento + envio
+
+        nueva_orden = {
+            "usuario_email": usuario_email,
+            "productos": carrito_items,
+            "subtotal": subtotal,
+            "descuento": descuento,
+            "envio": envio,
+            "total": total,
+            "estado": "pendiente",
+            "medio_pago_id": orden_data.get("medio_pago_id"),
+            # Solo si es un medio del dueño: pagar con él no requiere buscar al dueño
+            "medio_pago_verificado": medio_pago_del_usuario(usuario, orden_data.get("medio_pago_id")),
+            "fecha_creacion": datetime.now().isoformat(),
+            "cupones": efecto["cupones"],
+            "cupon_codigo": ", ".join(c["codigo"] for c in efecto["cupones"]),
+            "direccion_envio": direccion,
+            "distancia_km": distancia_info.get("distancia_km"),
+            "dentro_radio_envio": distancia_info.get("dentro_radio")
+        }
+
+        async def reservar_y_crear(session):
+            await self.cupones.reservar(efecto["cupones"], usuario_email, session)
+            try:
+                return await self.repository.crear(dict(nueva_orden), session)
+            except Exception:
+                if session is None:
+                    await self.cupones.liberar(efecto["cupones"], usuario_email)
+                raise
+
+        return await ejecutar_en_transaccion(reservar_y_crear)
+
+    async def listar(self, usuario_email: str = None, estado: str = None, fecha: str = None,
+                     limite: int = None, cursor: str = None):
+        """
+        Una página del historial, de la más reciente a la más antigua, con
+        paginación por cursor (keyset) sobre (fecha_creacion, _id) y solo los
+        campos del listado.
+        Retorna (órdenes serializadas, cursor de la página siguiente o None).
+        """
+        limite = limite or LIMITE_PREDETERMINADO_ORDENES
+        if not 1 <= limite <= LIMITE_MAXIMO_ORDENES:
+            raise ValueError(f"limite debe estar entre 1 y {LIMITE_MAXIMO_ORDENES}")
+        filtro = filtro_historial(usuario_email, estado, fecha)
+        if cursor:
+            fecha_ultima, ultimo_id = decodificar_cursor(cursor)
+            posicion = {"$or": [
+                {"fecha_creacion": {"$lt": fecha_ultima}},
+                {"fecha_creacion": fecha_ultima, "_id": {"$lt": ultimo_id}}
+            ]}
+            filtro = {"$and": [filtro, posicion]} if filtro else posicion
+        
+        # Se pide una orden extra solo para saber si hay página siguiente
+        ordenes = await self.repository.listar(filtro, PROYECCION_ORDEN_RESUMEN, limite + 1)
+        siguiente_cursor = None
+        if len(ordenes) > limite:
+            ordenes = ordenes[:limite]
+            ultima = ordenes[-1]
+            siguiente_cursor = codificar_cursor(ultima.get("fecha_creacion"), ultima["_id"])
+        return [serializar_orden_resumen(o) for o in ordenes], siguiente_cursor
+    
+    async def _ordenes_exportables(self, filtro: dict, formato: str):
+        async for orden in self.repository.recorrer(filtro, PROYECCION_ORDEN, formatos.FILAS_POR_BLOQUE):
+            orden = serializar_orden(orden)
+            if formato == "csv":
+                # Una fila por orden: los productos se resumen en una sola celda
+                orden["productos"] = "; ".join(
+                    f"{p.get('nombre', '')} x{p.get('cantidad', 1)}" for p in orden["productos"]
+                )
+            yield orden
+    
+    def exportar(self, formato: str, usuario_email: str = None, estado: str = None, fecha: str = None):
+        """
+        Generador asíncrono con el historial completo (filtrado) en NDJSON o
+        CSV, leído con un cursor del servidor: la memoria no crece con la
+        cantidad de órdenes. Lanza ValueError si un filtro no es válido.
+        """
+        filtro = filtro_historial(usuario_email, estado, fecha)
+        return formatos.codificar(self._ordenes_exportables(filtro, formato), formato, COLUMNAS_EXPORTACION)
+    
+    async def _rechazo(self, orden_id: str, mensaje_estado, mensaje_condicion: str) -> None:
+        """
+        Explica por qué no se aplicó una transición: retorna None si la orden
+        no existe y lanza ValueError si está en otro estado o si sigue
+        pendiente (falló una condición adicional del filtro).
+        """
+        estado = await self.repository.obtener_estado(orden_id)
+        if estado is None:
+            return None
+        if estado != "pendiente":
+            raise ValueError(mensaje_estado(estado))
+        raise ValueError(mensaje_condicion)
+
+    async def pagar(self, orden_id: str, medio_pago_id: str = None, metodo_pago: str = "tarjeta_guardada",
+                    usuario: dict = None):
+        """
+        Marca una orden pendiente como pagada y suma la venta a la analítica
+        en una transacción si el servidor la admite, y vacía el carrito del
+        usuario (en memoria y en el diario; la escritura diferida lo lleva a
+        la base). La propiedad del medio de pago se exige en el mismo update:
+        por el usuario de la sesión (`usuario`) o por el medio verificado al
+        crear la orden; solo con otro medio se busca a su dueño.
+        Retorna la orden actualizada, None si no existe, o lanza ValueError si
+        ya no está pendiente o el medio de pago no es del dueño de la orden.
+        """
+        if not ObjectId.is_valid(orden_id):
+            return None
+
+        filtro_extra = {}
+        medio_oid = None
+        if medio_pago_id:
+            try:
+                medio_oid = ObjectId(medio_pago_id)
+            except (InvalidId, TypeError):
+                raise ValueError("Medio de pago no válido")
+            if medio_pago_del_usuario(usuario, medio_oid):
+                filtro_extra["usuario_email"] = usuario.get("correo")
+            else:
+                filtro_extra["medio_pago_verificado"] = medio_oid
+
+        cambios = {
+            "estado": "pagado",
+            "fecha_pago": datetime.now().isoformat(),
+            "metodo_pago_usado": metodo_pago,
+            "medio_pago_id": medio_oid
+        }
+
+        async def pagar_y_registrar(session):
+            orden = await self.repository.cambiar_estado(orden_id, "pendiente", cambios, filtro_extra, session)
+            if orden is not None:
+                await self.analitica.registrar_pago(orden, session)
+            return orden
+
+        orden = await ejecutar_en_transaccion(pagar_y_registrar)
+        if orden is None and "medio_pago_verificado" in filtro_extra:
+            # Un medio distinto del elegido al crear: se exige que sea del dueño de la orden
+            correo = await self.usuarios.obtener_correo_por_medio_pago(medio_oid)
+            if not correo:
+                raise ValueError("Medio de pago no válido")
+            filtro_extra = {"usuario_email": correo}
+            orden = await ejecutar_en_transaccion(pagar_y_registrar)
+        if orden is None:
+            return await self._rechazo(
+                orden_id, lambda estado: f"La orden ya está {estado}", "Medio de pago no válido"
+            )
+        if orden.get("usuario_email"):
+            # El vaciado queda en el diario y en la cola de escrituras diferidas,
+            # detrás de cualquier escritura anterior del carrito
+            await self.carrito.vaciar_carrito(orden["usuario_email"])
+        return orden
+
+    async def cancelar(self, orden_id: str):
+        """
+        Cancela una orden pendiente, devuelve los usos de sus cupones y la
+        registra en la analítica (en una transacción si el servidor la admite).
+        Retorna la orden actualizada, None si no existe, o lanza ValueError si
+        ya no está pendiente.
+        """
+        if not ObjectId.is_valid(orden_id):
+            return None
+        cambios = {"estado": "cancelado", "fecha_cancelacion": datetime.now().isoformat()}
+
+        async def cancelar_y_registrar(session):
+            orden = await self.repository.cambiar_estado(orden_id, "pendiente", cambios, session=session)
+            if orden is not None:
+                await self.analitica.registrar_cancelacion(orden, session)
+                # Los usos de cupón reservados al crear la orden vuelven a estar disponibles
+                await self.cupones.liberar(orden.get("cupones", []), orden.get("usuario_email"), session)
+            return orden
+
+        orden = await ejecutar_en_transaccion(cancelar_y_registrar)
+        if orden is None:
+            return await self._rechazo(
+                orden_id,
+                lambda estado: f"No se puede cancelar una orden que está {estado}. Solo se pueden cancelar órdenes pendientes.",
+                "No se pudo cancelar la orden, intenta nuevamente"
+            )
+        return orden
@@ -0,0 +1,298 @@
+"""
+Perfilado de Peticiones
+Capa de lógica de negocio: perfilador por muestreo de pila, opcional, para
+peticiones puntuales. Se activa con el header X-Perfilar o cuando una
+petición supera un umbral de duración, y guarda el perfil por ruta en
+formato de pilas colapsadas (flamegraph.pl, speedscope, inferno)
+"""
+import os
+import sys
+import time
+import asyncio
+import secrets
+import threading
+from collections import Counter, deque
+from datetime import datetime
+
+PERFILADO_HABILITADO = os.getenv("PERFILADO_HABILITADO", "0") == "1"
+UMBRAL_LENTO_MS = float(os.getenv("PERFILADO_UMBRAL_MS", "1000"))  # 0: solo a pedido (header)
+INTERVALO_MUESTREO_MS = float(os.getenv("PERFILADO_INTERVALO_MS", "5"))
+MAX_CAPTURAS_POR_MINUTO = int(os.getenv("PERFILADO_MAX_POR_MINUTO", "6"))
+CLAVE_ENCABEZADO = os.getenv("PERFILADO_CLAVE", "")  # Si se define, X-Perfilar debe traerla
+PERFILES_POR_RUTA = 5  # Se conservan los más recientes de cada ruta
+ENCABEZADO_PERFILAR = b"x-perfilar"
+ENCABEZADO_ID = b"x-perfil-id"
+RAIZ_PROYECTO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def _archivo(ruta: str) -> str:
+    """Ruta relativa al proyecto, o paquete/archivo para bibliotecas"""
+    if ruta.startswith(RAIZ_PROYECTO):
+        return os.path.relpath(ruta, RAIZ_PROYECTO)
+    return "/".join(ruta.replace("\\", "/").split("/")[-2:])
+
+def _etiqueta(marco) -> str:
+    codigo = marco.f_code
+    nombre = getattr(codigo, "co_qualname", codigo.co_name)
+    return f"{_archivo(codigo.co_filename)}:{nombre}".replace(";", ",").replace(" ", "_")
+
+def _siguiente_espera(corrutina):
+    """El objeto que espera una corrutina o generador (None si espera un Future o nada)"""
+    for atributo in ("cr_await", "gi_yieldfrom", "ag_await"):
+        siguiente = getattr(corrutina, atributo, None)
+        if siguiente is not None:
+            return siguiente
+    return None
+
+def _marco_de(corrutina):
+    for atributo in ("cr_frame", "gi_frame", "ag_frame"):
+        marco = getattr(corrutina, atributo, None)
+        if marco is not None:
+            return marco
+    return None
+
+class _Peticion:
+    """Una petición en curso que puede llegar a perfilarse"""
+    __slots__ = ("id", "tarea", "marco", "inicio", "pedida", "descartada", "capturando", "desde", "muestras")
+
+    def __init__(self, tarea, marco, pedida: bool):
+        self.id = None
+        self.tarea = tarea
+        self.marco = marco  # Marco del middleware: las pilas se cortan ahí
+        self.inicio = time.monotonic()
+        self.pedida = pedida
+        self.descartada = False
+        self.capturando = False
+        self.desde = 0.0
+        self.muestras = Counter()
+
+class Perfilador:
+    """
+    Un hilo muestrea la pila del event loop cada INTERVALO_MUESTREO_MS
+    mientras haya una captura activa (una a la vez). Si la tarea de la
+    petición es la que está corriendo, la muestra es su pila de Python
+    ("cpu"); si no, es la cadena de awaits donde está detenida ("espera"),
+    que distingue p. ej. una consulta de Motor de una geocodificación.
+    Las capturas se limitan a MAX_CAPTURAS_POR_MINUTO. Si el perfilado no
+    está habilitado no se agrega el middleware ni se inicia el hilo.
+    """
+
+    def __init__(self, umbral_ms: float = UMBRAL_LENTO_MS, intervalo_ms: float = INTERVALO_MUESTREO_MS,
+                 max_por_minuto: int = MAX_CAPTURAS_POR_MINUTO, clave: str = CLAVE_ENCABEZADO):
+        self.umbral = umbral_ms / 1000
+        self.intervalo = intervalo_ms / 1000
+        self.max_por_minuto = max_por_minuto
+        self.clave = clave.encode("latin-1")
+        self._lock = threading.Lock()
+        self._en_curso = {}  # id de la tarea -> _Peticion
+        self._activa = None
+        self._capturas_recientes = deque()  # Instantes de inicio de las capturas del último minuto
+        self._loop = None
+        self._hilo_loop = None
+        self._hilo = None
+        self._detener = threading.Event()
+        self.perfiles = {}  # "MÉTODO /ruta" -> deque de perfiles, del más antiguo al más nuevo
+        self._por_id = {}
+        self.contadores = {"capturados": 0, "descartados_limite": 0, "descartados_ocupado": 0}
+
+    # --- Ciclo de vida ---
+
+    def _iniciar_hilo(self):
+        self._loop = asyncio.get_running_loop()
+        self._hilo_loop = threading.get_ident()
+        self._hilo = threading.Thread(target=self._muestrear_continuamente, name="perfilador", daemon=True)
+        self._hilo.start()
+
+    def detener(self):
+        """Detiene el hilo de muestreo (si se inició)"""
+        self._detener.set()
+        if self._hilo is not None:
+            self._hilo.join(timeout=1.0)
+            self._hilo = None
+
+    # --- Peticiones (se llaman desde el event loop) ---
+
+    def pedida(self, scope) -> bool:
+        """Indica si la petición trae el header X-Perfilar (con la clave, si hay una configurada)"""
+        for nombre, valor in scope.get("headers", ()):
+            if nombre == ENCABEZADO_PERFILAR:
+                return valor == self.clave if self.clave else valor not in (b"", b"0")
+        return False
+
+    def registrar(self, marco, pedida: bool) -> _Peticion:
+        """Anota una petición en curso; si fue pedida, intenta empezar a capturarla de inmediato"""
+        if self._hilo is None:
+            self._iniciar_hilo()
+        peticion = _Peticion(asyncio.current_task(), marco, pedida)
+        with self._lock:
+            self._en_curso[id(peticion.tarea)] = peticion
+            if pedida:
+                self._intentar_captura(peticion, peticion.inicio)
+        return peticion
+
+    def terminar(self, peticion: _Peticion, metodo: str, ruta: str):
+        """Saca la petición de las en curso y, si se capturó, guarda su perfil"""
+        with self._lock:
+            self._en_curso.pop(id(peticion.tarea), None)
+            if self._activa is peticion:
+                self._activa = None
+            if not peticion.capturando:
+                return None
+            muestras = dict(peticion.muestras)
+        perfil = {
+            "id": peticion.id,
+            "ruta": f"{metodo} {ruta}",
+            "motivo": "encabezado" if peticion.pedida else "lenta",
+            "fecha": datetime.now().isoformat(timespec="seconds"),
+            "duracion_ms": round((time.monotonic() - peticion.inicio) * 1000, 1),
+            "capturado_desde_ms": round((peticion.desde - peticion.inicio) * 1000, 1),
+            "intervalo_ms": round(self.intervalo * 1000, 2),
+            "muestras": sum(muestras.values()),
+        }
+        self._guardar(perfil, muestras)
+        return perfil
+
+    def _intentar_captura(self, peticion: _Peticion, ahora: float) -> bool:
+        """Inicia la captura si no hay otra activa y queda cupo en el último minuto (con el lock tomado)"""
+        if self._activa is not None:
+            if peticion.pedida:
+                self.contadores["descartados_ocupado"] += 1
+            peticion.descartada = True
+            return False
+        while self._capturas_recientes and ahora - self._capturas_recientes[0] > 60:
+            self._capturas_recientes.popleft()
+        if len(self._capturas_recientes) >= self.max_por_minuto:
+            self.contadores["descartados_limite"] += 1
+            peticion.descartada = True
+            return False
+        self._capturas_recientes.append(ahora)
+        peticion.capturando = True
+        peticion.desde = ahora
+        peticion.id = secrets.token_hex(6)
+        self._activa = peticion
+        self.contadores["capturados"] += 1
+        return True
+
+    # --- Muestreo (hilo propio) ---
+
+    def _muestrear_continuamente(self):
+        while not self._detener.wait(self.intervalo):
+            with self._lock:
+                activa = self._activa
+                if activa is None and self.umbral:
+                    activa = self._buscar_lenta()
+            if activa is not None:
+                pila = self._muestra(activa)
+                if pila:
+                    with self._lock:
+                        activa.muestras[pila] += 1
+
+    def _buscar_lenta(self):
+        """Primera petición en curso que superó el umbral y aún no se consideró (con el lock tomado)"""
+        ahora = time.monotonic()
+        for peticion in self._en_curso.values():
+            if not peticion.descartada and ahora - peticion.inicio >= self.umbral:
+                # Sin cupo en el último minuto queda descartada y no se busca otra
+                return peticion if self._intentar_captura(peticion, ahora) else None
+        return None
+
+    def _muestra(self, peticion: _Peticion) -> str:
+        """Pila colapsada ("cpu;a;b;c" o "espera;a;b;c") de la petición en este instante"""
+        try:
+            corriendo = asyncio.current_task(self._loop) is peticion.tarea
+        except RuntimeError:
+            corriendo = False
+        if corriendo:
+            marco = sys._current_frames().get(self._hilo_loop)
+            pila = []
+            while marco is not None:
+                pila.append(_etiqueta(marco))
+                if marco is peticion.marco:
+                    break
+                marco = marco.f_back
+            if marco is None:
+                return ""  # La tarea ya soltó el loop entre las dos lecturas
+            pila.append("cpu")
+            return ";".join(reversed(pila))
+
+        pila = ["espera"]
+        dentro = False
+        corrutina = peticion.tarea.get_coro()
+        while corrutina is not None:
+            marco = _marco_de(corrutina)
+            if marco is None:
+                break
+            dentro = dentro or marco is peticion.marco
+            if dentro:
+                pila.append(_etiqueta(marco))
+            corrutina = _siguiente_espera(corrutina)
+        return ";".join(pila) if dentro else ""
+
+    # --- Perfiles guardados ---
+
+    def _guardar(self, perfil: dict, muestras: dict):
+        with self._lock:
+            guardados = self.perfiles.setdefault(perfil["ruta"], deque())
+            guardados.append(perfil)
+            self._por_id[perfil["id"]] = (perfil, muestras)
+            if len(guardados) > PERFILES_POR_RUTA:
+                self._por_id.pop(guardados.popleft()["id"], None)
+
+    def listar(self, ruta: str = None) -> list:
+        """Metadatos de los perfiles guardados (de una ruta o de todas), del más nuevo al más antiguo"""
+        with self._lock:
+            perfiles = [p for r, guardados in self.perfiles.items() if ruta in (None, r) for p in guardados]
+        return sorted(perfiles, key=lambda p: p["fecha"], reverse=True)
+
+    def exportar(self, perfil_id: str):
+        """Pilas colapsadas del perfil ("pila cantidad" por línea), o None si no existe"""
+        with self._lock:
+            guardado = self._por_id.get(perfil_id)
+        if guardado is None:
+            return None
+        _, muestras = guardado
+        return "".join(f"{pila} {cantidad}\n" for pila, cantidad in sorted(muestras.items()))
+
+    def estadisticas(self) -> dict:
+        with self._lock:
+            return {
+                **self.contadores,
+                "umbral_ms": self.umbral * 1000,
+                "intervalo_ms": self.intervalo * 1000,
+                "max_por_minuto": self.max_por_minuto,
+                "capturas_ultimo_minuto": sum(1 for t in self._capturas_recientes if time.monotonic() - t <= 60),
+                "en_curso": len(self._en_curso),
+            }
+
+class MiddlewarePerfilado:
+    """
+    Middleware ASGI que registra cada petición en el perfilador mientras
+    dura. A las perfiladas por header les agrega X-Perfil-Id con el id para
+    descargar el perfil. Sin umbral, solo se registran las pedidas.
+    """
+
+    def __init__(self, app, perfilador: Perfilador):
+        self.app = app
+        self.perfilador = perfilador
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        pedida = self.perfilador.pedida(scope)
+        if not pedida and not self.perfilador.umbral:
+            return await self.app(scope, receive, send)
+
+        peticion = self.perfilador.registrar(sys._getframe(), pedida)
+        if peticion.capturando:
+            async def enviar(mensaje):
+                if mensaje["type"] == "http.response.start":
+                    mensaje["headers"] = list(mensaje.get("headers", [])) + [
+                        (ENCABEZADO_ID, peticion.id.encode("ascii"))
+                    ]
+                await send(mensaje)
+        else:
+            enviar = send
+        try:
+            await self.app(scope, receive, enviar)
+        finally:
+            ruta = getattr(scope.get("route"), "path", None) or "sin_ruta"
+            self.perfilador.terminar(peticion, scope["method"], ruta)
@@ -2,45 +2,381 @@
 Servicio de Productos
 Capa de lógica de negocio: operaciones de negocio sobre productos
 """
+import json
+import math
+import base64
+import asyncio
+import secrets
 from repositories.productos_repository import ProductosRepository
-from models.serializers import serializar_producto
+from models.serializers import serializar_producto, PROYECCION_PRODUCTO
+from models.codificacion import codificar_json
+from services import formatos
 from bson import ObjectId
+from bson.errors import InvalidId
+from pymongo import InsertOne, UpdateOne
+from pymongo.errors import OperationFailure
+
+# Código de error de MongoDB cuando el servidor no es replica set (sin change streams)
+CODIGO_SIN_CHANGE_STREAMS = 40573
+ESPERA_REINTENTO_CAMBIOS = 5.0  # Segundos antes de reabrir un change stream caído
+
+# Órdenes disponibles para GET /productos: nombre -> (campo, dirección)
+ORDENES_PRODUCTOS = {
+    "id": ("_id", 1),
+    "recientes": ("_id", -1),
+    "precio_asc": ("precio", 1),
+    "precio_desc": ("precio", -1),
+    "nombre_asc": ("nombre", 1),
+    "nombre_desc": ("nombre", -1),
+}
+LIMITE_MAXIMO_PRODUCTOS = 200
+
+# Importación / exportación masiva
+CAMPOS_PRODUCTO = ("nombre", "precio", "categoria", "imagen", "estado")
+TAMANO_LOTE_IMPORTACION = 1000  # Operaciones por bulk_write
+MAX_ERRORES_REPORTADOS = 100  # Errores detallados en el resumen (el total se cuenta igual)
+
+def operacion_importacion(registro: dict):
+    """
+    Valida un registro importado y lo convierte en una operación de escritura:
+    con `_id` actualiza (o crea) ese producto, sin `_id` inserta uno nuevo.
+    Lanza ValueError con el motivo si el registro no es válido.
+    """
+    desconocidos = set(registro) - set(CAMPOS_PRODUCTO) - {"_id"}
+    if desconocidos:
+        raise ValueError(f"Campos desconocidos: {', '.join(sorted(desconocidos))}")
+    
+    producto = {}
+    for campo in ("nombre", "categoria"):
+        valor = registro.get(campo)
+        if not isinstance(valor, str) or not valor.strip():
+            raise ValueError(f"{campo} es obligatorio")
+        producto[campo] = valor.strip()
+    
+    precio = registro.get("precio")
+    if isinstance(precio, str):
+        # Desde CSV todo llega como texto
+        try:
+            precio = float(precio.strip())
+        except ValueError:
+            raise ValueError("precio debe ser un número")
+    if isinstance(precio, bool) or not isinstance(precio, (int, float)):
+        raise ValueError("precio es obligatorio y debe ser un número")
+    if isinstance(precio, float) and not math.isfinite(precio):
+        # int() de inf lanzaría OverflowError (y de nan, ValueError con otro mensaje)
+        raise ValueError("precio debe ser un número finito")
+    if precio < 0 or precio != int(precio):
+        raise ValueError("precio debe ser un entero mayor o igual a 0")
+    producto["precio"] = int(precio)
+    
+    for campo in ("imagen", "estado"):
+        valor = registro.get(campo)
+        if valor is None:
+            continue
+        if not isinstance(valor, str):
+            raise ValueError(f"{campo} debe ser texto")
+        producto[campo] = valor
+    
+    id_producto = registro.get("_id")
+    if id_producto is None or id_producto == "":
+        return InsertOne(producto)
+    try:
+        oid = ObjectId(id_producto)
+    except (InvalidId, TypeError):
+        raise ValueError("_id inválido")
+    return UpdateOne({"_id": oid}, {"$set": producto}, upsert=True)
+
+def codificar_cursor(valor, id_documento) -> str:
+    """Codifica la posición (valor de orden, _id) del último elemento de una página"""
+    crudo = json.dumps([valor, str(id_documento)], separators=(",", ":"))
+    return base64.urlsafe_b64encode(crudo.encode()).decode().rstrip("=")
+
+def decodificar_cursor(cursor: str) -> tuple:
+    """Decodifica un cursor; lanza ValueError si no es válido"""
+    try:
+        relleno = "=" * (-len(cursor) % 4)
+        valor, id_documento = json.loads(base64.urlsafe_b64decode(cursor + relleno))
+        return valor, ObjectId(id_documento)
+    except (ValueError, TypeError, InvalidId):
+        raise ValueError("Cursor inválido")
+
+def posicion_cursor(campo: str, direccion: int, valor, ultimo_id: ObjectId) -> dict:
+    """
+    Filtro de las filas que van después de (valor, ultimo_id) en el orden
+    (campo, _id). MongoDB ordena los nulos y faltantes antes que cualquier
+    valor, así que un cursor en un nulo sigue con los demás nulos y, en
+    orden ascendente, con todos los no nulos; y en orden descendente los
+    nulos siguen a cualquier valor.
+    """
+    operador = "$gt" if direccion == 1 else "$lt"
+    if campo == "_id":
+        return {"_id": {operador: ultimo_id}}
+    if valor is None:
+        mismos_nulos = {campo: None, "_id": {operador: ultimo_id}}
+        if direccion == 1:
+            return {"$or": [{campo: {"$ne": None}}, mismos_nulos]}
+        return mismos_nulos
+    siguientes = [
+        {campo: {operador: valor}},
+        {campo: valor, "_id": {operador: ultimo_id}}
+    ]
+    if direccion == -1:
+        siguientes.append({campo: None})
+    return {"$or": siguientes}
 
 class ProductosService:
     """Servicio para lógica de negocio de productos"""
     
     def __init__(self):
         self.repository = ProductosRepository()
+        # Catálogo materializado en memoria: lista serializada, índice por id
+        # y cuerpo JSON ya codificado. None = no cargado o invalidado.
+        self._catalogo = None
+        self._catalogo_por_id = None
+        self._catalogo_json = None
+        # Se incrementa en cada invalidación para descartar cargas obsoletas
+        self._generacion = 0
+        self._carga_en_curso = None
+        self._tarea_cambios = None
+        # Distingue las generaciones de este proceso de las de otros workers
+        self._epoca = secrets.token_hex(4)
+    
+    def etag(self) -> str:
+        """
+        ETag del catálogo: cambia con cada invalidación. Debe obtenerse antes
+        de leer los productos para no describir datos más nuevos.
+        """
+        return f'"productos-{self._epoca}-{self._generacion}"'
+    
+    async def _cargar_catalogo(self):
+        """Lee el catálogo completo y lo materializa (si no se invalidó mientras tanto)"""
+        generacion = self._generacion
+        productos = [serializar_producto(p) for p in await self.repository.obtener_todos(PROYECCION_PRODUCTO)]
+        # Se codifica una sola vez: las respuestas envían estos bytes directamente
+        cuerpo = codificar_json(productos)
+        if generacion == self._generacion:
+            self._catalogo = productos
+            self._catalogo_por_id = {p["_id"]: p for p in productos}
+            self._catalogo_json = cuerpo
+        return productos, cuerpo
+    
+    async def _obtener_catalogo(self):
+        """Retorna (productos, cuerpo JSON); carga una sola vez aunque haya lecturas concurrentes"""
+        if self._catalogo is not None:
+            return self._catalogo, self._catalogo_json
+        if self._carga_en_curso is None:
+            self._carga_en_curso = asyncio.ensure_future(self._cargar_catalogo())
+            self._carga_en_curso.add_done_callback(self._terminar_carga)
+        return await asyncio.shield(self._carga_en_curso)
+    
+    def _terminar_carga(self, tarea):
+        if self._carga_en_curso is tarea:
+            self._carga_en_curso = None
+    
+    def invalidar_catalogo(self):
+        """Descarta el catálogo en memoria; la próxima lectura lo recarga"""
+        self._generacion += 1
+        self._catalogo = None
+        self._catalogo_por_id = None
+        self._catalogo_json = None
+        self._carga_en_curso = None
     
     async def obtener_todos(self):
-        """Obtiene todos los productos serializados"""
-        productos = await self.repository.obtener_todos()
-        return [serializar_producto(p) for p in productos]
+        """Obtiene todos los productos serializados (desde el catálogo en memoria)"""
+        productos, _ = await self._obtener_catalogo()
+        return productos
+    
+    async def obtener_todos_json(self) -> bytes:
+        """Obtiene el catálogo completo ya codificado como JSON"""
+        _, cuerpo = await self._obtener_catalogo()
+        return cuerpo
+    
+    async def _vigilar_cambios(self):
+        """Invalida el catálogo ante cualquier cambio hecho por otro proceso"""
+        token = None
+        while True:
+            try:
+                async with self.repository.vigilar_cambios(resume_after=token) as stream:
+                    # Lo ocurrido antes de abrir el stream no se vio: partir limpio
+                    if token is None:
+                        self.invalidar_catalogo()
+                    async for cambio in stream:
+                        token = stream.resume_token
+                        self.invalidar_catalogo()
+            except asyncio.CancelledError:
+                raise
+            except OperationFailure as e:
+                if e.code == CODIGO_SIN_CHANGE_STREAMS:
+                    print("MongoDB sin replica set: el catálogo solo se invalida con escrituras locales")
+                    return
+                print(f"Error en change stream de productos: {e}")
+                token = None
+            except Exception as e:
+                print(f"Error en change stream de productos: {e}")
+            # Los cambios durante la desconexión pudieron perderse
+            self.invalidar_catalogo()
+            await asyncio.sleep(ESPERA_REINTENTO_CAMBIOS)
+    
+    def iniciar_vigilancia_cambios(self):
+        """Inicia la invalidación por change stream (para varios workers)"""
+        if self._tarea_cambios is None:
+            self._tarea_cambios = asyncio.create_task(self._vigilar_cambios())
+    
+    async def detener_vigilancia_cambios(self):
+        if self._tarea_cambios is not None:
+            self._tarea_cambios.cancel()
+            try:
+                await self._tarea_cambios
+            except asyncio.CancelledError:
+                pass
+            self._tarea_cambios = None
+    
+    async def buscar(self, categoria: str = None, precio_min: int = None, precio_max: int = None,
+                     estado: str = None, orden: str = None, limite: int = None, cursor: str = None):
+        """
+        Busca productos filtrando, ordenando y paginando en la base de datos.
+        La paginación es por cursor (keyset) sobre (campo de orden, _id).
+        Retorna (productos serializados, cursor de la página siguiente o None).
+        """
+        campo, direccion = ORDENES_PRODUCTOS.get(orden or "id", (None, None))
+        if campo is None:
+            raise ValueError(f"Orden inválido. Opciones: {', '.join(ORDENES_PRODUCTOS)}")
+        if limite is not None and not 1 <= limite <= LIMITE_MAXIMO_PRODUCTOS:
+            raise ValueError(f"limite debe estar entre 1 y {LIMITE_MAXIMO_PRODUCTOS}")
+        
+        filtro = {}
+        if categoria:
+            filtro["categoria"] = categoria
+        if estado:
+            filtro["estado"] = estado
+        if precio_min is not None or precio_max is not None:
+            filtro["precio"] = {}
+            if precio_min is not None:
+                filtro["precio"]["$gte"] = precio_min
+            if precio_max is not None:
+                filtro["precio"]["$lte"] = precio_max
+        
+        if cursor:
+            valor, ultimo_id = decodificar_cursor(cursor)
+            posicion = posicion_cursor(campo, direccion, valor, ultimo_id)
+            filtro = {"$and": [filtro, posicion]} if filtro else posicion
+        
+        orden_mongo = [(campo, direccion)]
+        if campo != "_id":
+            orden_mongo.append(("_id", direccion))
+        
+        # Se pide un elemento extra solo para saber si hay página siguiente
+        productos = await self.repository.buscar(
+            filtro, orden_mongo, limite + 1 if limite else None, PROYECCION_PRODUCTO
+        )
+        siguiente_cursor = None
+        if limite and len(productos) > limite:
+            productos = productos[:limite]
+            ultimo = productos[-1]
+            valor = ultimo["_id"] if campo == "_id" else ultimo.get(campo)
+            siguiente_cursor = codificar_cursor(str(valor) if campo == "_id" else valor, ultimo["_id"])
+        return [serializar_producto(p) for p in productos], siguiente_cursor
     
     async def obtener_por_id(self, id_producto: str):
         """Obtiene un producto por ID"""
-        producto = await self.repository.obtener_por_id(id_producto)
-        if producto:
-            return serializar_producto(producto)
-        return None
+        await self._obtener_catalogo()
+        if self._catalogo_por_id is not None:
+            return self._catalogo_por_id.get(id_producto)
+        # La carga se cruzó con una invalidación y no quedó materializada: se lee de la base
+        try:
+            producto = await self.repository.obtener_por_id(id_producto)
+        except (InvalidId, TypeError):
+            return None
+        return serializar_producto(producto) if producto else None
     
     async def crear(self, producto: dict):
         """Crea un nuevo producto"""
-        return await self.repository.crear(producto)
+        result_id = await self.repository.crear(producto)
+        self.invalidar_catalogo()
+        return result_id
     
     async def actualizar(self, id_producto: str, producto: dict):
-        """Actualiza un producto"""
-        existe = await self.repository.obtener_por_id(id_producto)
-        if not existe:
-            return False
-        return await self.repository.actualizar(id_producto, producto)
+        """Actualiza un producto (False si no existe)"""
+        actualizado = await self.repository.actualizar(id_producto, producto)
+        if actualizado:
+            self.invalidar_catalogo()
+        return actualizado
     
     async def eliminar(self, id_producto: str):
-        """Elimina un producto"""
-        existe = await self.repository.obtener_por_id(id_producto)
-        if not existe:
-            return False
-        return await self.repository.eliminar(id_producto)
+        """Elimina un producto (False si no existe)"""
+        eliminado = await self.repository.eliminar(id_producto)
+        if eliminado:
+            self.invalidar_catalogo()
+        return eliminado
+    
+    async def importar(self, registros) -> dict:
+        """
+        Importa productos desde un flujo asíncrono de (línea, registro, error)
+        (ver services/formatos.py). Valida cada registro al llegar y escribe
+        en lotes de TAMANO_LOTE_IMPORTACION con bulk_write no ordenado; el
+        lote siguiente se valida mientras el anterior se escribe.
+        Retorna un resumen con los totales y los errores por línea.
+        """
+        resumen = {"procesados": 0, "insertados": 0, "actualizados": 0, "con_error": 0, "errores": []}
+        
+        def anotar_error(linea: int, mensaje: str):
+            resumen["con_error"] += 1
+            if len(resumen["errores"]) < MAX_ERRORES_REPORTADOS:
+                resumen["errores"].append({"linea": linea, "error": mensaje})
+        
+        async def escribir(operaciones: list, lineas: list):
+            escrituras.append(len(operaciones))
+            resultado = await self.repository.aplicar_lote(operaciones)
+            resumen["insertados"] += resultado["insertados"]
+            resumen["actualizados"] += resultado["actualizados"]
+            for indice, mensaje in resultado["errores"]:
+                anotar_error(lineas[indice], mensaje)
+        
+        lote, lineas = [], []
+        escrituras = []
+        en_curso = None
+        try:
+            async for linea, registro, error in registros:
+                resumen["procesados"] += 1
+                if error is None:
+                    try:
+                        lote.append(operacion_importacion(registro))
+                        lineas.append(linea)
+                    except ValueError as e:
+                        error = str(e)
+                if error is not None:
+                    anotar_error(linea, error)
+                if len(lote) >= TAMANO_LOTE_IMPORTACION:
+                    # Como máximo un lote escribiéndose a la vez
+                    if en_curso is not None:
+                        await en_curso
+                    en_curso = asyncio.create_task(escribir(lote, lineas))
+                    lote, lineas = [], []
+            if en_curso is not None:
+                await en_curso
+                en_curso = None
+            if lote:
+                await escribir(lote, lineas)
+        finally:
+            # Si el cliente se desconecta a mitad de camino, el lote en vuelo termina igual
+            if en_curso is not None and not en_curso.done():
+                await asyncio.shield(en_curso)
+            if escrituras:
+                self.invalidar_catalogo()
+        resumen["errores"].sort(key=lambda e: e["linea"])
+        return resumen
+    
+    async def _productos_exportables(self):
+        async for p in self.repository.recorrer(PROYECCION_PRODUCTO, formatos.FILAS_POR_BLOQUE):
+            yield {"_id": str(p["_id"]), **{campo: p.get(campo) for campo in CAMPOS_PRODUCTO}}
+    
+    def exportar(self, formato: str):
+        """
+        Generador asíncrono con el catálogo completo en NDJSON o CSV, leído
+        con un cursor del servidor: la memoria no crece con el catálogo.
+        El resultado se puede volver a importar con importar().
+        """
+        return formatos.codificar(self._productos_exportables(), formato, ["_id", *CAMPOS_PRODUCTO])
 
 
 
@@ -0,0 +1,152 @@
+"""
+Utilidades de Resiliencia
+Capa de lógica de negocio: limitador de tasa (token bucket) y circuit breaker
+para llamadas a servicios externos
+"""
+import time
+import asyncio
+
+class ServicioNoDisponible(Exception):
+    """El servicio externo no se puede usar ahora (circuito abierto o sin cupo)"""
+
+class LimitadorTasa:
+    """
+    Token bucket: permite `tasa` solicitudes por segundo con ráfagas de
+    hasta `capacidad`. Si el próximo token tarda más que `max_espera`,
+    se rechaza en lugar de encolar la solicitud.
+    """
+
+    def __init__(self, tasa: float, capacidad: float = 1, max_espera: float = 1.0):
+        self.tasa = tasa
+        self.capacidad = capacidad
+        self.max_espera = max_espera
+        self._tokens = capacidad
+        self._ultimo = time.monotonic()
+        self.contadores = {"concedidos": 0, "esperas": 0, "rechazados": 0}
+
+    def _recargar(self, ahora: float):
+        self._tokens = min(self.capacidad, self._tokens + (ahora - self._ultimo) * self.tasa)
+        self._ultimo = ahora
+
+    async def adquirir(self):
+        """Espera un token o lanza ServicioNoDisponible si la espera sería muy larga"""
+        self._recargar(time.monotonic())
+        espera = (1 - self._tokens) / self.tasa if self._tokens < 1 else 0.0
+        if espera > self.max_espera:
+            self.contadores["rechazados"] += 1
+            raise ServicioNoDisponible("Límite de tasa excedido")
+        # Reservar el token ahora (puede quedar en negativo) y esperar su turno
+        self._tokens -= 1
+        self.contadores["concedidos"] += 1
+        if espera > 0:
+            self.contadores["esperas"] += 1
+            await asyncio.sleep(espera)
+
+    def estadisticas(self) -> dict:
+        self._recargar(time.monotonic())
+        return {
+            **self.contadores,
+            "tasa_por_segundo": self.tasa,
+            "tokens_disponibles": round(self._tokens, 3)
+        }
+
+class CircuitBreaker:
+    """
+    Circuit breaker con estados cerrado → abierto → semiabierto.
+    Tras `umbral_fallos` fallos consecutivos se abre y rechaza de inmediato
+    durante `enfriamiento` segundos; luego deja pasar una llamada de prueba.
+    """
+
+    CERRADO = "cerrado"
+    ABIERTO = "abierto"
+    SEMIABIERTO = "semiabierto"
+
+    def __init__(self, umbral_fallos: int = 5, enfriamiento: float = 30.0):
+        self.umbral_fallos = umbral_fallos
+        self.enfriamiento = enfriamiento
+        self.estado = self.CERRADO
+        self.fallos_consecutivos = 0
+        self._abierto_desde = None
+        self._prueba_en_curso = False
+        self.contadores = {"exitos": 0, "fallos": 0, "rechazos": 0, "aperturas": 0}
+        # Latencia de las llamadas agrupada por el estado en que se hicieron
+        self.latencias = {
+            estado: {"llamadas": 0, "total_ms": 0.0, "max_ms": 0.0}
+            for estado in (self.CERRADO, self.ABIERTO, self.SEMIABIERTO)
+        }
+
+    def _actualizar_estado(self):
+        if self.estado == self.ABIERTO and time.monotonic() - self._abierto_desde >= self.enfriamiento:
+            self.estado = self.SEMIABIERTO
+            self._prueba_en_curso = False
+
+    def _registrar_latencia(self, estado: str, inicio: float):
+        transcurrido_ms = (time.perf_counter() - inicio) * 1000
+        latencia = self.latencias[estado]
+        latencia["llamadas"] += 1
+        latencia["total_ms"] += transcurrido_ms
+        latencia["max_ms"] = max(latencia["max_ms"], transcurrido_ms)
+
+    def _abrir(self):
+        self.estado = self.ABIERTO
+        self._abierto_desde = time.monotonic()
+        self.contadores["aperturas"] += 1
+
+    async def llamar(self, funcion, *args, **kwargs):
+        """
+        Ejecuta `funcion` protegida por el circuito.
+        Lanza ServicioNoDisponible si el circuito no permite la llamada;
+        cualquier excepción de `funcion` cuenta como fallo y se propaga.
+        """
+        inicio = time.perf_counter()
+        self._actualizar_estado()
+        estado = self.estado
+
+        if estado == self.ABIERTO or (estado == self.SEMIABIERTO and self._prueba_en_curso):
+            self.contadores["rechazos"] += 1
+            self._registrar_latencia(self.ABIERTO, inicio)
+            raise ServicioNoDisponible("Circuito abierto")
+
+        if estado == self.SEMIABIERTO:
+            self._prueba_en_curso = True
+
+        try:
+            resultado = await funcion(*args, **kwargs)
+        except (ServicioNoDisponible, asyncio.CancelledError):
+            # Rechazo local (p. ej. limitador) o cancelación: no es un fallo del servicio externo
+            if estado == self.SEMIABIERTO:
+                self._prueba_en_curso = False
+            raise
+        except Exception:
+            self.contadores["fallos"] += 1
+            self.fallos_consecutivos += 1
+            self._registrar_latencia(estado, inicio)
+            if estado == self.SEMIABIERTO or self.fallos_consecutivos >= self.umbral_fallos:
+                self._abrir()
+            raise
+
+        self.contadores["exitos"] += 1
+        self.fallos_consecutivos = 0
+        self._registrar_latencia(estado, inicio)
+        if estado == self.SEMIABIERTO:
+            self.estado = self.CERRADO
+        return resultado
+
+    def estadisticas(self) -> dict:
+        self._actualizar_estado()
+        latencias = {
+            estado: {
+                "llamadas": datos["llamadas"],
+                "promedio_ms": round(datos["total_ms"] / datos["llamadas"], 2) if datos["llamadas"] else None,
+                "max_ms": round(datos["max_ms"], 2)
+            }
+            for estado, datos in self.latencias.items()
+        }
+        return {
+            "estado": self.estado,
+            "fallos_consecutivos": self.fallos_consecutivos,
+            "umbral_fallos": self.umbral_fallos,
+            "enfriamiento_segundos": self.enfriamiento,
+            **self.contadores,
+            "latencias": latencias
+        }
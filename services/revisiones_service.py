@@ -0,0 +1,39 @@
+"""
+Servicio de Revisiones
+Capa de lógica de negocio: contadores de revisión que cambian con cada
+escritura, usados para calcular ETags sin leer los documentos
+"""
+from repositories.revisiones_repository import RevisionesRepository
+
+class RevisionesService:
+    """
+    Por cada colección mantiene tres tipos de contador:
+    - global: cambia con escrituras que pueden afectar a cualquier usuario
+    - todos: cambia con cualquier escritura (vista sin filtro de usuario)
+    - por usuario: cambia con las escrituras de ese usuario
+    El ETag de un usuario combina global + usuario, y el de la vista completa
+    global + todos.
+    Las lecturas deben obtener el ETag antes de leer los datos, y las
+    escrituras incrementar después de escribir: así un ETag nunca describe
+    datos más nuevos que los que acompaña.
+    """
+    
+    def __init__(self):
+        self.repository = RevisionesRepository()
+    
+    def _claves_lectura(self, coleccion: str, usuario_email: str = None) -> list:
+        return [coleccion, f"{coleccion}:{usuario_email}" if usuario_email else f"{coleccion}:*"]
+    
+    async def etag(self, coleccion: str, usuario_email: str = None) -> str:
+        """ETag de una colección (o de los datos de un usuario en ella)"""
+        claves = self._claves_lectura(coleccion, usuario_email)
+        valores = await self.repository.obtener(claves)
+        return '"' + coleccion + "-" + ".".join(str(valores[c]) for c in claves) + '"'
+    
+    async def incrementar(self, coleccion: str, usuario_email: str = None):
+        """
+        Registra una escritura sobre los datos de un usuario, o sobre datos de
+        usuario desconocido / todos los usuarios si usuario_email es None.
+        """
+        claves = [f"{coleccion}:*", f"{coleccion}:{usuario_email}" if usuario_email else coleccion]
+        await self.repository.incrementar(claves)
@@ -0,0 +1,225 @@
+"""
+Servicio de Sesiones
+Capa de lógica de negocio: tokens de sesión firmados (HMAC-SHA256) que se
+verifican sin acceder a la base de datos, revocación por sesión o por
+usuario, y una caché breve de documentos de usuario por sujeto del token
+"""
+import os
+import json
+import time
+import hmac
+import base64
+import asyncio
+import hashlib
+import secrets
+from collections import OrderedDict
+
+from repositories.sesiones_repository import SesionesRepository
+from repositories.usuarios_repository import UsuariosRepository
+from repositories.revisiones_repository import RevisionesRepository
+
+DURACION_SESION_SEGUNDOS = int(os.getenv("SESION_DURACION_SEGUNDOS", str(8 * 3600)))
+TTL_CACHE_USUARIOS = 60.0  # Segundos que un documento de usuario se sirve desde memoria
+MAX_USUARIOS_EN_CACHE = 10000
+INTERVALO_RECARGA_SEGUNDOS = 10  # Cada cuánto se buscan revocaciones de otros procesos
+CLAVE_REVISION = "sesiones"  # Contador en `revisiones` que cambia con cada revocación
+CLAVE_REVISION_USUARIOS = "sesiones:usuarios"  # Cambia con cada escritura sobre un usuario
+
+def _b64(datos: bytes) -> str:
+    return base64.urlsafe_b64encode(datos).decode("ascii").rstrip("=")
+
+def _desde_b64(texto: str) -> bytes:
+    return base64.urlsafe_b64decode(texto + "=" * (-len(texto) % 4))
+
+def firmar_token(datos: dict, secreto: bytes) -> str:
+    """Token "<datos>.<firma>": datos JSON y firma HMAC-SHA256, ambos en base64url"""
+    cuerpo = _b64(json.dumps(datos, separators=(",", ":")).encode("utf-8"))
+    firma = hmac.new(secreto, cuerpo.encode("ascii"), hashlib.sha256).digest()
+    return f"{cuerpo}.{_b64(firma)}"
+
+def leer_token(token: str, secreto: bytes) -> dict:
+    """Verifica firma y expiración; lanza ValueError si el token no es válido"""
+    try:
+        cuerpo, firma = token.split(".")
+        esperada = hmac.new(secreto, cuerpo.encode("ascii"), hashlib.sha256).digest()
+        if not hmac.compare_digest(esperada, _desde_b64(firma)):
+            raise ValueError
+        datos = json.loads(_desde_b64(cuerpo))
+        expira = float(datos["exp"])
+    except (ValueError, KeyError, TypeError, UnicodeError):
+        raise ValueError("Token de sesión inválido")
+    if expira <= time.time():
+        raise ValueError("La sesión expiró")
+    return datos
+
+class SesionesService:
+    """
+    Servicio de sesiones.
+    Verificar un token solo requiere la firma y las revocaciones en memoria;
+    las revocaciones se guardan en `sesiones_revocadas` y los demás procesos
+    las recargan cuando cambia la revisión "sesiones". Los documentos de
+    usuario se cachean por correo durante TTL_CACHE_USUARIOS; cualquier
+    escritura sobre el usuario o revocación los descarta en este proceso, y
+    la escritura incrementa la revisión "sesiones:usuarios" para que los
+    demás vacíen su caché en la siguiente revisión periódica (a lo más
+    INTERVALO_RECARGA_SEGUNDOS después).
+    """
+
+    def __init__(self, secreto: str = None, duracion: int = DURACION_SESION_SEGUNDOS):
+        secreto = secreto or os.getenv("SESION_SECRETO")
+        if not secreto:
+            print("[SESIONES] Sin SESION_SECRETO: se usa uno aleatorio (las sesiones no sobreviven un reinicio)")
+            secreto = secrets.token_hex(32)
+        self._secreto = secreto.encode("utf-8")
+        self.duracion = duracion
+        self.repository = SesionesRepository()
+        self.usuarios = UsuariosRepository()
+        self.revisiones = RevisionesRepository()
+        self._sesiones_revocadas = {}  # sid -> expiración
+        self._revocado_desde = {}  # correo -> emisión mínima válida
+        self._version = None
+        self._version_usuarios = None
+        self._tarea_recarga = None
+        self._usuarios = OrderedDict()  # correo -> (vence, documento), en orden de uso
+
+    # --- Revocaciones ---
+
+    async def cargar(self):
+        """
+        Incorpora las revocaciones vigentes de la base de datos (las hechas
+        por este proceso ya están en memoria) y descarta de la caché a los
+        usuarios afectados.
+        """
+        versiones = await self.revisiones.obtener([CLAVE_REVISION, CLAVE_REVISION_USUARIOS])
+        for revocacion in await self.repository.obtener_vigentes():
+            correo = revocacion.get("correo")
+            if "sid" in revocacion:
+                if revocacion["sid"] not in self._sesiones_revocadas:
+                    self._sesiones_revocadas[revocacion["sid"]] = revocacion["expira"]
+                    self.invalidar_usuario(correo)
+            elif revocacion.get("desde", 0) > self._revocado_desde.get(correo, 0):
+                self._revocado_desde[correo] = revocacion["desde"]
+                self.invalidar_usuario(correo)
+        self._version = versiones[CLAVE_REVISION]
+        if self._version_usuarios is None:
+            self._version_usuarios = versiones[CLAVE_REVISION_USUARIOS]
+        self._descartar_expiradas()
+
+    def _descartar_expiradas(self):
+        ahora = time.time()
+        self._sesiones_revocadas = {sid: exp for sid, exp in self._sesiones_revocadas.items() if exp > ahora}
+        limite = ahora - self.duracion
+        self._revocado_desde = {c: d for c, d in self._revocado_desde.items() if d > limite}
+
+    async def verificar_cambios(self):
+        """
+        Recarga si otro proceso revocó sesiones y vacía la caché de usuarios
+        si alguno modificó un usuario (compara solo las revisiones)
+        """
+        versiones = await self.revisiones.obtener([CLAVE_REVISION, CLAVE_REVISION_USUARIOS])
+        if versiones[CLAVE_REVISION_USUARIOS] != self._version_usuarios:
+            # No se sabe cuál cambió: se descartan todos y se releen a medida que se piden
+            self._usuarios.clear()
+            self._version_usuarios = versiones[CLAVE_REVISION_USUARIOS]
+        if versiones[CLAVE_REVISION] != self._version:
+            await self.cargar()
+        else:
+            self._descartar_expiradas()
+
+    async def _recargar_periodicamente(self, intervalo: float):
+        while True:
+            await asyncio.sleep(intervalo)
+            try:
+                await self.verificar_cambios()
+            except Exception as e:
+                print(f"Error recargando revocaciones de sesión: {e}")
+
+    def iniciar_recarga_automatica(self, intervalo: float = INTERVALO_RECARGA_SEGUNDOS):
+        """Inicia la revisión periódica de revocaciones hechas por otros procesos"""
+        if self._tarea_recarga is None:
+            self._tarea_recarga = asyncio.create_task(self._recargar_periodicamente(intervalo))
+
+    async def detener_recarga_automatica(self):
+        if self._tarea_recarga is not None:
+            self._tarea_recarga.cancel()
+            try:
+                await self._tarea_recarga
+            except asyncio.CancelledError:
+                pass
+            self._tarea_recarga = None
+
+    # --- Tokens ---
+
+    def emitir(self, correo: str) -> str:
+        """Token de sesión nuevo para `correo`"""
+        ahora = time.time()
+        return firmar_token(
+            {"sub": correo, "sid": secrets.token_urlsafe(12), "iat": round(ahora, 3), "exp": int(ahora + self.duracion)},
+            self._secreto
+        )
+
+    def verificar(self, token: str) -> dict:
+        """
+        Datos de un token válido ({"sub", "sid", "iat", "exp"}), sin acceder a
+        la base de datos. Lanza ValueError si es inválido, expiró o fue revocado.
+        """
+        datos = leer_token(token, self._secreto)
+        if (datos.get("sid") in self._sesiones_revocadas
+                or datos.get("iat", 0) < self._revocado_desde.get(datos.get("sub"), 0)):
+            raise ValueError("La sesión fue cerrada")
+        return datos
+
+    async def revocar(self, datos: dict):
+        """Cierra una sesión (los datos de un token ya verificado)"""
+        self._sesiones_revocadas[datos["sid"]] = datos["exp"]
+        self.invalidar_usuario(datos["sub"])
+        await self.repository.revocar_sesion(datos["sid"], datos["sub"], datos["exp"])
+        await self.revisiones.incrementar([CLAVE_REVISION])
+
+    async def revocar_usuario(self, correo: str):
+        """Cierra todas las sesiones de un usuario emitidas hasta ahora"""
+        ahora = round(time.time(), 3)
+        self._revocado_desde[correo] = ahora
+        self.invalidar_usuario(correo)
+        await self.repository.revocar_usuario(correo, ahora, ahora + self.duracion)
+        await self.revisiones.incrementar([CLAVE_REVISION])
+
+    # --- Caché de usuarios ---
+
+    def guardar_usuario(self, usuario: dict):
+        """Deja un documento de usuario recién leído en la caché"""
+        correo = usuario.get("correo")
+        if not correo:
+            return
+        self._usuarios[correo] = (time.monotonic() + TTL_CACHE_USUARIOS, usuario)
+        self._usuarios.move_to_end(correo)
+        while len(self._usuarios) > MAX_USUARIOS_EN_CACHE:
+            self._usuarios.popitem(last=False)
+
+    def invalidar_usuario(self, correo: str):
+        """Descarta el documento cacheado de un usuario en este proceso"""
+        self._usuarios.pop(correo, None)
+
+    async def usuario_modificado(self, correo: str, usuario: dict = None):
+        """
+        Tras escribir sobre un usuario: deja en la caché el documento nuevo
+        (si se indica) o descarta el anterior, y avisa a los demás procesos
+        """
+        if usuario is not None:
+            self.guardar_usuario(usuario)
+        else:
+            self.invalidar_usuario(correo)
+        await self.revisiones.incrementar([CLAVE_REVISION_USUARIOS])
+
+    async def obtener_usuario(self, correo: str):
+        """Documento del usuario desde la caché, o desde la base si venció (None si no existe)"""
+        entrada = self._usuarios.get(correo)
+        if entrada is not None and entrada[0] > time.monotonic():
+            self._usuarios.move_to_end(correo)
+            return entrada[1]
+        usuario = await self.usuarios.obtener_por_correo(correo)
+        if usuario is None:
+            self._usuarios.pop(correo, None)
+        else:
+            self.guardar_usuario(usuario)
+        return usuario
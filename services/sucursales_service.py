@@ -0,0 +1,160 @@
+"""
+Servicio de Sucursales
+Capa de lógica de negocio: registro de sucursales e índice espacial en memoria
+para encontrar la sucursal más cercana a un cliente
+"""
+import asyncio
+
+from repositories.sucursales_repository import SucursalesRepository
+from repositories.revisiones_repository import RevisionesRepository
+from models.serializers import serializar_sucursal
+from services.indice_espacial import IndiceEspacial
+
+INTERVALO_RECARGA_SEGUNDOS = 30  # Cada cuánto se revisa si las sucursales cambiaron
+CLAVE_REVISION = "sucursales"  # Contador en `revisiones` que cambia con cada edición
+VALORES_ACTIVA = {"true": True, "1": True, "si": True, "sí": True, "false": False, "0": False, "no": False}
+
+def _activa(valor) -> bool:
+    """Convierte `activa` a booleano: "false" o "0" de un cliente JSON no cuentan como activa"""
+    if isinstance(valor, bool):
+        return valor
+    if isinstance(valor, int) and valor in (0, 1):
+        return bool(valor)
+    if isinstance(valor, str) and valor.strip().lower() in VALORES_ACTIVA:
+        return VALORES_ACTIVA[valor.strip().lower()]
+    raise ValueError("activa debe ser true o false")
+
+class SucursalesService:
+    """
+    Servicio para lógica de negocio de sucursales. Las ediciones de este
+    proceso actualizan el índice de inmediato; las de otros workers se
+    detectan con el contador de revisión y recargan el índice completo.
+    """
+    
+    def __init__(self, distancia):
+        self.repository = SucursalesRepository()
+        self.revisiones = RevisionesRepository()
+        self.indice = IndiceEspacial(distancia)
+        self._sucursales = {}  # id -> sucursal serializada (solo activas)
+        self._version = None
+        self._tarea_recarga = None
+    
+    def _indexar(self, sucursal: dict):
+        """Agrega o quita una sucursal del índice según esté activa"""
+        if sucursal.get("activa", True):
+            self._sucursales[sucursal["_id"]] = sucursal
+            self.indice.agregar(sucursal["_id"], sucursal["latitud"], sucursal["longitud"])
+        else:
+            self._desindexar(sucursal["_id"])
+    
+    def _desindexar(self, id_sucursal: str):
+        self._sucursales.pop(id_sucursal, None)
+        self.indice.eliminar(id_sucursal)
+    
+    async def cargar(self):
+        """Carga todas las sucursales activas en el índice (al iniciar la app)"""
+        version = (await self.revisiones.obtener([CLAVE_REVISION]))[CLAVE_REVISION]
+        sucursales = await self.repository.obtener_activas()
+        self.indice.limpiar()
+        self._sucursales.clear()
+        for s in sucursales:
+            self._indexar(serializar_sucursal(s))
+        self._version = version
+    
+    async def verificar_cambios(self):
+        """Recarga el índice si otro proceso editó las sucursales (compara solo la revisión)"""
+        version = (await self.revisiones.obtener([CLAVE_REVISION]))[CLAVE_REVISION]
+        if version != self._version:
+            await self.cargar()
+    
+    async def _recargar_periodicamente(self, intervalo: float):
+        while True:
+            await asyncio.sleep(intervalo)
+            try:
+                await self.verificar_cambios()
+            except Exception as e:
+                print(f"Error recargando sucursales: {e}")
+    
+    def iniciar_recarga_automatica(self, intervalo: float = INTERVALO_RECARGA_SEGUNDOS):
+        """Inicia la revisión periódica de cambios en las sucursales"""
+        if self._tarea_recarga is None:
+            self._tarea_recarga = asyncio.create_task(self._recargar_periodicamente(intervalo))
+    
+    async def detener_recarga_automatica(self):
+        if self._tarea_recarga is not None:
+            self._tarea_recarga.cancel()
+            try:
+                await self._tarea_recarga
+            except asyncio.CancelledError:
+                pass
+            self._tarea_recarga = None
+    
+    def listar(self):
+        """Retorna las sucursales activas indexadas"""
+        return list(self._sucursales.values())
+    
+    def mas_cercana(self, lat: float, lon: float):
+        """Retorna (sucursal, distancia_km) de la sucursal más cercana, o None"""
+        resultado = self.indice.mas_cercano(lat, lon)
+        if resultado is None:
+            return None
+        id_sucursal, distancia = resultado
+        return self._sucursales[id_sucursal], distancia
+    
+    def coordenadas(self):
+        """Retorna (ids, latitudes, longitudes) de las sucursales activas"""
+        sucursales = self.listar()
+        return (
+            [s["_id"] for s in sucursales],
+            [s["latitud"] for s in sucursales],
+            [s["longitud"] for s in sucursales]
+        )
+    
+    def _validar(self, datos: dict, parcial: bool = False):
+        requeridos = [] if parcial else ["nombre", "latitud", "longitud"]
+        for campo in requeridos:
+            if datos.get(campo) in (None, ""):
+                raise ValueError(f"Campo requerido: {campo}")
+        for campo in ("latitud", "longitud"):
+            if campo in datos:
+                try:
+                    datos[campo] = float(datos[campo])
+                except (ValueError, TypeError):
+                    raise ValueError(f"{campo} inválida")
+        if "activa" in datos:
+            datos["activa"] = _activa(datos["activa"])
+    
+    async def _registrar_edicion(self):
+        """Avisa a los demás workers (este ya actualizó su índice)"""
+        await self.revisiones.incrementar([CLAVE_REVISION])
+    
+    async def crear(self, datos: dict):
+        """Crea una sucursal y la agrega al índice sin recargar las demás"""
+        self._validar(datos)
+        datos.setdefault("activa", True)
+        id_sucursal = await self.repository.crear(datos)
+        datos["_id"] = id_sucursal
+        sucursal = serializar_sucursal(datos)
+        self._indexar(sucursal)
+        await self._registrar_edicion()
+        return sucursal
+    
+    async def actualizar(self, id_sucursal: str, datos: dict):
+        """Actualiza una sucursal y reubica solo esa entrada en el índice"""
+        datos.pop("_id", None)
+        self._validar(datos, parcial=True)
+        actualizada = await self.repository.actualizar(id_sucursal, datos)
+        if not actualizada:
+            return None
+        sucursal = serializar_sucursal(actualizada)
+        self._indexar(sucursal)
+        await self._registrar_edicion()
+        return sucursal
+    
+    async def eliminar(self, id_sucursal: str):
+        """Elimina una sucursal y la quita del índice"""
+        eliminada = await self.repository.eliminar(id_sucursal)
+        if eliminada:
+            self._desindexar(id_sucursal)
+            await self._registrar_edicion()
+        return eliminada
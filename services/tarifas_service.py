@@ -0,0 +1,156 @@
+"""
+Servicio de Tarifas de Envío
+Capa de lógica de negocio: compila las reglas de tarifas (tramos de distancia,
+recargos y envío gratis por monto) en una tabla de búsqueda ordenada
+"""
+import asyncio
+from bisect import bisect_left
+
+from repositories.tarifas_repository import TarifasRepository
+
+# NumPy es opcional: solo se usa para evaluar lotes de distancias
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+INTERVALO_RECARGA_SEGUNDOS = 30  # Cada cuánto se revisa si las reglas cambiaron
+
+def validar_reglas(reglas: dict) -> dict:
+    """
+    Valida y normaliza reglas de tarifas. Formato:
+    {
+        "tramos": [{"hasta_km": float, "costo": int}, ...],
+        "costo_estandar": int,  # fuera de los tramos o sin distancia conocida
+        "recargos": [{"nombre": str, "monto": int, "activo": bool}, ...],
+        "envio_gratis_desde": int o None  # subtotal desde el cual el envío es gratis
+    }
+    Lanza ValueError si las reglas no son válidas.
+    """
+    try:
+        tramos = [
+            {"hasta_km": float(t["hasta_km"]), "costo": int(t["costo"])}
+            for t in reglas.get("tramos", [])
+        ]
+        costo_estandar = int(reglas["costo_estandar"])
+        recargos = [
+            {"nombre": r.get("nombre", ""), "monto": int(r["monto"]), "activo": bool(r.get("activo", True))}
+            for r in reglas.get("recargos", [])
+        ]
+        envio_gratis_desde = reglas.get("envio_gratis_desde")
+        if envio_gratis_desde is not None:
+            envio_gratis_desde = int(envio_gratis_desde)
+    except (KeyError, TypeError, ValueError, AttributeError):
+        raise ValueError("Reglas de tarifas inválidas")
+
+    tramos.sort(key=lambda t: t["hasta_km"])
+    limites = [t["hasta_km"] for t in tramos]
+    if any(l <= 0 for l in limites) or len(set(limites)) != len(limites):
+        raise ValueError("Los tramos deben tener distancias positivas y distintas")
+    if costo_estandar < 0 or any(t["costo"] < 0 for t in tramos) or any(r["monto"] < 0 for r in recargos):
+        raise ValueError("Los costos y recargos no pueden ser negativos")
+
+    return {
+        "tramos": tramos,
+        "costo_estandar": costo_estandar,
+        "recargos": recargos,
+        "envio_gratis_desde": envio_gratis_desde
+    }
+
+class TablaTarifas:
+    """
+    Reglas de tarifas compiladas: límites de tramo ordenados y costos finales
+    (con recargos ya sumados), de modo que cada evaluación es un bisect O(log n).
+    Es inmutable; al cambiar las reglas se compila una tabla nueva.
+    """
+
+    def __init__(self, reglas: dict, version: int = 0):
+        self.reglas = reglas
+        self.version = version
+        recargo = sum(r["monto"] for r in reglas["recargos"] if r["activo"])
+        # Los recargos solo se aplican a envíos que no son gratis
+        con_recargo = lambda costo: costo + recargo if costo > 0 else 0
+        self.limites = [t["hasta_km"] for t in reglas["tramos"]]
+        # El último elemento corresponde a "fuera de todos los tramos"
+        self.costos = [con_recargo(t["costo"]) for t in reglas["tramos"]]
+        self.costos.append(con_recargo(reglas["costo_estandar"]))
+        self.costo_estandar = self.costos[-1]
+        self.envio_gratis_desde = reglas["envio_gratis_desde"]
+        if np is not None:
+            self._limites_np = np.asarray(self.limites, dtype=np.float64)
+            self._costos_np = np.asarray(self.costos, dtype=np.int64)
+
+    def _gratis_por_monto(self, subtotal) -> bool:
+        return self.envio_gratis_desde is not None and subtotal is not None and subtotal >= self.envio_gratis_desde
+
+    def costo(self, distancia_km: float = None, subtotal: int = None) -> int:
+        """Costo de envío para una distancia (None = desconocida) y subtotal opcional"""
+        if self._gratis_por_monto(subtotal):
+            return 0
+        if distancia_km is None:
+            return self.costo_estandar
+        # El límite de cada tramo es inclusivo: distancia <= hasta_km
+        return self.costos[bisect_left(self.limites, distancia_km)]
+
+    def costos_lote(self, distancias):
+        """Versión vectorizada de costo(); las distancias NaN usan el costo estándar"""
+        # searchsorted ubica los NaN al final, es decir, en el costo estándar
+        return self._costos_np[np.searchsorted(self._limites_np, distancias, side="left")]
+
+class TarifasService:
+    """Servicio que mantiene la tabla de tarifas compilada y la recarga en caliente"""
+
+    def __init__(self, reglas_por_defecto: dict):
+        self.repository = TarifasRepository()
+        self.reglas_por_defecto = validar_reglas(reglas_por_defecto)
+        self.tabla = TablaTarifas(self.reglas_por_defecto)
+        self._tarea_recarga = None
+
+    def _compilar(self, documento):
+        """Compila un documento de reglas, o las reglas por defecto si no hay"""
+        if not documento:
+            self.tabla = TablaTarifas(self.reglas_por_defecto)
+            return
+        self.tabla = TablaTarifas(validar_reglas(documento), documento.get("version", 0))
+
+    async def cargar(self):
+        """Carga las reglas desde la base de datos y compila la tabla"""
+        self._compilar(await self.repository.obtener())
+
+    async def actualizar(self, reglas: dict) -> dict:
+        """Guarda nuevas reglas y recompila la tabla de inmediato"""
+        documento = await self.repository.guardar(validar_reglas(reglas))
+        self._compilar(documento)
+        return self.obtener_reglas()
+
+    async def verificar_cambios(self):
+        """Recompila si otro proceso cambió las reglas (compara solo la versión)"""
+        version = await self.repository.obtener_version()
+        if version is not None and version != self.tabla.version:
+            await self.cargar()
+
+    async def _recargar_periodicamente(self, intervalo: float):
+        while True:
+            await asyncio.sleep(intervalo)
+            try:
+                await self.verificar_cambios()
+            except Exception as e:
+                print(f"Error recargando tarifas de envío: {e}")
+
+    def iniciar_recarga_automatica(self, intervalo: float = INTERVALO_RECARGA_SEGUNDOS):
+        """Inicia la revisión periódica de cambios en las reglas"""
+        if self._tarea_recarga is None:
+            self._tarea_recarga = asyncio.create_task(self._recargar_periodicamente(intervalo))
+
+    async def detener_recarga_automatica(self):
+        if self._tarea_recarga is not None:
+            self._tarea_recarga.cancel()
+            try:
+                await self._tarea_recarga
+            except asyncio.CancelledError:
+                pass
+            self._tarea_recarga = None
+
+    def obtener_reglas(self) -> dict:
+        """Retorna las reglas vigentes y su versión"""
+        return {**self.tabla.reglas, "version": self.tabla.version}
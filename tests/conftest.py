@@ -0,0 +1,38 @@
+"""
+Configuración común de las pruebas
+Reemplaza las colecciones de repositories.database por colecciones de
+mongomock_motor antes de que se importen los repositorios (que las toman
+al importarse), así las pruebas corren sin un mongod.
+Requiere: pytest, pytest-asyncio y mongomock-motor.
+"""
+import os
+import sys
+
+import pytest_asyncio
+import mongomock.collection
+import mongomock_motor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import repositories.database as database
+
+def _sin_sort(metodo):
+    """mongomock no conoce el argumento sort que pymongo 4.11+ pasa en bulk_write"""
+    def envoltura(self, *args, sort=None, **kwargs):
+        return metodo(self, *args, **kwargs)
+    return envoltura
+
+mongomock.collection.BulkOperationBuilder.add_update = _sin_sort(mongomock.collection.BulkOperationBuilder.add_update)
+mongomock.collection.BulkOperationBuilder.add_replace = _sin_sort(mongomock.collection.BulkOperationBuilder.add_replace)
+
+database.client = mongomock_motor.AsyncMongoMockClient()
+database.db = database.client[database.MONGO_BASE]
+for _nombre in [n for n in vars(database) if n.endswith("_col")]:
+    setattr(database, _nombre, database.db[getattr(database, _nombre).name])
+
+@pytest_asyncio.fixture
+async def db():
+    """Base de datos vacía para cada prueba"""
+    for nombre in await database.db.list_collection_names():
+        await database.db.drop_collection(nombre)
+    yield database.db
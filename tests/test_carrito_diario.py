@@ -0,0 +1,264 @@
+"""
+Pruebas del diario del carrito: las mutaciones confirmadas sobreviven una
+caída del proceso y reproducir el diario es idempotente
+"""
+import json
+import os
+
+import pytest
+
+from repositories.database import carritos_col
+from services import carrito_service
+from services.carrito_service import CarritoService
+
+CORREO = "cliente@example.com"
+
+def _item(producto: str, cantidad: int = 1) -> dict:
+    return {"usuario_email": CORREO, "producto_id": producto, "nombre": producto, "precio": 1000,
+            "cantidad": cantidad}
+
+async def _en_base() -> list:
+    """Líneas del carrito persistido como (producto_id, cantidad), en orden"""
+    carrito = await carritos_col.find_one({"_id": CORREO})
+    return [(item["producto_id"], item["cantidad"]) for item in (carrito or {}).get("items", [])]
+
+def _caer(servicio: CarritoService):
+    """El proceso muere: no se escribe lo pendiente, el diario queda como está"""
+    servicio._diario.cerrar()
+
+def _quitar_ultima_marca(servicio: CarritoService):
+    """El proceso murió tras escribir el lote en MongoDB pero antes de marcarlo como escrito"""
+    ruta = servicio._diario.ruta
+    with open(ruta, encoding="utf-8") as archivo:
+        lineas = archivo.readlines()
+    assert "escrito" in json.loads(lineas[-1])
+    with open(ruta, "w", encoding="utf-8") as archivo:
+        archivo.writelines(lineas[:-1])
+
+async def _reiniciar(ruta: str) -> CarritoService:
+    servicio = CarritoService(ruta_diario=ruta)
+    await servicio.iniciar()
+    await servicio.detener()
+    return servicio
+
+@pytest.fixture
+def ruta(tmp_path):
+    return str(tmp_path / "carrito.jsonl")
+
+@pytest.mark.asyncio
+async def test_mutaciones_confirmadas_sobreviven_una_caida_antes_del_lote(db, ruta):
+    servicio = CarritoService(ruta_diario=ruta)
+    arroz = await servicio.agregar_item(_item("arroz", 2))
+    cafe = await servicio.agregar_item(_item("cafe"))
+    await servicio.escribir_pendientes()
+    await servicio.cambiar_cantidad(str(arroz), 3, CORREO)
+    await servicio.eliminar_item(str(cafe), CORREO)
+    await servicio.agregar_item(_item("te", 4))
+    _caer(servicio)
+    assert await _en_base() == [("arroz", 2), ("cafe", 1)]
+
+    reiniciado = await _reiniciar(ruta)
+
+    assert await _en_base() == [("arroz", 5), ("te", 4)]
+    assert reiniciado.contadores["reproducidas"] == 3
+    assert reiniciado._diario.leer() == []
+
+@pytest.mark.asyncio
+async def test_reproducir_un_lote_ya_escrito_no_duplica_efectos(db, ruta):
+    servicio = CarritoService(ruta_diario=ruta)
+    arroz = await servicio.agregar_item(_item("arroz", 2))
+    await servicio.escribir_pendientes()
+    await servicio.cambiar_cantidad(str(arroz), 1, CORREO)
+    await servicio.agregar_item(_item("cafe"))
+    await servicio.agregar_item(_item("arroz", 2))  # Misma línea: suma la cantidad
+    await servicio.escribir_pendientes()
+    _quitar_ultima_marca(servicio)
+    _caer(servicio)
+
+    await _reiniciar(ruta)
+
+    assert await _en_base() == [("arroz", 5), ("cafe", 1)]
+
+@pytest.mark.asyncio
+async def test_reproducir_vaciar_no_borra_lo_que_otro_proceso_agrego_despues(db, ruta):
+    servicio = CarritoService(ruta_diario=ruta)
+    await servicio.agregar_item(_item("arroz"))
+    await servicio.escribir_pendientes()
+    await servicio.vaciar_carrito(CORREO)
+    await servicio.escribir_pendientes()
+    _quitar_ultima_marca(servicio)
+    _caer(servicio)
+
+    otro_proceso = CarritoService(ruta_diario=None)
+    await otro_proceso.agregar_item(_item("cafe", 2))
+    await otro_proceso.escribir_pendientes()
+
+    await _reiniciar(ruta)
+
+    assert await _en_base() == [("cafe", 2)]
+
+@pytest.mark.asyncio
+async def test_vaciar_y_volver_a_agregar_en_el_mismo_lote(db):
+    servicio = CarritoService(ruta_diario=None)
+    await servicio.agregar_item(_item("arroz", 2))
+    await servicio.escribir_pendientes()
+
+    await servicio.vaciar_carrito(CORREO)
+    await servicio.agregar_item(_item("arroz", 4))
+    await servicio.escribir_pendientes()
+
+    assert await _en_base() == [("arroz", 4)]
+
+@pytest.mark.asyncio
+async def test_cada_lote_solo_agrega_lineas_al_diario(db, ruta, monkeypatch):
+    reescrituras = []
+    reescribir = carrito_service.DiarioCarrito.reescribir
+    monkeypatch.setattr(carrito_service.DiarioCarrito, "reescribir",
+                        lambda diario, entradas: reescrituras.append(len(entradas)) or reescribir(diario, entradas))
+    servicio = CarritoService(ruta_diario=ruta)
+
+    for producto in ("arroz", "cafe", "te"):
+        await servicio.agregar_item(_item(producto))
+        await servicio.escribir_pendientes()
+
+    assert reescrituras == []
+    assert [e for e in servicio._diario.leer() if "escrito" in e] == [{"escrito": 1}, {"escrito": 2}, {"escrito": 3}]
+
+@pytest.mark.asyncio
+async def test_diario_se_compacta_al_superar_el_maximo(db, ruta, monkeypatch):
+    monkeypatch.setattr(carrito_service, "MAX_LINEAS_DIARIO", 5)
+    servicio = CarritoService(ruta_diario=ruta)
+
+    for producto in ("arroz", "cafe", "te"):
+        await servicio.agregar_item(_item(producto))
+        await servicio.escribir_pendientes()
+    await servicio.agregar_item(_item("pan"))
+
+    entradas = servicio._diario.leer()
+    agregados = [e["item"]["producto_id"] for e in entradas if e.get("tipo") == "agregar"]
+    assert agregados == ["te", "pan"]  # Lo anterior a la compactación ya no está
+    assert [[op["item"]["producto_id"] for op in lote] for lote in carrito_service.lotes_del_diario(entradas)] == [["pan"]]
+
+@pytest.mark.asyncio
+async def test_item_solo_guarda_campos_conocidos_y_cantidades_acotadas(db):
+    servicio = CarritoService(ruta_diario=None)
+    with pytest.raises(ValueError):
+        await servicio.agregar_item(_item("arroz", 10 ** 20))
+    with pytest.raises(ValueError):
+        await servicio.agregar_item({**_item("arroz"), "precio": float("inf")})
+
+    arroz = await servicio.agregar_item({**_item("arroz", 998), "relleno": "x" * 1000})
+    await servicio.agregar_item(_item("arroz", 5))
+    assert (await servicio.cambiar_cantidad(str(arroz), 10 ** 30, CORREO))["cantidad"] == carrito_service.MAX_CANTIDAD_ITEM
+    await servicio.escribir_pendientes()
+
+    carrito = await carritos_col.find_one({"_id": CORREO})
+    assert set(carrito["items"][0]) <= {"_id", "producto_id", "nombre", "precio", "imagen", "cantidad", "aplicadas"}
+    assert await _en_base() == [("arroz", carrito_service.MAX_CANTIDAD_ITEM)]
+
+def _rechazar_a(servicio: CarritoService, usuario: str):
+    """El repositorio falla como pymongo al codificar un entero de más de 8 bytes"""
+    aplicar = servicio.repository.aplicar_cambios
+
+    async def aplicar_cambios(cambios):
+        if any(cambio["usuario_email"] == usuario for cambio in cambios):
+            raise OverflowError("MongoDB can only handle up to 8-byte ints")
+        await aplicar(cambios)
+    servicio.repository.aplicar_cambios = aplicar_cambios
+
+@pytest.mark.asyncio
+async def test_cambios_que_nunca_se_podran_escribir_no_bloquean_a_los_demas(db):
+    servicio = CarritoService(ruta_diario=None)
+    _rechazar_a(servicio, "malo@example.com")
+    await servicio.agregar_item({**_item("arroz"), "usuario_email": "malo@example.com"})
+    await servicio.agregar_item(_item("cafe", 2))
+
+    await servicio.escribir_pendientes()
+
+    assert await _en_base() == [("cafe", 2)]
+    assert servicio.contadores["apartadas"] == 1
+    assert servicio.estadisticas()["pendientes"] == 0
+    assert await servicio.obtener_por_usuario("malo@example.com") == []  # Se relee de MongoDB
+
+@pytest.mark.asyncio
+async def test_una_operacion_invalida_en_el_diario_no_impide_iniciar(db, ruta):
+    servicio = CarritoService(ruta_diario=ruta)
+    await servicio.agregar_item({**_item("arroz"), "usuario_email": "malo@example.com"})
+    await servicio.agregar_item(_item("cafe", 2))
+    _caer(servicio)
+
+    reiniciado = CarritoService(ruta_diario=ruta)
+    _rechazar_a(reiniciado, "malo@example.com")
+    await reiniciado.iniciar()
+    await reiniciado.detener()
+
+    assert await _en_base() == [("cafe", 2)]
+    assert (reiniciado.contadores["reproducidas"], reiniciado.contadores["apartadas"]) == (1, 1)
+    assert reiniciado._diario.leer() == []
+
+def _diario_de_otro_proceso(ruta: str, pid: int, *productos: str) -> carrito_service.DiarioCarrito:
+    """Diario de otro proceso con un item agregado (sin escribir) por producto"""
+    otro = CarritoService(ruta_diario=None)
+    diario = carrito_service.DiarioCarrito(f"{ruta}.{pid}")
+    for producto in productos:
+        diario.anotar({"tipo": "agregar", "item": {**_item(producto), "_id": str(carrito_service.ObjectId())},
+                       "id": f"{otro._epoca}-{producto}", "u": CORREO})
+    return diario
+
+@pytest.mark.asyncio
+async def test_cada_proceso_tiene_su_diario_y_se_reproducen_solo_los_huerfanos(db, ruta):
+    vivo = _diario_de_otro_proceso(ruta, 1, "te")  # Sigue abierto: su proceso corre
+    muerto = _diario_de_otro_proceso(ruta, 2, "cafe")
+    muerto.cerrar()
+
+    reiniciado = await _reiniciar(ruta)
+
+    assert reiniciado._diario.ruta == f"{ruta}.{os.getpid()}"
+    assert await _en_base() == [("cafe", 1)]
+    assert not os.path.exists(muerto.ruta)
+    assert [e["item"]["producto_id"] for e in vivo.leer()] == ["te"]
+    vivo.cerrar()
+
+@pytest.mark.asyncio
+async def test_un_diario_que_no_se_pudo_reproducir_queda_para_el_siguiente_inicio(db, ruta):
+    _diario_de_otro_proceso(ruta, 2, "cafe").cerrar()
+    fallido = CarritoService(ruta_diario=ruta)
+
+    async def sin_conexion(cambios):
+        raise ConnectionError("MongoDB no responde")
+    fallido.repository.aplicar_cambios = sin_conexion
+    await fallido.iniciar()
+    await fallido.detener()
+    assert os.path.exists(f"{ruta}.2")
+
+    await _reiniciar(ruta)
+
+    assert await _en_base() == [("cafe", 1)]
+
+@pytest.mark.asyncio
+async def test_compactar_el_diario_no_toca_el_de_otro_proceso(db, ruta, monkeypatch):
+    monkeypatch.setattr(carrito_service, "MAX_LINEAS_DIARIO", 2)
+    otro = _diario_de_otro_proceso(ruta, 1, "te")
+    servicio = CarritoService(ruta_diario=ruta)
+    await servicio.agregar_item(_item("arroz"))
+    await servicio.escribir_pendientes()
+    await servicio.vaciar_carrito()
+
+    assert [e["item"]["producto_id"] for e in otro.leer()] == ["te"]
+    otro.cerrar()
+
+@pytest.mark.asyncio
+async def test_la_copia_en_memoria_expira_por_tiempo_de_carga_aunque_se_use(db, monkeypatch):
+    reloj = [1000.0]
+    monkeypatch.setattr(carrito_service.time, "monotonic", lambda: reloj[0])
+    servicio = CarritoService(ruta_diario=None)
+    assert await servicio.obtener_por_usuario(CORREO) == []
+    otro_worker = CarritoService(ruta_diario=None)
+    await otro_worker.agregar_item(_item("cafe"))
+    await otro_worker.escribir_pendientes()
+
+    for _ in range(3):  # Lecturas continuas no renuevan la copia
+        reloj[0] += carrito_service.TTL_ESTADO / 2 - 1
+        await servicio.obtener_por_usuario(CORREO)
+
+    assert [item["producto_id"] for item in await servicio.obtener_por_usuario(CORREO)] == ["cafe"]
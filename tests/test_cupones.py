@@ -0,0 +1,33 @@
+"""
+Pruebas de las fechas de los cupones: con y sin zona horaria se comparan
+como instantes
+"""
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from services.cupones_service import CuponesService, validar_cupon
+
+def _cupon(**fechas) -> dict:
+    return {"codigo": "VERANO", "tipo": "percent", "valor": 10, **fechas}
+
+def test_cupon_con_fecha_en_utc_se_evalua_sin_error():
+    servicio = CuponesService([_cupon(expiracion="2999-01-01T00:00:00Z")])
+    assert servicio.obtener("verano").codigo == "VERANO"
+
+    vencido = CuponesService([_cupon(expiracion="2000-01-01T00:00:00Z")])
+    assert vencido.obtener("verano") is None
+
+def test_fechas_sin_zona_son_hora_local():
+    manana = (datetime.now() + timedelta(days=1)).replace(microsecond=0)
+    cupon = validar_cupon(_cupon(expiracion=manana.isoformat()))
+    assert datetime.fromisoformat(cupon["expiracion"]) == manana.astimezone(timezone.utc)
+    assert CuponesService([_cupon(expiracion=manana.isoformat())]).obtener("VERANO") is not None
+
+def test_inicio_y_expiracion_se_comparan_como_instantes():
+    # Como texto inicio >= expiracion (y se rechazaba), pero 10:00 +05:00 es anterior a 08:00 UTC
+    cupon = validar_cupon(_cupon(inicio="2027-01-01T10:00:00+05:00", expiracion="2027-01-01T08:00:00+00:00"))
+    assert cupon["inicio"] == "2027-01-01T05:00:00+00:00"
+
+    with pytest.raises(ValueError):
+        validar_cupon(_cupon(inicio="2027-01-01T08:00:00+00:00", expiracion="2027-01-01T10:00:00+05:00"))
@@ -0,0 +1,38 @@
+"""
+Pruebas de la lectura de CSV en streaming: una fila continúa en la línea
+siguiente solo si un campo entre comillas quedó abierto
+"""
+import pytest
+
+from services.formatos import registros
+
+async def _bloques(texto: str):
+    yield texto.encode("utf-8")
+
+async def _leer(texto: str) -> list:
+    return [resultado async for resultado in registros(_bloques(texto), "csv")]
+
+@pytest.mark.asyncio
+async def test_comillas_dentro_de_un_campo_sin_comillas_son_texto():
+    filas = await _leer('nombre,precio\nPizza 12" familiar,1000\nBebida,900\n')
+
+    assert filas == [
+        (2, {"nombre": 'Pizza 12" familiar', "precio": "1000"}, None),
+        (3, {"nombre": "Bebida", "precio": "900"}, None),
+    ]
+
+@pytest.mark.asyncio
+async def test_campo_entre_comillas_continua_en_la_linea_siguiente():
+    filas = await _leer('nombre,precio\n"Pizza ""grande""\nfamiliar",1000\nBebida,900\n')
+
+    assert filas == [
+        (2, {"nombre": 'Pizza "grande"\nfamiliar', "precio": "1000"}, None),
+        (4, {"nombre": "Bebida", "precio": "900"}, None),
+    ]
+
+@pytest.mark.asyncio
+async def test_comillas_sin_cerrar_al_final_son_un_error():
+    filas = await _leer('nombre,precio\nBebida,900\n"Pizza,1000\n')
+
+    assert filas[0] == (2, {"nombre": "Bebida", "precio": "900"}, None)
+    assert filas[1] == (3, None, "CSV inválido: comillas sin cerrar")
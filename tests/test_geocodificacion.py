@@ -0,0 +1,70 @@
+"""
+Pruebas de la geocodificación: las llamadas concurrentes para una misma
+dirección deben compartir una sola consulta a Nominatim (single-flight)
+"""
+import asyncio
+
+import pytest
+import pytest_asyncio
+
+from services import envio_service
+from services.resiliencia import LimitadorTasa, CircuitBreaker
+from benchmarks.carga.nominatim_falso import NominatimFalso
+
+CONCURRENTES = 20
+
+@pytest_asyncio.fixture
+async def nominatim(db, monkeypatch):
+    """Nominatim falso local con latencia suficiente para que las llamadas se solapen"""
+    servidor = NominatimFalso(latencia=0.2)
+    await servidor.iniciar()
+    monkeypatch.setattr(envio_service, "NOMINATIM_URL", servidor.url)
+    # Límite y circuito nuevos: el estado de otras pruebas no debe hacer esperar ni abrir el circuito
+    monkeypatch.setattr(envio_service, "limitador_nominatim", LimitadorTasa(tasa=1, max_espera=1.0))
+    monkeypatch.setattr(envio_service, "circuito_nominatim", CircuitBreaker(umbral_fallos=5, enfriamiento=30))
+    envio_service.geocache.limpiar_memoria()
+    await envio_service.iniciar_cliente_http()
+    yield servidor
+    await envio_service.cerrar_cliente_http()
+    await servidor.detener()
+
+@pytest.mark.asyncio
+async def test_llamadas_concurrentes_hacen_una_sola_solicitud(nominatim):
+    resultados = await asyncio.gather(*(
+        envio_service.geocodificar_direccion("Av. Providencia 1234, Santiago")
+        for _ in range(CONCURRENTES)
+    ))
+
+    assert nominatim.solicitudes == 1
+    assert resultados[0] is not None
+    assert all(r == resultados[0] for r in resultados)
+    assert envio_service._geocodificaciones_en_curso == {}
+
+@pytest.mark.asyncio
+async def test_variantes_de_la_misma_direccion_comparten_la_solicitud(nominatim):
+    variantes = ["Av. Providencia 1234", "av providencia 1234", "  AV. PROVIDENCIA   1234 "]
+    await asyncio.gather(*(envio_service.geocodificar_direccion(v) for v in variantes * 5))
+
+    assert nominatim.solicitudes == 1
+
+@pytest.mark.asyncio
+async def test_cancelar_una_llamada_no_cancela_las_demas(nominatim):
+    tareas = [
+        asyncio.ensure_future(envio_service.geocodificar_direccion("Los Leones 500"))
+        for _ in range(5)
+    ]
+    await asyncio.sleep(0.05)
+    tareas[0].cancel()
+    resultados = await asyncio.gather(*tareas[1:])
+
+    assert nominatim.solicitudes == 1
+    assert all(r is not None for r in resultados)
+
+@pytest.mark.asyncio
+async def test_direccion_ya_resuelta_no_vuelve_a_consultar(nominatim):
+    primera = await envio_service.geocodificar_direccion("Apoquindo 3000")
+    envio_service.geocache.limpiar_memoria()  # Obliga a leer la caché persistente
+    segunda = await envio_service.geocodificar_direccion("Apoquindo 3000")
+
+    assert nominatim.solicitudes == 1
+    assert segunda == primera
@@ -0,0 +1,46 @@
+"""
+Pruebas de la verificación de índices declarados contra los existentes
+"""
+import pytest
+from pymongo import ASCENDING
+
+from repositories import indices
+
+async def _crear_declarados(db):
+    """
+    Crea los índices declarados uno por uno con create_index: el
+    create_indexes de mongomock descarta partialFilterExpression
+    """
+    for coleccion, modelos in indices.INDICES.items():
+        for modelo in modelos:
+            opciones = {k: v for k, v in modelo.document.items() if k != "key"}
+            await db[coleccion].create_index(list(modelo.document["key"].items()), **opciones)
+
+@pytest.mark.asyncio
+async def test_indices_creados_no_se_reportan(db):
+    await _crear_declarados(db)
+
+    assert await indices.verificar_indices() == {}
+
+@pytest.mark.asyncio
+async def test_indice_faltante_se_reporta(db):
+    await _crear_declarados(db)
+    await db["cupones"].drop_index("codigo_1")
+
+    assert await indices.verificar_indices() == {"cupones": ["codigo_1"]}
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("coleccion, claves, opciones", [
+    ("cupones", [("codigo", ASCENDING)], {}),  # Sin unique
+    ("geocodificaciones", [("expiracion", ASCENDING)], {"expireAfterSeconds": 3600}),  # Otro TTL
+    ("geocodificaciones", [("expiracion", ASCENDING)], {}),  # Sin TTL
+    ("usuarios", [("rut", ASCENDING)], {"unique": True}),  # Sin filtro parcial
+    ("usuarios", [("rut", ASCENDING)], {"unique": True, "partialFilterExpression": {"rut": {"$exists": True}}}),
+])
+async def test_indice_con_otras_opciones_se_reporta(db, coleccion, claves, opciones):
+    await _crear_declarados(db)
+    nombre = "_".join(f"{campo}_{sentido}" for campo, sentido in claves)
+    await db[coleccion].drop_index(nombre)
+    await db[coleccion].create_index(claves, **opciones)
+
+    assert await indices.verificar_indices() == {coleccion: [nombre]}
@@ -0,0 +1,49 @@
+"""
+Pruebas del middleware de límites de peticiones
+"""
+import json
+
+import pytest
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+from starlette.testclient import TestClient
+
+from services.limites_peticiones import LimitesPeticiones, MiddlewareLimites, MAX_CUERPO_INSPECCIONADO
+
+RUTA = "/usuarios/login"
+
+async def _login(request: Request):
+    datos = await request.json()
+    return JSONResponse({"correo": datos.get("correo")})
+
+@pytest.fixture
+def cliente():
+    limitador = LimitesPeticiones({("POST", RUTA): {"ip": (100, 60), "usuario": (2, 60)}})
+    app = Starlette(routes=[Route(RUTA, _login, methods=["POST"])])
+    app.add_middleware(MiddlewareLimites, limitador=limitador)
+    with TestClient(app) as cliente:
+        cliente.limitador = limitador
+        yield cliente
+
+def test_limite_por_correo(cliente):
+    estados = [cliente.post(RUTA, json={"correo": "Ana@Example.com "}).status_code for _ in range(3)]
+
+    assert estados == [200, 200, 429]
+
+def test_el_cuerpo_llega_intacto_al_controlador(cliente):
+    respuesta = cliente.post(RUTA, json={"correo": "ana@example.com"})
+
+    assert respuesta.json() == {"correo": "ana@example.com"}
+
+def test_cuerpo_rellenado_no_salta_el_limite(cliente):
+    relleno = "x" * (MAX_CUERPO_INSPECCIONADO + 1)
+    for _ in range(2):
+        cliente.post(RUTA, json={"correo": "ana@example.com"})
+
+    respuesta = cliente.post(RUTA, content=json.dumps({"correo": "ana@example.com", "relleno": relleno}),
+                             headers={"content-type": "application/json"})
+
+    assert respuesta.status_code == 413
+    assert cliente.limitador.estadisticas()["endpoints"][f"POST {RUTA}"]["rechazadas_cuerpo"] == 1
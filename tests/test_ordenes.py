@@ -0,0 +1,175 @@
+"""
+Pruebas del checkout: creación, pago y cancelación de órdenes
+"""
+import threading
+from datetime import datetime
+
+import mongomock.collection
+import pytest
+import pytest_asyncio
+from bson import ObjectId
+
+from repositories.database import ordenes_col, usuarios_col
+from services.analitica_service import AnaliticaService
+from services.carrito_service import CarritoService
+from services.cupones_service import CuponesService
+from services.ordenes_service import OrdenesService
+
+CORREO = "cliente@example.com"
+
+@pytest_asyncio.fixture
+async def ordenes(db, tmp_path):
+    carrito = CarritoService(ruta_diario=str(tmp_path / "carrito.jsonl"))
+    await carrito.iniciar()
+    yield OrdenesService(carrito=carrito, analitica=AnaliticaService(), cupones=CuponesService([]))
+    await carrito.detener()
+
+async def _orden_antigua(**campos) -> str:
+    """Orden creada antes de que existiera el campo estado"""
+    orden = {"usuario_email": CORREO, "productos": [], "subtotal": 1000, "descuento": 0, "envio": 0,
+             "total": 1000, "fecha_creacion": datetime.now().isoformat(), **campos}
+    resultado = await ordenes_col.insert_one(orden)
+    return str(resultado.inserted_id)
+
+@pytest.mark.asyncio
+async def test_orden_sin_estado_aparece_como_pendiente_en_el_historial(ordenes):
+    orden_id = await _orden_antigua()
+    await _orden_antigua(estado="pagado")
+
+    pendientes, _ = await ordenes.listar(usuario_email=CORREO, estado="pendiente")
+
+    assert [o["_id"] for o in pendientes] == [orden_id]
+    assert pendientes[0]["estado"] == "pendiente"
+
+@pytest.mark.asyncio
+async def test_orden_sin_estado_se_puede_pagar(ordenes):
+    medio = ObjectId()
+    await usuarios_col.insert_one({"correo": CORREO, "medios_pago": [{"_id": medio}]})
+    orden_id = await _orden_antigua()
+
+    orden = await ordenes.pagar(orden_id, str(medio))
+
+    assert orden["estado"] == "pagado"
+    with pytest.raises(ValueError, match="ya está pagado"):
+        await ordenes.pagar(orden_id, str(medio))
+
+@pytest.mark.asyncio
+async def test_orden_sin_estado_se_puede_cancelar(ordenes):
+    orden_id = await _orden_antigua()
+
+    orden = await ordenes.cancelar(orden_id)
+
+    assert orden["estado"] == "cancelado"
+    with pytest.raises(ValueError, match="está cancelado"):
+        await ordenes.cancelar(orden_id)
+
+OPERACIONES_MONGO = ("find_one", "find", "aggregate", "insert_one", "insert_many", "update_one", "update_many",
+                     "replace_one", "delete_one", "delete_many", "find_one_and_update", "bulk_write")
+
+@pytest.fixture
+def operaciones(monkeypatch):
+    """Cuenta las operaciones sobre las colecciones (cada una es un viaje a la base)"""
+    contadas = []
+    anidada = threading.local()  # mongomock implementa unas operaciones con otras
+    for nombre in OPERACIONES_MONGO:
+        original = getattr(mongomock.collection.Collection, nombre)
+
+        def contar(self, *args, _original=original, _nombre=nombre, **kwargs):
+            if getattr(anidada, "activa", False):
+                return _original(self, *args, **kwargs)
+            contadas.append(f"{self.name}.{_nombre}")
+            anidada.activa = True
+            try:
+                return _original(self, *args, **kwargs)
+            finally:
+                anidada.activa = False
+
+        monkeypatch.setattr(mongomock.collection.Collection, nombre, contar)
+    return contadas
+
+async def _preparar_checkout(ordenes: OrdenesService) -> tuple:
+    """Usuario con un medio de pago y un item en el carrito ya escrito en la base"""
+    medio = ObjectId()
+    usuario = {"correo": CORREO, "medios_pago": [{"_id": medio}]}
+    await usuarios_col.insert_one(dict(usuario))
+    await ordenes.carrito.agregar_item({"usuario_email": CORREO, "producto_id": "p1", "nombre": "Arroz",
+                                        "precio": 1500, "cantidad": 2})
+    await ordenes.carrito.escribir_pendientes()
+    return usuario, medio
+
+@pytest.mark.asyncio
+async def test_viajes_por_checkout_sin_sesion(ordenes, operaciones):
+    _, medio = await _preparar_checkout(ordenes)
+    ordenes.carrito._estados.clear()  # Carrito frío: se lee de la base
+    operaciones.clear()
+
+    orden = await ordenes.crear_desde_carrito(CORREO, {"medio_pago_id": str(medio)})
+    creacion = sorted(operaciones)
+    operaciones.clear()
+    pagada = await ordenes.pagar(str(orden["_id"]), str(medio))
+
+    assert pagada["estado"] == "pagado"
+    # Usuario y carrito se leen en paralelo
+    assert creacion == ["carritos.find_one", "ordenes.insert_one", "usuarios.find_one"]
+    # El medio se verificó al crear: no se busca a su dueño
+    assert operaciones == ["ordenes.find_one_and_update", "ventas_resumen.bulk_write"]
+
+@pytest.mark.asyncio
+async def test_viajes_por_checkout_con_sesion(ordenes, operaciones):
+    usuario, medio = await _preparar_checkout(ordenes)
+    operaciones.clear()
+
+    orden = await ordenes.crear_desde_carrito(CORREO, {"medio_pago_id": str(medio)}, usuario)
+    await ordenes.pagar(str(orden["_id"]), str(medio), usuario=usuario)
+
+    # El carrito se lee de la base aunque esté en memoria: puede haber cambiado en otro worker
+    assert operaciones == ["carritos.find_one", "ordenes.insert_one", "ordenes.find_one_and_update",
+                           "ventas_resumen.bulk_write"]
+
+@pytest.mark.asyncio
+async def test_la_orden_incluye_lo_agregado_en_otro_worker(ordenes):
+    usuario, medio = await _preparar_checkout(ordenes)
+    await ordenes.carrito.obtener_por_usuario(CORREO)  # Copia en memoria al día
+    otro_worker = CarritoService(ruta_diario=None)
+    await otro_worker.agregar_item({"usuario_email": CORREO, "producto_id": "p2", "nombre": "Cafe",
+                                    "precio": 3000, "cantidad": 1})
+    await otro_worker.escribir_pendientes()
+
+    orden = await ordenes.crear_desde_carrito(CORREO, {"medio_pago_id": str(medio)}, usuario)
+
+    assert [producto["nombre"] for producto in orden["productos"]] == ["Arroz", "Cafe"]
+    assert orden["subtotal"] == 6000
+
+@pytest.mark.asyncio
+async def test_pagar_con_otro_medio_del_dueno(ordenes):
+    _, medio = await _preparar_checkout(ordenes)
+    otro = ObjectId()
+    await usuarios_col.update_one({"correo": CORREO}, {"$push": {"medios_pago": {"_id": otro}}})
+    orden = await ordenes.crear_desde_carrito(CORREO, {"medio_pago_id": str(medio)})
+
+    pagada = await ordenes.pagar(str(orden["_id"]), str(otro))
+
+    assert pagada["estado"] == "pagado"
+    assert pagada["medio_pago_id"] == otro
+
+@pytest.mark.asyncio
+async def test_pagar_con_medio_de_otro_usuario(ordenes):
+    _, medio = await _preparar_checkout(ordenes)
+    ajeno = ObjectId()
+    await usuarios_col.insert_one({"correo": "otro@example.com", "medios_pago": [{"_id": ajeno}]})
+    orden = await ordenes.crear_desde_carrito(CORREO, {"medio_pago_id": str(ajeno)})
+
+    with pytest.raises(ValueError, match="Medio de pago no válido"):
+        await ordenes.pagar(str(orden["_id"]), str(ajeno))
+    assert (await ordenes_col.find_one({"_id": orden["_id"]}))["estado"] == "pendiente"
+
+@pytest.mark.asyncio
+async def test_pagar_vacia_el_carrito(ordenes):
+    _, medio = await _preparar_checkout(ordenes)
+    orden = await ordenes.crear_desde_carrito(CORREO, {"medio_pago_id": str(medio)})
+
+    await ordenes.pagar(str(orden["_id"]), str(medio))
+    await ordenes.carrito.escribir_pendientes()
+    ordenes.carrito._estados.clear()
+
+    assert await ordenes.carrito.obtener_por_usuario(CORREO) == []
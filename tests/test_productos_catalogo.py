@@ -0,0 +1,47 @@
+"""
+Pruebas del catálogo de productos materializado en memoria
+"""
+import pytest
+
+from repositories.database import productos_col
+from services.productos_service import ProductosService
+
+def _cruzar_cargas_con_invalidacion(servicio: ProductosService):
+    """Hace que cada carga del catálogo se cruce con una escritura (invalidación)"""
+    obtener_todos = servicio.repository.obtener_todos
+
+    async def obtener_todos_e_invalidar(proyeccion=None):
+        productos = await obtener_todos(proyeccion)
+        servicio.invalidar_catalogo()
+        return productos
+
+    servicio.repository.obtener_todos = obtener_todos_e_invalidar
+
+@pytest.mark.asyncio
+async def test_obtener_por_id_usa_el_catalogo_en_memoria(db):
+    resultado = await productos_col.insert_one({"nombre": "Arroz", "precio": 1500, "categoria": "Despensa"})
+    servicio = ProductosService()
+
+    producto = await servicio.obtener_por_id(str(resultado.inserted_id))
+
+    assert producto["nombre"] == "Arroz"
+    assert servicio._catalogo_por_id is not None
+
+@pytest.mark.asyncio
+async def test_obtener_por_id_con_carga_cruzada_con_invalidacion(db):
+    resultado = await productos_col.insert_one({"nombre": "Arroz", "precio": 1500, "categoria": "Despensa"})
+    servicio = ProductosService()
+    _cruzar_cargas_con_invalidacion(servicio)
+
+    producto = await servicio.obtener_por_id(str(resultado.inserted_id))
+
+    assert servicio._catalogo_por_id is None
+    assert producto is not None and producto["nombre"] == "Arroz"
+
+@pytest.mark.asyncio
+async def test_obtener_por_id_inexistente_o_invalido_sin_catalogo(db):
+    servicio = ProductosService()
+    _cruzar_cargas_con_invalidacion(servicio)
+
+    assert await servicio.obtener_por_id("64b7f0000000000000000000") is None
+    assert await servicio.obtener_por_id("no-es-un-id") is None
@@ -0,0 +1,39 @@
+"""
+Pruebas de la paginación por cursor de GET /productos con valores de orden
+nulos (MongoDB trata igual los faltantes)
+"""
+import pytest
+
+from repositories.database import productos_col
+from services.productos_service import ProductosService
+
+PRODUCTOS = [
+    {"nombre": "Arroz", "precio": 1500, "categoria": "Despensa"},
+    {"nombre": "Bolsa", "precio": None, "categoria": "Despensa"},
+    {"nombre": "Café", "precio": None, "categoria": "Despensa"},
+    {"nombre": "Dulce", "precio": 800, "categoria": "Despensa"},
+    {"nombre": None, "precio": 800, "categoria": "Despensa"},
+    {"nombre": "Fideos", "precio": None, "categoria": "Despensa"},
+    {"nombre": "Galletas", "precio": 1200, "categoria": "Despensa"},
+]
+
+async def _recorrer(servicio: ProductosService, orden: str, limite: int) -> list:
+    ids, cursor = [], None
+    while True:
+        pagina, cursor = await servicio.buscar(orden=orden, limite=limite, cursor=cursor)
+        ids.extend(p["_id"] for p in pagina)
+        if cursor is None:
+            return ids
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("orden", ["precio_asc", "precio_desc", "nombre_asc", "nombre_desc", "recientes"])
+@pytest.mark.parametrize("limite", [1, 2, 3])
+async def test_paginas_cubren_todo_el_catalogo_con_nulos(db, orden, limite):
+    await productos_col.insert_many([dict(p) for p in PRODUCTOS])
+    servicio = ProductosService()
+
+    completo, _ = await servicio.buscar(orden=orden)
+    paginado = await _recorrer(servicio, orden, limite)
+
+    assert paginado == [p["_id"] for p in completo]
+    assert len(paginado) == len(PRODUCTOS)
@@ -0,0 +1,40 @@
+"""
+Pruebas de la importación masiva de productos
+"""
+import pytest
+from pymongo import InsertOne
+
+from repositories.database import productos_col
+from services.productos_service import ProductosService, operacion_importacion
+
+def _registro(precio) -> dict:
+    return {"nombre": "Arroz", "categoria": "Despensa", "precio": precio}
+
+@pytest.mark.parametrize("precio", [1500, 1500.0, "1500", " 1500.0 "])
+def test_precio_valido(precio):
+    operacion = operacion_importacion(_registro(precio))
+
+    assert isinstance(operacion, InsertOne)
+    assert operacion._doc["precio"] == 1500
+
+@pytest.mark.parametrize("precio", ["inf", "-inf", "nan", "1e400", float("inf"), float("nan"), 1e308 * 10])
+def test_precio_no_finito_es_un_error_de_validacion(precio):
+    with pytest.raises(ValueError, match="finito"):
+        operacion_importacion(_registro(precio))
+
+@pytest.mark.parametrize("precio", [-1, 10.5, "abc", None, True])
+def test_precio_invalido(precio):
+    with pytest.raises(ValueError):
+        operacion_importacion(_registro(precio))
+
+async def _registros(filas):
+    for linea, registro in enumerate(filas, start=1):
+        yield linea, registro, None
+
+@pytest.mark.asyncio
+async def test_fila_con_precio_infinito_no_interrumpe_la_importacion(db):
+    resumen = await ProductosService().importar(_registros([_registro(1000), _registro("inf"), _registro(2000)]))
+
+    assert resumen["insertados"] == 2
+    assert resumen["errores"] == [{"linea": 2, "error": "precio debe ser un número finito"}]
+    assert await productos_col.count_documents({}) == 2
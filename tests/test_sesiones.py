@@ -0,0 +1,64 @@
+"""
+Pruebas de la caché de usuarios de las sesiones con varios procesos
+(dos instancias de SesionesService sobre la misma base)
+"""
+import pytest
+import pytest_asyncio
+
+from repositories.database import usuarios_col
+from services.sesiones_service import SesionesService
+
+CORREO = "cliente@example.com"
+
+@pytest_asyncio.fixture
+async def workers(db):
+    await usuarios_col.insert_one({"correo": CORREO, "nombre": "Ana", "medios_pago": []})
+    procesos = [SesionesService(secreto="secreto-de-prueba") for _ in range(2)]
+    for proceso in procesos:
+        await proceso.cargar()
+    return procesos
+
+@pytest.mark.asyncio
+async def test_escritura_en_otro_proceso_descarta_el_usuario_cacheado(workers):
+    a, b = workers
+    assert (await b.obtener_usuario(CORREO))["nombre"] == "Ana"
+
+    await usuarios_col.update_one({"correo": CORREO}, {"$set": {"nombre": "Ana María"}})
+    await a.usuario_modificado(CORREO)
+    assert (await b.obtener_usuario(CORREO))["nombre"] == "Ana"  # Hasta la revisión periódica
+
+    await b.verificar_cambios()
+
+    assert (await b.obtener_usuario(CORREO))["nombre"] == "Ana María"
+
+@pytest.mark.asyncio
+async def test_escritura_con_documento_nuevo_lo_deja_en_la_cache_local(workers):
+    a, _ = workers
+    await usuarios_col.update_one({"correo": CORREO}, {"$set": {"nombre": "Ana María"}})
+
+    await a.usuario_modificado(CORREO, await usuarios_col.find_one({"correo": CORREO}))
+    await usuarios_col.delete_one({"correo": CORREO})
+
+    assert (await a.obtener_usuario(CORREO))["nombre"] == "Ana María"
+
+@pytest.mark.asyncio
+async def test_sin_cambios_la_cache_se_mantiene(workers):
+    _, b = workers
+    await b.obtener_usuario(CORREO)
+    await usuarios_col.delete_one({"correo": CORREO})
+
+    await b.verificar_cambios()
+
+    assert await b.obtener_usuario(CORREO) is not None
+
+@pytest.mark.asyncio
+async def test_revocacion_en_otro_proceso_invalida_el_token(workers):
+    a, b = workers
+    token = a.emitir(CORREO)
+    datos = b.verificar(token)
+
+    await a.revocar(datos)
+    await b.verificar_cambios()
+
+    with pytest.raises(ValueError, match="cerrada"):
+        b.verificar(token)
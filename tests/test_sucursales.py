@@ -0,0 +1,40 @@
+"""
+Pruebas de sucursales: las ediciones de un worker llegan al índice de los
+demás y `activa` se guarda como booleano
+"""
+import pytest
+
+from services.envio_service import calcular_distancia_haversine
+from services.sucursales_service import SucursalesService
+
+def _worker() -> SucursalesService:
+    return SucursalesService(distancia=calcular_distancia_haversine)
+
+SANTIAGO = {"nombre": "Centro", "latitud": -33.45, "longitud": -70.66}
+VALPARAISO = {"nombre": "Puerto", "latitud": -33.05, "longitud": -71.62}
+
+@pytest.mark.asyncio
+async def test_los_demas_workers_dejan_de_usar_una_sucursal_desactivada_o_eliminada(db):
+    editor, otro = _worker(), _worker()
+    centro = await editor.crear(dict(SANTIAGO))
+    puerto = await editor.crear(dict(VALPARAISO))
+    await otro.cargar()
+    assert otro.mas_cercana(-33.44, -70.65)[0]["_id"] == centro["_id"]
+
+    await editor.actualizar(centro["_id"], {"activa": "false"})
+    await otro.verificar_cambios()
+    assert otro.mas_cercana(-33.44, -70.65)[0]["_id"] == puerto["_id"]
+
+    await editor.eliminar(puerto["_id"])
+    await otro.verificar_cambios()
+    assert otro.mas_cercana(-33.44, -70.65) is None
+
+@pytest.mark.asyncio
+async def test_activa_se_convierte_a_booleano(db):
+    servicio = _worker()
+    assert (await servicio.crear({**SANTIAGO, "activa": "0"}))["activa"] is False
+    assert (await servicio.crear({**VALPARAISO, "activa": "true"}))["activa"] is True
+    assert [s["nombre"] for s in servicio.listar()] == ["Puerto"]
+
+    with pytest.raises(ValueError):
+        await servicio.crear({**SANTIAGO, "activa": "tal vez"})
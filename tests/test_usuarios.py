@@ -0,0 +1,37 @@
+"""
+Pruebas del registro de usuarios: dos registros simultáneos con el mismo
+correo o RUT no terminan en un error 500
+"""
+import pytest
+from fastapi.testclient import TestClient
+from pymongo.errors import DuplicateKeyError
+
+import main
+
+class _ColeccionConCarrera:
+    """Simula que otro registro insertó primero: las búsquedas no encuentran nada"""
+
+    def __init__(self, indice: dict):
+        self.indice = indice
+
+    async def find_one(self, filtro, *args, **kwargs):
+        return None
+
+    async def insert_one(self, documento, *args, **kwargs):
+        raise DuplicateKeyError("E11000 duplicate key error", 11000, {"keyPattern": self.indice})
+
+@pytest.mark.parametrize("indice, detalle", [
+    ({"correo": 1}, "El correo ya está registrado"),
+    ({"rut": 1}, "El RUT ya está registrado"),
+])
+def test_registro_simultaneo_responde_400(monkeypatch, indice, detalle):
+    async def hashear(password):
+        return "hash"
+    monkeypatch.setattr(main, "usuarios_col", _ColeccionConCarrera(indice))
+    monkeypatch.setattr(main.contrasenas_service, "hashear", hashear)
+    cliente = TestClient(main.app)
+
+    respuesta = cliente.post("/usuarios/registro", json={"correo": "a@example.com", "rut": "1-9", "password": "x"})
+
+    assert respuesta.status_code == 400
+    assert respuesta.json()["detail"] == detalle